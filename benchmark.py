@@ -0,0 +1,251 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import peak_rss_bytes
+from synthetic import SYNTHETIC_VERSION, SyntheticScale, generate_snapshot_files
+
+# Bump when the phases or the result format change: results of another version
+# are not compared.
+BENCHMARK_VERSION = 1
+SCALE_POINTS = {
+    "small": SyntheticScale(accounts=10, regions=2, tgws_per_region=1, vpcs_per_tgw=50),
+    "medium": SyntheticScale(accounts=50, regions=4, tgws_per_region=2, vpcs_per_tgw=250, tgw_peerings=8,
+                             vpc_peerings=200, dx_gateways=8),
+    "large": SyntheticScale(accounts=200, regions=8, tgws_per_region=2, vpcs_per_tgw=1000, tgw_peerings=24,
+                            vpc_peerings=2000, dx_gateways=32),
+}
+BACKENDS = ("networkx", "compact")
+DEFAULT_DATA_DIR = ".benchmark_data"
+DATA_MARKER = "synthetic.json"
+# A phase is reported as a regression when it is this much slower (or larger)
+# than in the baseline; phases faster than MIN_COMPARED_SECONDS are too noisy.
+DEFAULT_THRESHOLD = 0.2
+MIN_COMPARED_SECONDS = 0.05
+
+
+def prepare_data(data_dir, name, scale, seed):
+    """
+    Return the directory of the synthetic files of a scale point, generating them
+    unless they were already generated with the same scale, seed and generator.
+    """
+    scale_dir = os.path.join(data_dir, f"{name}-{seed}")
+    marker = {"version": SYNTHETIC_VERSION, "scale": scale._asdict(), "seed": seed}
+    try:
+        with open(os.path.join(scale_dir, DATA_MARKER)) as f:
+            if json.load(f) == marker:
+                return scale_dir
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(scale_dir, ignore_errors=True)
+    start = time.perf_counter()
+    counts = generate_snapshot_files(scale_dir, scale, seed)
+    with open(os.path.join(scale_dir, DATA_MARKER), "w") as f:
+        json.dump(marker, f)
+    print(f"Generated {name}: {counts['files']} files ({counts['bytes']} bytes) in {time.perf_counter() - start:.2f}s.")
+    return scale_dir
+
+
+def run_phases(dir_path, backend="networkx", workers=1, min_size=None):
+    """
+    Run the phases of a build of the .pb files of dir_path in this process and
+    return {phase: {"seconds", "peak_rss_bytes"}} plus the graph sizes. The peak
+    RSS is the process peak at the end of the phase, so it only grows; run each
+    scale point in a fresh process (see run_scale_point).
+    """
+    # Imported here so that the parent process of run_scale_point stays small.
+    from ingest import iter_file_records
+    from prot import discover_and_convert_files
+    from snapshot import MIN_COMPONENT_SIZE, build_topology, get_files
+
+    if min_size is None:
+        min_size = MIN_COMPONENT_SIZE
+    phases = {}
+    sizes = {}
+    work_dir = tempfile.mkdtemp(prefix="topology-benchmark-")
+
+    def record(phase, start):
+        phases[phase] = {"seconds": time.perf_counter() - start, "peak_rss_bytes": peak_rss_bytes()}
+
+    try:
+        start = time.perf_counter()
+        snapshots = []
+        for file_snapshots, _ in iter_file_records(get_files(dir_path, ".pb"), workers):
+            snapshots.extend(file_snapshots)
+        record("parse", start)
+
+        start = time.perf_counter()
+        net = build_topology(snapshots, backend)
+        del snapshots
+        record("build", start)
+        sizes["nodes"] = net.network.number_of_nodes()
+        sizes["edges"] = net.network.number_of_edges()
+
+        start = time.perf_counter()
+        sizes["drawn_nodes"] = len(net.components.nodes(min_size))
+        sizes["components"] = net.components.number_of_components()
+        record("components", start)
+
+        start = time.perf_counter()
+        sizes["grouped_nodes"] = net.grouped_view("account-region").to_networkx().number_of_nodes()
+        record("grouping", start)
+
+        start = time.perf_counter()
+        net.show(os.path.join(work_dir, "topology.html"), min_size)
+        record("render", start)
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            discover_and_convert_files(dir_path, os.path.join(work_dir, "export"), "ndjson", workers)
+        record("export", start)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {"phases": phases, "sizes": sizes}
+
+
+def run_scale_point(dir_path, backend="networkx", workers=1, min_size=None):
+    """
+    Run run_phases in a fresh (spawned) process, so that its peak RSS is the one
+    of this scale point alone.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_phases, dir_path, backend, workers, min_size).result()
+
+
+def _best_run(runs):
+    """
+    Merge repeated runs of a scale point: fastest time and lowest peak per phase.
+    """
+    result = runs[0]
+    for run in runs[1:]:
+        for phase, values in run["phases"].items():
+            best = result["phases"][phase]
+            best["seconds"] = min(best["seconds"], values["seconds"])
+            if best["peak_rss_bytes"] is not None:
+                best["peak_rss_bytes"] = min(best["peak_rss_bytes"], values["peak_rss_bytes"])
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Return the regressions of results against a baseline (both from run_benchmarks):
+    (scale point, backend, phase, metric, baseline value, value) for each metric
+    more than threshold (a fraction) above the baseline.
+    """
+    regressions = []
+    baseline_runs = {(run["scale"], run["backend"]): run for run in baseline.get("runs", [])}
+    for run in results["runs"]:
+        baseline_run = baseline_runs.get((run["scale"], run["backend"]))
+        if baseline_run is None:
+            continue
+        for phase, values in run["phases"].items():
+            baseline_values = baseline_run["phases"].get(phase)
+            if baseline_values is None:
+                continue
+            for metric in ("seconds", "peak_rss_bytes"):
+                before, after = baseline_values[metric], values[metric]
+                if before is None or after is None:
+                    continue
+                if metric == "seconds" and max(before, after) < MIN_COMPARED_SECONDS:
+                    continue
+                if after > before * (1 + threshold):
+                    regressions.append((run["scale"], run["backend"], phase, metric, before, after))
+    return regressions
+
+
+def run_benchmarks(scale_names, backends=BACKENDS, data_dir=DEFAULT_DATA_DIR, seed=0, workers=1, repeat=1):
+    """
+    Generate (or reuse) the synthetic files of each scale point and time the phases
+    of each backend on them. Return the JSON-serializable results.
+    """
+    runs = []
+    for name in scale_names:
+        scale = SCALE_POINTS[name]
+        dir_path = prepare_data(data_dir, name, scale, seed)
+        for backend in backends:
+            result = _best_run([run_scale_point(dir_path, backend, workers) for _ in range(repeat)])
+            runs.append({"scale": name, "backend": backend, **result})
+            phases = ", ".join(f"{phase} {values['seconds']:.2f}s" for phase, values in result["phases"].items())
+            peaks = [values["peak_rss_bytes"] for values in result["phases"].values() if values["peak_rss_bytes"] is not None]
+            peak = f"{max(peaks) / 2**20:.0f} MiB" if peaks else "unknown"
+            print(f"{name} {backend}: {result['sizes']['nodes']} nodes, {result['sizes']['edges']} edges; "
+                  f"{phases}; peak RSS {peak}.")
+    return {
+        "version": BENCHMARK_VERSION,
+        "synthetic_version": SYNTHETIC_VERSION,
+        "commit": _git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": seed,
+        "workers": workers,
+        "repeat": repeat,
+        "scales": {name: SCALE_POINTS[name]._asdict() for name in scale_names},
+        "runs": runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the topology build phases on synthetic estates of several sizes.")
+    parser.add_argument("--scales", dest="scales", choices=SCALE_POINTS, nargs="+", default=list(SCALE_POINTS),
+                        help="Scale points to run (see SCALE_POINTS).")
+    parser.add_argument("--backends", dest="backends", choices=BACKENDS, nargs="+", default=list(BACKENDS),
+                        help="Graph backends to run each scale point with.")
+    parser.add_argument("--data-dir", dest="data_dir", type=str, default=DEFAULT_DATA_DIR,
+                        help="Directory of the generated .pb files, reused between runs.")
+    parser.add_argument("--seed", dest="seed", type=int, default=0,
+                        help="Seed of the synthetic estates.")
+    parser.add_argument("--workers", dest="workers", type=int, default=1,
+                        help="Number of processes used to parse and export the .pb files (0 uses all CPU cores). "
+                             "The peak RSS does not include them.")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=1,
+                        help="Run each scale point this many times and keep the fastest time of each phase.")
+    parser.add_argument("--output", dest="output_file", type=str, default=None,
+                        help="Write the results as JSON to this file, e.g. to use as a baseline.")
+    parser.add_argument("--baseline", dest="baseline_file", type=str, default=None,
+                        help="Compare the results with a previous --output and exit with status 1 on regressions.")
+    parser.add_argument("--threshold", dest="threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Fraction above the baseline reported as a regression.")
+    args = parser.parse_args()
+    baseline = None
+    if args.baseline_file is not None:
+        with open(args.baseline_file) as f:
+            baseline = json.load(f)
+        if baseline.get("version") != BENCHMARK_VERSION or baseline.get("synthetic_version") != SYNTHETIC_VERSION:
+            print(f"{args.baseline_file} is from another benchmark or generator version, not comparing.")
+            baseline = None
+
+    results = run_benchmarks(args.scales, args.backends, args.data_dir, args.seed, args.workers, args.repeat)
+    if args.output_file is not None:
+        with open(args.output_file, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote the results to {args.output_file}.")
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, backend, phase, metric, before, after in regressions:
+            print(f"Regression: {name} {backend} {phase} {metric} {before:.3g} -> {after:.3g} ({after / before - 1:+.0%}).")
+        print(f"{len(regressions)} regressions against {args.baseline_file} (commit {baseline.get('commit')}).")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
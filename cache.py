@@ -0,0 +1,144 @@
+import hashlib
+import os
+import pickle
+import time
+
+# Bump when the format of the cached topology records changes.
+CACHE_VERSION = 4
+# Bump when the layout algorithms change.
+LAYOUT_CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = ".topology_cache"
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+class RecordCache:
+    """
+    On-disk cache of the topology records extracted from each snapshot file.
+    Entries are keyed by the file path and a variant naming the extraction options,
+    and invalidated when the file size or mtime changes.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, rebuild=False, max_age_days=DEFAULT_MAX_AGE_DAYS, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.rebuild = rebuild
+        self.max_age = max_age_days * 24 * 3600
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def fingerprint(file_path):
+        """
+        Return the fingerprint of a snapshot file: absolute path, size and mtime.
+        """
+        stat = os.stat(file_path)
+        return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+    def _entry_path(self, file_path, variant=""):
+        key = os.path.abspath(file_path)
+        if variant:
+            key = f"{key}\0{variant}"
+        key = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.pickle")
+
+    @staticmethod
+    def _is_entry(name):
+        """
+        Tell whether a file name of the cache directory is a records entry, named
+        by the SHA-1 of its key, and not e.g. a LayoutCache file.
+        """
+        stem, extension = os.path.splitext(name)
+        return extension == ".pickle" and len(stem) == 40 and all(c in "0123456789abcdef" for c in stem)
+
+    def get(self, file_path, variant="", fingerprint=None):
+        """
+        Return the cached records of a file, or None if missing or stale. fingerprint
+        is the current one of the file, taken if not given.
+        """
+        if self.rebuild:
+            return None
+        entry_path = self._entry_path(file_path, variant)
+        try:
+            with open(entry_path, "rb") as f:
+                version, entry_fingerprint, records = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+        if fingerprint is None:
+            fingerprint = self.fingerprint(file_path)
+        if version != CACHE_VERSION or entry_fingerprint != fingerprint:
+            return None
+        # The entry mtime tracks the last use for eviction.
+        os.utime(entry_path)
+        return records
+
+    def put(self, file_path, records, variant="", fingerprint=None):
+        """
+        Store the records of a file. fingerprint is the one of the file taken before
+        it was decoded: if the file changed while being decoded, the entry is stale.
+        It is taken now if not given.
+        """
+        if fingerprint is None:
+            fingerprint = self.fingerprint(file_path)
+        entry_path = self._entry_path(file_path, variant)
+        temp_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump((CACHE_VERSION, fingerprint, records), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, entry_path)
+
+    def evict(self):
+        """
+        Remove entries unused for more than max_age, then the least recently used
+        entries until the records fit in max_bytes. Return the number of removed entries.
+        Other files of the cache directory (layout caches) are left alone.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and self._is_entry(entry.name):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+
+class LayoutCache:
+    """
+    On-disk cache of the node positions computed by the layout module, keyed by a
+    hash of each connected component (nodes, levels, edges and layout method).
+    It lives in the records cache directory, in the file name.pickle, and only keeps
+    the components of the last saved layout.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, name="layout"):
+        self.path = os.path.join(cache_dir, f"{name}.pickle")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def load(self):
+        """
+        Return the cached positions by component key, empty if missing or stale.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                version, entries = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return {}
+        return entries if version == LAYOUT_CACHE_VERSION else {}
+
+    def save(self, entries):
+        """
+        Replace the cached positions.
+        """
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump((LAYOUT_CACHE_VERSION, entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
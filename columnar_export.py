@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import time
+import zipfile
+
+import numpy as np
+
+from cache import DEFAULT_CACHE_DIR, RecordCache
+from compact_graph import CompactGraph
+from snapshot import load_topology
+
+# Rows of each row group (Parquet) or column chunk (npz).
+ROW_GROUP_SIZE = 1 << 16
+COLUMNAR_FORMATS = ("parquet", "npz")
+
+# Columns of each table: (name, graph column or None for the node index, dictionary).
+# Dictionaries are the node id table ("node_ids") or the attribute string table ("strings").
+# title is the id of the attachment, association or connection an edge stands for.
+NODE_TABLE = (
+    ("id", None, "node_ids"),
+    ("resource_type", "resource_types", "strings"),
+    ("name", "names", "strings"),
+    ("account", "accounts", "strings"),
+    ("region", "regions", "strings"),
+)
+EDGE_TABLE = (
+    ("source", "edge_sources", "node_ids"),
+    ("target", "edge_targets", "node_ids"),
+    ("kind", "edge_kinds", "strings"),
+    ("title", "edge_titles", "strings"),
+)
+
+
+def _codes(graph, column, start, stop):
+    """
+    Return the dictionary codes of rows start:stop of a graph column as an int32
+    array, without copying the column. NO_VALUE (-1) is null.
+    """
+    if column is None:
+        return np.arange(start, stop, dtype=np.int32)
+    return np.frombuffer(getattr(graph, column), dtype=np.int32)[start:stop]
+
+
+def iter_row_groups(graph, table, row_group_size=ROW_GROUP_SIZE):
+    """
+    Yield the row groups of the node (NODE_TABLE) or edge (EDGE_TABLE) table of a
+    CompactGraph, as {column name: dictionary codes}.
+    """
+    row_count = graph.number_of_nodes() if table is NODE_TABLE else graph.number_of_edges()
+    for start in range(0, row_count, row_group_size):
+        stop = min(start + row_group_size, row_count)
+        yield {name: _codes(graph, column, start, stop) for name, column, _ in table}
+
+
+def _string_buffers(values):
+    """
+    Return the Arrow-style (offsets, UTF-8 data) arrays of a sequence of strings.
+    """
+    encoded = [value.encode() for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _write_array(archive, name, array):
+    with archive.open(f"{name}.npy", "w", force_zip64=True) as f:
+        np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+
+
+def write_npz_table(file_path, graph, table, row_group_size=ROW_GROUP_SIZE):
+    """
+    Write a table of a CompactGraph to an .npz archive: each column as int32 chunks
+    of dictionary codes ("<column>/<chunk>", -1 for null), then the dictionaries it
+    uses as Arrow-style offsets and UTF-8 data ("<dictionary>.offsets", ".data").
+    Return the number of rows.
+    """
+    rows = 0
+    with zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for chunk, row_group in enumerate(iter_row_groups(graph, table, row_group_size)):
+            for name, codes in row_group.items():
+                _write_array(archive, f"{name}/{chunk:06d}", codes)
+            rows += len(row_group[table[0][0]])
+        for dictionary in sorted({dictionary for _, _, dictionary in table}):
+            offsets, data = _string_buffers(getattr(graph, dictionary).values)
+            _write_array(archive, f"{dictionary}.offsets", offsets)
+            _write_array(archive, f"{dictionary}.data", data)
+        archive.writestr("columns.json", json.dumps({name: dictionary for name, _, dictionary in table}))
+    return rows
+
+
+def read_npz_table(file_path):
+    """
+    Read a table written by write_npz_table. Return {column: (codes, dictionary)}
+    where codes is an int32 array (-1 for null) and dictionary a list of strings.
+    """
+    with np.load(file_path, allow_pickle=False) as archive:
+        with zipfile.ZipFile(file_path) as names:
+            columns = json.loads(names.read("columns.json"))
+        dictionaries = {}
+        for dictionary in set(columns.values()):
+            offsets, data = archive[f"{dictionary}.offsets"], archive[f"{dictionary}.data"].tobytes()
+            dictionaries[dictionary] = [data[start:stop].decode() for start, stop in zip(offsets[:-1], offsets[1:])]
+        table = {}
+        for name, dictionary in columns.items():
+            chunks = sorted(key for key in archive.files if key.startswith(f"{name}/"))
+            codes = np.concatenate([archive[key] for key in chunks]) if chunks else np.zeros(0, dtype=np.int32)
+            table[name] = (codes, dictionaries[dictionary])
+    return table
+
+
+def write_parquet_table(file_path, graph, table, row_group_size=ROW_GROUP_SIZE):
+    """
+    Write a table of a CompactGraph to a Parquet file, one row group at a time, with
+    dictionary-encoded string columns (the node id column is plain). Needs pyarrow.
+    Return the number of rows.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    dictionary_type = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema([(name, pa.string() if column is None else dictionary_type) for name, column, _ in table])
+    rows = 0
+    with pq.ParquetWriter(file_path, schema) as writer:
+        for row_group in iter_row_groups(graph, table, row_group_size):
+            arrays = []
+            for name, column, dictionary in table:
+                values = getattr(graph, dictionary).values
+                codes = row_group[name]
+                if column is None:
+                    arrays.append(pa.array([values[code] for code in codes], type=pa.string()))
+                    continue
+                # Each row group carries only the dictionary entries it uses.
+                nulls = codes < 0
+                used, indices = np.unique(codes[~nulls], return_inverse=True)
+                group_indices = np.zeros(len(codes), dtype=np.int32)
+                group_indices[~nulls] = indices
+                arrays.append(pa.DictionaryArray.from_arrays(
+                    pa.array(group_indices, mask=nulls), pa.array([values[code] for code in used], type=pa.string())))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema), row_group_size=row_group_size)
+            rows += len(row_group[table[0][0]])
+    return rows
+
+
+def export_columns(net, output_dir, output_format="npz", row_group_size=ROW_GROUP_SIZE):
+    """
+    Write the nodes and edges of an AwsTopology as columnar tables, nodes.<format>
+    and edges.<format> in output_dir. Return the {table: row count}.
+    """
+    graph = net.network if net.compact else CompactGraph.from_networkx(net.network)
+    write = write_parquet_table if output_format == "parquet" else write_npz_table
+    os.makedirs(output_dir, exist_ok=True)
+    counts = {}
+    for name, table in (("nodes", NODE_TABLE), ("edges", EDGE_TABLE)):
+        file_path = os.path.join(output_dir, f"{name}.{output_format}")
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        counts[name] = write(temp_path, graph, table, row_group_size)
+        os.replace(temp_path, file_path)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the topology nodes and edges as columnar tables.")
+    parser.add_argument("--input_dir", dest="dir_path", type=str, required=True,
+                        help="Path to the directory containing .pb files, or a saved .topo topology file.")
+    parser.add_argument("--output_dir", dest="output_dir", type=str, required=True,
+                        help="Directory of the nodes and edges tables.")
+    parser.add_argument("--format", dest="output_format", choices=COLUMNAR_FORMATS, default="npz",
+                        help="npz (NumPy arrays of dictionary codes) or parquet (needs pyarrow).")
+    parser.add_argument("--row-group-size", dest="row_group_size", type=int, default=ROW_GROUP_SIZE,
+                        help="Number of rows written at once.")
+    parser.add_argument("--workers", dest="workers", type=int, default=1,
+                        help="Number of processes used to parse the .pb files (0 uses all CPU cores).")
+    parser.add_argument("--full-decode", dest="topology_only", action="store_false",
+                        help="Decode every snapshot field instead of only the topology ones.")
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, default=DEFAULT_CACHE_DIR,
+                        help="Directory of the per-file topology records cache.")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                        help="Do not read or write the records cache.")
+    args = parser.parse_args()
+    if args.output_format == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            print("Parquet output needs pyarrow (pip install pyarrow), or use --format npz.")
+            return
+    cache = RecordCache(args.cache_dir) if args.use_cache else None
+    net = load_topology(args.dir_path, args.workers, args.topology_only, cache=cache, backend="compact")
+    if net is None:
+        return
+    start = time.perf_counter()
+    counts = export_columns(net, args.output_dir, args.output_format, args.row_group_size)
+    print(f"Wrote {counts['nodes']} nodes and {counts['edges']} edges to {args.output_dir} in {time.perf_counter() - start:.2f}s.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+from array import array
+from collections import defaultdict
+
+import networkx as nx
+
+from styles import edge_attributes, node_attributes
+
+NO_VALUE = -1
+
+
+class StringTable:
+    """
+    Interned table of strings addressed by small integer codes.
+    """
+
+    def __init__(self, values=()):
+        self.values = []
+        self.codes = {}
+        for value in values:
+            self.code(value)
+
+    def code(self, value):
+        """
+        Return the code of value, adding it to the table if needed. None is NO_VALUE.
+        """
+        if value is None:
+            return NO_VALUE
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def value(self, code):
+        """
+        Return the string of a code, None for NO_VALUE.
+        """
+        return None if code == NO_VALUE else self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class CompactGraph:
+    """
+    Undirected graph storing node ids in an interned table, node attributes as
+    integer codes and edges as integer arrays. Presentation attributes (image,
+    shape, size, color...) are not stored; they are derived from the resource type
+    and edge kind by the styles module when converting to networkx.
+    Adding an existing node or edge updates it, like networkx.
+    """
+
+    def __init__(self):
+        self.node_ids = StringTable()
+        self.strings = StringTable()
+        self.resource_types = array('i')
+        self.names = array('i')
+        self.accounts = array('i')
+        self.regions = array('i')
+        self.edge_sources = array('i')
+        self.edge_targets = array('i')
+        self.edge_kinds = array('i')
+        self.edge_titles = array('i')
+        self._edge_index = {}
+        self._csr = None
+
+    # Construction
+
+    def add_node(self, node_id, resource_type=None, name=None, account=None, region=None):
+        """
+        Add a node or update its resource type and name; account and region are only
+        updated when given. Return the node index.
+        """
+        index = self._node_index(node_id)
+        self.resource_types[index] = self.strings.code(resource_type)
+        self.names[index] = self.strings.code(name)
+        if account and region:
+            self.accounts[index] = self.strings.code(account)
+            self.regions[index] = self.strings.code(region)
+        return index
+
+    def add_edge(self, source_id, target_id, kind=None, title=None):
+        """
+        Add an edge or update its kind and title, adding missing nodes without attributes.
+        """
+        source = self._node_index(source_id)
+        target = self._node_index(target_id)
+        key = (min(source, target) << 32) | max(source, target)
+        index = self._edge_index.get(key)
+        if index is None:
+            self._edge_index[key] = len(self.edge_sources)
+            self.edge_sources.append(source)
+            self.edge_targets.append(target)
+            self.edge_kinds.append(self.strings.code(kind))
+            self.edge_titles.append(self.strings.code(title))
+            self._csr = None
+        else:
+            self.edge_kinds[index] = self.strings.code(kind)
+            self.edge_titles[index] = self.strings.code(title)
+
+    def set_node(self, node_id, resource_type=None, name=None, account=None, region=None):
+        """
+        Add a node or replace all its attributes. Return the node index.
+        """
+        index = self._node_index(node_id)
+        self.resource_types[index] = self.strings.code(resource_type)
+        self.names[index] = self.strings.code(name)
+        self.accounts[index] = self.strings.code(account)
+        self.regions[index] = self.strings.code(region)
+        return index
+
+    def remove_edges_from(self, edges):
+        """
+        Remove the given (source, target) edges; missing edges are ignored.
+        """
+        codes = self.node_ids.codes
+        removed = set()
+        for source_id, target_id in edges:
+            source, target = codes.get(source_id), codes.get(target_id)
+            if source is not None and target is not None:
+                index = self._edge_index.get((min(source, target) << 32) | max(source, target))
+                if index is not None:
+                    removed.add(index)
+        if removed:
+            self._rebuild_edges(lambda index, source, target: index not in removed)
+
+    def remove_nodes_from(self, node_ids):
+        """
+        Remove the given nodes and their edges; missing nodes are ignored.
+        The remaining nodes are renumbered, keeping their order.
+        """
+        codes = self.node_ids.codes
+        removed = {codes[node_id] for node_id in node_ids if node_id in codes}
+        if not removed:
+            return
+        kept = [index for index in range(len(self.node_ids)) if index not in removed]
+        remap = array('i', [NO_VALUE]) * len(self.node_ids)
+        for new_index, index in enumerate(kept):
+            remap[index] = new_index
+        self.node_ids = StringTable(self.node_ids.values[index] for index in kept)
+        for name in ("resource_types", "names", "accounts", "regions"):
+            column = getattr(self, name)
+            setattr(self, name, array('i', (column[index] for index in kept)))
+        self._rebuild_edges(lambda index, source, target: remap[source] != NO_VALUE and remap[target] != NO_VALUE, remap)
+
+    def _rebuild_edges(self, keep, remap=None):
+        """
+        Keep the edges for which keep(index, source, target) is true, renumbering
+        their nodes with remap if given.
+        """
+        columns = (self.edge_sources, self.edge_targets, self.edge_kinds, self.edge_titles)
+        sources, targets, kinds, titles = (array('i') for _ in columns)
+        self._edge_index = {}
+        for index, (source, target, kind, title) in enumerate(zip(*columns)):
+            if not keep(index, source, target):
+                continue
+            if remap is not None:
+                source, target = remap[source], remap[target]
+            self._edge_index[(min(source, target) << 32) | max(source, target)] = len(sources)
+            sources.append(source)
+            targets.append(target)
+            kinds.append(kind)
+            titles.append(title)
+        self.edge_sources, self.edge_targets, self.edge_kinds, self.edge_titles = sources, targets, kinds, titles
+        self._csr = None
+
+    def _node_index(self, node_id):
+        index = self.node_ids.codes.get(node_id)
+        if index is None:
+            index = self.node_ids.code(node_id)
+            for column in (self.resource_types, self.names, self.accounts, self.regions):
+                column.append(NO_VALUE)
+            self._csr = None
+        return index
+
+    # Queries
+
+    def has_node(self, node_id):
+        return node_id in self.node_ids.codes
+
+    def has_edge(self, source_id, target_id):
+        codes = self.node_ids.codes
+        source, target = codes.get(source_id), codes.get(target_id)
+        if source is None or target is None:
+            return False
+        return (min(source, target) << 32) | max(source, target) in self._edge_index
+
+    def __contains__(self, node_id):
+        return self.has_node(node_id)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def number_of_nodes(self):
+        return len(self.node_ids)
+
+    def number_of_edges(self):
+        return len(self.edge_sources)
+
+    def _scan_tables(self):
+        """
+        Return the node ids and the string lookup used by full scans.
+        """
+        return self.node_ids.values, self.strings.value
+
+    def node_data(self, index):
+        """
+        Return the stored (non-presentation) attributes of a node index.
+        """
+        value = self.strings.value
+        return {
+            "resource_type": value(self.resource_types[index]),
+            "name": value(self.names[index]),
+            "account": value(self.accounts[index]),
+            "region": value(self.regions[index]),
+        }
+
+    def node_attributes(self, node_id):
+        """
+        Return the full attributes of a node, presentation included.
+        """
+        return self._node_attributes(node_id, self.node_ids.codes[node_id])
+
+    def _node_attributes(self, node_id, index):
+        if self.resource_types[index] == NO_VALUE:
+            return {}
+        return node_attributes(node_id, **self.node_data(index))
+
+    def nodes(self, data=False):
+        """
+        Iterate over node ids, or (node id, attributes) pairs with data=True.
+        """
+        if not data:
+            return iter(self.node_ids.values)
+        return ((node_id, self._node_attributes(node_id, index)) for index, node_id in enumerate(self.node_ids.values))
+
+    def edges(self, data=False):
+        """
+        Iterate over (source, target) pairs, or (source, target, attributes) with data=True.
+        """
+        ids, value = self._scan_tables()
+        for index in range(len(self.edge_sources)):
+            source = ids[self.edge_sources[index]]
+            target = ids[self.edge_targets[index]]
+            if data:
+                yield source, target, edge_attributes(value(self.edge_kinds[index]), value(self.edge_titles[index]))
+            else:
+                yield source, target
+
+    def node_records(self):
+        """
+        Iterate over (node id, resource type, name, account, region) tuples.
+        """
+        ids, value = self._scan_tables()
+        for node_id, resource_type, name, account, region in zip(ids, self.resource_types, self.names, self.accounts, self.regions):
+            yield node_id, value(resource_type), value(name), value(account), value(region)
+
+    def edge_records(self):
+        """
+        Iterate over (source id, target id, kind, title) tuples.
+        """
+        ids, value = self._scan_tables()
+        for source, target, kind, title in zip(self.edge_sources, self.edge_targets, self.edge_kinds, self.edge_titles):
+            yield ids[source], ids[target], value(kind), value(title)
+
+    def _adjacency(self):
+        """
+        Build (once per change) the CSR adjacency: offsets and neighbor node indices.
+        """
+        if self._csr is None:
+            node_count = len(self.node_ids)
+            offsets = array('i', [0]) * (node_count + 1)
+            for source, target in zip(self.edge_sources, self.edge_targets):
+                offsets[source + 1] += 1
+                offsets[target + 1] += 1
+            for index in range(node_count):
+                offsets[index + 1] += offsets[index]
+            neighbors = array('i', [0]) * offsets[node_count]
+            fill = array('i', offsets[:node_count])
+            for source, target in zip(self.edge_sources, self.edge_targets):
+                neighbors[fill[source]] = target
+                fill[source] += 1
+                neighbors[fill[target]] = source
+                fill[target] += 1
+            self._csr = (offsets, neighbors)
+        return self._csr
+
+    def neighbors(self, node_id):
+        """
+        Return the ids of the neighbors of a node.
+        """
+        offsets, neighbors = self._adjacency()
+        index = self.node_ids.codes[node_id]
+        ids = self.node_ids.values
+        return [ids[neighbor] for neighbor in neighbors[offsets[index]:offsets[index + 1]]]
+
+    def degree(self, node_id):
+        offsets, _ = self._adjacency()
+        index = self.node_ids.codes[node_id]
+        return offsets[index + 1] - offsets[index]
+
+    def component_indices(self):
+        """
+        Yield the connected components as lists of node indices.
+        """
+        offsets, neighbors = self._adjacency()
+        seen = bytearray(len(self.node_ids))
+        for start in range(len(self.node_ids)):
+            if seen[start]:
+                continue
+            seen[start] = 1
+            component = [start]
+            position = 0
+            while position < len(component):
+                index = component[position]
+                position += 1
+                for neighbor in neighbors[offsets[index]:offsets[index + 1]]:
+                    if not seen[neighbor]:
+                        seen[neighbor] = 1
+                        component.append(neighbor)
+            yield component
+
+    def connected_components(self):
+        """
+        Yield the connected components as sets of node ids, like networkx.
+        """
+        ids, _ = self._scan_tables()
+        for component in self.component_indices():
+            yield {ids[index] for index in component}
+
+    def subgraph(self, node_ids):
+        """
+        Return a new CompactGraph with the given nodes and the edges between them.
+        The subgraph shares the string table of this graph.
+        """
+        codes = self.node_ids.codes
+        return self.subgraph_indices([codes[node_id] for node_id in node_ids])
+
+    def subgraph_indices(self, indices):
+        """
+        Same as subgraph, from node indices (e.g. of component_indices).
+        """
+        subgraph = CompactGraph()
+        subgraph.strings = self.strings
+        remap = array('i', [NO_VALUE]) * len(self.node_ids)
+        for index in sorted(indices):
+            remap[index] = subgraph.node_ids.code(self.node_ids.values[index])
+            subgraph.resource_types.append(self.resource_types[index])
+            subgraph.names.append(self.names[index])
+            subgraph.accounts.append(self.accounts[index])
+            subgraph.regions.append(self.regions[index])
+        for index, (source, target) in enumerate(zip(self.edge_sources, self.edge_targets)):
+            source, target = remap[source], remap[target]
+            if source != NO_VALUE and target != NO_VALUE:
+                subgraph._edge_index[(min(source, target) << 32) | max(source, target)] = len(subgraph.edge_sources)
+                subgraph.edge_sources.append(source)
+                subgraph.edge_targets.append(target)
+                subgraph.edge_kinds.append(self.edge_kinds[index])
+                subgraph.edge_titles.append(self.edge_titles[index])
+        return subgraph
+
+    def group_nodes(self, attribute):
+        """
+        Group the node ids by "resource_type", "account" or "region".
+        Nodes without the attribute are grouped under None.
+        """
+        column = {"resource_type": self.resource_types, "account": self.accounts, "region": self.regions}[attribute]
+        groups = defaultdict(list)
+        for node_id, code in zip(self.node_ids.values, column):
+            groups[code].append(node_id)
+        return {self.strings.value(code): members for code, members in groups.items()}
+
+    @classmethod
+    def from_networkx(cls, graph):
+        """
+        Return the CompactGraph of a networkx.Graph built by AwsTopology.
+        """
+        compact = cls()
+        for node_id, data in graph.nodes(data=True):
+            compact.set_node(node_id, data.get("resource_type"), data.get("name"), data.get("account"), data.get("region"))
+        for source, target, data in graph.edges(data=True):
+            compact.add_edge(source, target, data.get("kind"), data.get("title"))
+        return compact
+
+    def to_networkx(self):
+        """
+        Convert to a networkx.Graph with the full presentation attributes.
+        """
+        graph = nx.Graph()
+        graph.add_nodes_from(self.nodes(data=True))
+        graph.add_edges_from(self.edges(data=True))
+        return graph
@@ -12,4 +12,14 @@ TGW_VPN_ATTACH_WIDTH = 1
 TGW_DIRECT_CONNECT_WIDTH=4
 VPC_VPN_EDGE_WIDTH = 1
 DIRECT_CONNECT_VPN_CONNECTION_WIDTH=2
-DIRECT_CONNECT_CONNECTION_GATEWAY_WIDTH=4
\ No newline at end of file
+DIRECT_CONNECT_CONNECTION_GATEWAY_WIDTH=4
+VIRTUAL_HUB_NODE_SIZE = 60
+VNET_NODE_SIZE = 20
+VIRTUAL_NETWORK_GATEWAY_NODE_SIZE = 10
+EXPRESS_ROUTE_NODE_SIZE = 50
+
+VNET_PEER_WIDTH = 2
+HUB_VNET_CONNECTION_WIDTH = 1
+VNET_GATEWAY_EDGE_WIDTH = 1
+EXPRESS_ROUTE_GATEWAY_HUB_WIDTH = 4
+EXPRESS_ROUTE_CONNECTION_WIDTH = 4
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: te/service/cm/v1/cm_snapshot_kafka.proto
+# Protobuf Python Version: 5.28.3
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    5,
+    28,
+    3,
+    '',
+    'te/service/cm/v1/cm_snapshot_kafka.proto'
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n(te/service/cm/v1/cm_snapshot_kafka.proto\x12\x10te.service.cm.v1\"`\n\x14SnapshotKafkaMessage\x12\x10\n\x03aid\x18\x01 \x01(\x09H\x00\x88\x01\x01\x12\x11\n\x04time\x18\x02 \x01(\x03H\x01\x88\x01\x01\x12\x12\n\npartitions\x18\x03 \x03(\x09B\x06\n\x04_aidB\x07\n\x05_timeB\"\n\x1ecom.thousandeyes.service.cm.v1P\x01b\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'te.service.cm.v1.cm_snapshot_kafka_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  _globals['DESCRIPTOR']._loaded_options = None
+  _globals['DESCRIPTOR']._serialized_options = b'\n\036com.thousandeyes.service.cm.v1P\001'
+  _globals['_SNAPSHOTKAFKAMESSAGE']._serialized_start=62
+  _globals['_SNAPSHOTKAFKAMESSAGE']._serialized_end=158
+# @@protoc_insertion_point(module_scope)
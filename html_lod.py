@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import time
+from collections import Counter, defaultdict
+
+from jinja2 import Environment
+
+from html_renderer import vis_edge, vis_node
+from html_shards import VIS_NETWORK_URL, read_manifest, write_if_changed, write_manifest
+from styles import cluster_node_attributes, edge_attributes, grouped_edge_attributes, node_attributes
+
+# How the leaf resources are collapsed into cluster nodes.
+LOD_MODES = ("account", "account-region", "tgw")
+# Leaf resources collapsed into clusters; hubs (TGWs, DX gateways, virtual hubs...)
+# are always drawn.
+CLUSTERED_RESOURCE_TYPES = frozenset((
+    "vpc",
+    "vnet",
+    "vpn-gateway",
+    "vpn-connection",
+    "virtual-network-gateway",
+    "direct-connect-connection",
+))
+CLUSTER_PREFIX = "cluster-"
+
+# The page draws the hubs, the clusters and the merged edges between them. Clicking
+# a cluster loads its members (a script calling topologyCluster) and replaces it
+# with them; their edges to nodes of clusters still collapsed go to the cluster.
+LOD_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Network topology</title>
+<script src="{{ vis_network_url }}"></script>
+<style>
+  body { margin: 0; }
+  #graph { width: 100%; height: 100vh; }
+</style>
+</head>
+<body>
+<div id="graph"></div>
+<script>
+  var clusters = {{ clusters }};
+  var nodes = new vis.DataSet({{ nodes }});
+  var edges = new vis.DataSet({{ edges }});
+  var loaded = {};
+  var pending = {};
+  var network = new vis.Network(document.getElementById("graph"), {nodes: nodes, edges: edges},
+                                {physics: {enabled: true, solver: "forceAtlas2Based"}});
+
+  function expand(clusterId) {
+    var cluster = loaded[clusterId];
+    var position = network.getPositions([clusterId])[clusterId] || {x: 0, y: 0};
+    edges.remove(edges.getIds({filter: function (edge) {
+      return edge.merged && (edge.from === clusterId || edge.to === clusterId);
+    }}));
+    nodes.remove(clusterId);
+    nodes.add(cluster.nodes.map(function (node) {
+      return Object.assign({x: position.x, y: position.y}, node);
+    }));
+    edges.update(cluster.edges.map(function (edge) {
+      var resolved = Object.assign({}, edge);
+      if (nodes.get(edge.to) === null) {
+        resolved.to = edge.cluster;
+      }
+      delete resolved.cluster;
+      return resolved;
+    }));
+    delete clusters[clusterId];
+  }
+
+  function topologyCluster(clusterId, clusterNodes, clusterEdges) {
+    loaded[clusterId] = {nodes: clusterNodes, edges: clusterEdges};
+    if (pending[clusterId]) {
+      delete pending[clusterId];
+      expand(clusterId);
+    }
+  }
+
+  network.on("click", function (params) {
+    var clusterId = params.nodes[0];
+    if (clusterId === undefined || !(clusterId in clusters)) {
+      return;
+    }
+    if (clusterId in loaded) {
+      expand(clusterId);
+      return;
+    }
+    pending[clusterId] = true;
+    var script = document.createElement("script");
+    script.src = clusters[clusterId];
+    document.body.appendChild(script);
+  });
+</script>
+</body>
+</html>
+"""
+
+
+def _edge_id(source, target):
+    return f"{source}|{target}" if source <= target else f"{target}|{source}"
+
+
+def assign_clusters(node_records, edge_records, mode="account"):
+    """
+    Return {node id: cluster id} of the leaf resources (CLUSTERED_RESOURCE_TYPES)
+    for a mode of LOD_MODES: by account, by account and region (the grouping of
+    get_acount_region_groupped_graph), or by the TGW they are attached to (the
+    first by id, resources without a TGW fall back to their account). Resources
+    that would be alone in their cluster, or without the attributes of their
+    cluster, are not clustered.
+    """
+    records = {record[0]: record for record in node_records}
+    tgw_of = {}
+    if mode == "tgw":
+        for source, target, _, _ in edge_records:
+            for node_id, other in ((source, target), (target, source)):
+                if records[other][1] == "tgw" and records[node_id][1] in CLUSTERED_RESOURCE_TYPES:
+                    if node_id not in tgw_of or other < tgw_of[node_id]:
+                        tgw_of[node_id] = other
+    cluster_of = {}
+    for node_id, resource_type, _, account, region in records.values():
+        if resource_type not in CLUSTERED_RESOURCE_TYPES:
+            continue
+        if node_id in tgw_of:
+            cluster_of[node_id] = f"cluster:{tgw_of[node_id]}"
+        elif mode == "account-region" and account and region:
+            cluster_of[node_id] = f"cluster:{account}:{region}"
+        elif mode != "account-region" and account:
+            cluster_of[node_id] = f"cluster:{account}"
+    sizes = Counter(cluster_of.values())
+    return {node_id: cluster_id for node_id, cluster_id in cluster_of.items() if sizes[cluster_id] > 1}
+
+
+def cluster_file_name(cluster_id):
+    return f"{CLUSTER_PREFIX}{hashlib.sha1(cluster_id.encode()).hexdigest()[:16]}.js"
+
+
+def render_cluster(cluster_id, node_records, edges):
+    """
+    Return the script of a cluster: a topologyCluster call with the vis.js nodes of
+    its members and their edges, each with the cluster of its far end ("cluster").
+    """
+    nodes = [vis_node(record[0], node_attributes(*record)) for record in sorted(node_records)]
+    vis_edges = []
+    for source, target, kind, title, far_cluster in sorted(edges, key=lambda edge: edge[:2]):
+        edge = vis_edge(source, target, edge_attributes(kind, title))
+        edge["id"] = _edge_id(source, target)
+        edge["cluster"] = far_cluster
+        vis_edges.append(edge)
+    arguments = ",".join(json.dumps(value, separators=(",", ":"), sort_keys=True) for value in (cluster_id, nodes, vis_edges))
+    return f"topologyCluster({arguments});\n"
+
+
+def write_lod_html(node_records, edge_records, output_file, mode="account", stats=None):
+    """
+    Write the level-of-detail page of a graph: hubs are drawn, leaf resources are
+    collapsed into cluster nodes (see assign_clusters) sized by their number of
+    members, and the edges between the same drawn nodes are merged. The members of
+    each cluster are written to a script of the <output>_clusters directory, loaded
+    and expanded when the cluster is clicked; only the scripts whose content
+    changed are rewritten. Render stats are added to stats if given.
+    """
+    start = time.perf_counter()
+    node_records = list(node_records)
+    edge_records = list(edge_records)
+    cluster_of = assign_clusters(node_records, edge_records, mode)
+
+    drawn_nodes = []
+    members = defaultdict(list)
+    for record in node_records:
+        cluster_id = cluster_of.get(record[0])
+        if cluster_id is None:
+            drawn_nodes.append(vis_node(record[0], node_attributes(*record)))
+        else:
+            members[cluster_id].append(record)
+
+    drawn_edges = []
+    merged = defaultdict(Counter)
+    cluster_edges = defaultdict(list)
+    for source, target, kind, title in edge_records:
+        source_cluster, target_cluster = cluster_of.get(source), cluster_of.get(target)
+        if source_cluster is None and target_cluster is None:
+            edge = vis_edge(source, target, edge_attributes(kind, title))
+            edge["id"] = _edge_id(source, target)
+            drawn_edges.append(edge)
+            continue
+        if source_cluster is not None:
+            cluster_edges[source_cluster].append((source, target, kind, title, target_cluster))
+        if target_cluster is not None and target_cluster != source_cluster:
+            cluster_edges[target_cluster].append((target, source, kind, title, source_cluster))
+        if source_cluster != target_cluster:
+            merged[tuple(sorted((source_cluster or source, target_cluster or target)))][kind] += 1
+    for (source, target), kinds in merged.items():
+        edge = vis_edge(source, target, grouped_edge_attributes(kinds))
+        edge["id"] = f"merged|{_edge_id(source, target)}"
+        edge["merged"] = True
+        drawn_edges.append(edge)
+
+    clusters_dir = f"{os.path.splitext(output_file)[0]}_clusters"
+    os.makedirs(clusters_dir, exist_ok=True)
+    previous = read_manifest(clusters_dir)
+    tgw_ids = {record[0] for record in node_records if record[1] == "tgw"}
+    hashes = {}
+    cluster_files = {}
+    written = cluster_bytes = 0
+    for cluster_id, records in members.items():
+        key = cluster_id[len("cluster:"):]
+        values = {"tgw": key} if key in tgw_ids else {"account": records[0][3], "region": records[0][4] if mode == "account-region" else None}
+        drawn_nodes.append(vis_node(cluster_id, cluster_node_attributes(cluster_id, Counter(record[1] for record in records), values)))
+        file_name = cluster_file_name(cluster_id)
+        content = render_cluster(cluster_id, records, cluster_edges[cluster_id]).encode()
+        _, hashes[file_name], cluster_written, cluster_size = write_if_changed(clusters_dir, file_name, content, previous.get(file_name))
+        written += cluster_written
+        cluster_bytes += cluster_size
+        cluster_files[cluster_id] = f"{os.path.basename(clusters_dir)}/{file_name}?{hashes[file_name][:16]}"
+    write_manifest(clusters_dir, hashes, previous, CLUSTER_PREFIX)
+
+    def script_json(value):
+        return json.dumps(value, sort_keys=True).replace("</", "<\\/")
+
+    page = Environment(autoescape=False).from_string(LOD_TEMPLATE).render(
+        vis_network_url=VIS_NETWORK_URL,
+        clusters=script_json(cluster_files),
+        nodes=script_json(drawn_nodes),
+        edges=script_json(drawn_edges),
+    )
+    temp_path = f"{output_file}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(page)
+        size = f.tell()
+    os.replace(temp_path, output_file)
+
+    if stats is not None:
+        stats["html_nodes"] += len(drawn_nodes)
+        stats["html_edges"] += len(drawn_edges)
+        stats["html_clusters"] += len(members)
+        stats["html_clusters_written"] += written
+        stats["html_bytes"] += size
+        stats["html_cluster_bytes"] += cluster_bytes
+        stats["html_seconds"] += time.perf_counter() - start
@@ -0,0 +1,192 @@
+import json
+import time
+
+from jinja2 import Environment, FileSystemLoader
+from jinja2.utils import htmlsafe_json_dumps
+from pyvis.network import Network
+
+from compact_graph import CompactGraph
+
+# Defaults applied by pyvis when converting a networkx graph.
+DEFAULT_NODE_COLOR = "#97c2fc"
+DEFAULT_NODE_SHAPE = "dot"
+DEFAULT_NODE_SIZE = 10
+DEFAULT_EDGE_WEIGHT = 1
+
+# Size of the buffered node/edge JSON written to the output file at once.
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+_NODES_MARKER = "\x00topology-nodes\x00"
+_EDGES_MARKER = "\x00topology-edges\x00"
+
+
+def _json(value):
+    """
+    Serialize like the jinja tojson filter used by the pyvis template.
+    """
+    return str(htmlsafe_json_dumps(value, dumps=json.dumps, sort_keys=True))
+
+
+def vis_node(node_id, data, position=None):
+    """
+    Return the vis.js node of a graph node, as pyvis from_nx builds it, fixed at
+    position (x, y) if given.
+    """
+    options = {key: value for key, value in data.items() if key not in ("label", "shape")}
+    color = options.pop("color", DEFAULT_NODE_COLOR)
+    if "group" not in options:
+        options["color"] = color
+    options["size"] = int(options.get("size", DEFAULT_NODE_SIZE))
+    options["id"] = node_id
+    options["label"] = data.get("label") or node_id
+    options["shape"] = data.get("shape", DEFAULT_NODE_SHAPE)
+    if position is not None:
+        options["x"], options["y"] = position
+    return options
+
+
+def vis_edge(source, target, data):
+    """
+    Return the vis.js edge of a graph edge, as pyvis from_nx builds it.
+    """
+    options = dict(data)
+    if "value" not in options or "width" not in options:
+        options["width"] = options.pop("weight", DEFAULT_EDGE_WEIGHT)
+    options["from"] = source
+    options["to"] = target
+    return options
+
+
+class _GraphItems:
+    """
+    Re-iterable view of the vis.js nodes or edges of a graph, generated on demand.
+    Nodes come in pyvis order: endpoints of the edges first, then isolated nodes.
+    """
+
+    def __init__(self, graph, edges=False, positions=None):
+        self.graph = graph
+        self.edges = edges
+        self.positions = positions or {}
+
+    def __len__(self):
+        return self.graph.number_of_edges() if self.edges else self.graph.number_of_nodes()
+
+    def __iter__(self):
+        if self.edges:
+            for source, target, data in self.graph.edges(data=True):
+                yield vis_edge(source, target, data)
+            return
+        # Attributes are looked up one node at a time: on the compact backend they
+        # are derived on demand and never all held at once.
+        if isinstance(self.graph, CompactGraph):
+            attributes = self.graph.node_attributes
+        else:
+            attributes = self.graph.nodes.__getitem__
+        seen = set()
+        for edge in self.graph.edges():
+            for node_id in edge:
+                if node_id not in seen:
+                    seen.add(node_id)
+                    yield vis_node(node_id, attributes(node_id), self.positions.get(node_id))
+        for node_id in self.graph.nodes():
+            if node_id not in seen:
+                yield vis_node(node_id, attributes(node_id), self.positions.get(node_id))
+
+
+class _ChunkedWriter:
+    """
+    Buffer strings and write them to a file in chunks of about chunk_size characters.
+    """
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.buffered = 0
+        self.chunks = 0
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.f.write("".join(self.buffer))
+            self.chunks += 1
+            self.buffer = []
+            self.buffered = 0
+
+
+def _stream_json_array(writer, items):
+    writer.write("[")
+    for index, item in enumerate(items):
+        if index:
+            writer.write(", ")
+        writer.write(_json(item))
+    writer.write("]")
+
+
+def _tojson(value):
+    if isinstance(value, _GraphItems):
+        return _EDGES_MARKER if value.edges else _NODES_MARKER
+    return _json(value)
+
+
+def write_html(graph, output_file, network=None, positions=None, chunk_size=DEFAULT_CHUNK_SIZE, stats=None):
+    """
+    Write the vis.js HTML page of a graph without building a pyvis network.
+    The page is rendered from the pyvis template with the options and menus of
+    network (a pyvis Network without nodes), while the node and edge JSON is
+    streamed from the graph to the file in chunks. graph is a networkx.Graph or
+    a CompactGraph. positions maps node ids to fixed (x, y) coordinates (see the
+    layout module). Render stats are added to stats if given.
+    """
+    start = time.perf_counter()
+    if network is None:
+        network = Network()
+    environment = Environment(loader=FileSystemLoader(network.template_dir))
+    environment.filters["tojson"] = _tojson
+    template = environment.get_template(network.path)
+
+    nodes = _GraphItems(graph, positions=positions)
+    edges = _GraphItems(graph, edges=True)
+    _, _, heading, height, width, options = network.get_network_data()
+    tooltip_link = any("href" in str(data.get("title") or "") for _, data in graph.nodes(data=True))
+
+    with open(output_file, "w") as f:
+        writer = _ChunkedWriter(f, chunk_size)
+        for text in template.generate(height=height,
+                                      width=width,
+                                      nodes=nodes,
+                                      edges=edges,
+                                      heading=heading,
+                                      options=options,
+                                      physics_enabled=network.options.physics.enabled,
+                                      use_DOT=network.use_DOT,
+                                      dot_lang=network.dot_lang,
+                                      widget=network.widget,
+                                      bgcolor=network.bgcolor,
+                                      conf=network.conf,
+                                      tooltip_link=tooltip_link,
+                                      neighborhood_highlight=network.neighborhood_highlight,
+                                      select_menu=network.select_menu,
+                                      filter_menu=network.filter_menu,
+                                      notebook=True,
+                                      cdn_resources=network.cdn_resources):
+            for marker, items in ((_NODES_MARKER, nodes), (_EDGES_MARKER, edges)):
+                while marker in text:
+                    before, text = text.split(marker, 1)
+                    writer.write(before)
+                    _stream_json_array(writer, items)
+            writer.write(text)
+        writer.flush()
+        size = f.tell()
+
+    if stats is not None:
+        stats["html_nodes"] += len(nodes)
+        stats["html_edges"] += len(edges)
+        stats["html_bytes"] += size
+        stats["html_chunks"] += writer.chunks
+        stats["html_seconds"] += time.perf_counter() - start
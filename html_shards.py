@@ -0,0 +1,313 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from jinja2 import Environment
+
+from html_renderer import vis_edge, vis_node
+from styles import edge_attributes, node_attributes
+
+# Bump when the format of the shards or of the manifest changes.
+SHARD_FORMAT_VERSION = 1
+SHARD_MANIFEST = "shards.json"
+SHARD_INDEX_PAGE = "index.html"
+SHARD_PREFIX = "component-"
+# Accounts and regions listed by name in the index page, per component.
+SUMMARY_VALUES = 5
+
+VIS_NETWORK_URL = "https://cdnjs.cloudflare.com/ajax/libs/vis-network/9.1.2/dist/vis-network.min.js"
+
+# The index page lists the components; a component's shard (a script calling
+# topologyShard) is only loaded when it is selected. Script tags, unlike fetch,
+# also load from file:// pages.
+INDEX_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Network topology</title>
+<script src="{{ vis_network_url }}"></script>
+<style>
+  body { font-family: sans-serif; margin: 0; display: flex; height: 100vh; }
+  #components { width: 32em; overflow-y: auto; border-right: 1px solid #ccc; }
+  #components table { border-collapse: collapse; width: 100%; font-size: 0.85em; }
+  #components th, #components td { padding: 4px 6px; border-bottom: 1px solid #eee; text-align: left; vertical-align: top; }
+  #components tbody tr { cursor: pointer; }
+  #components tbody tr:hover, #components tr.selected { background: #e8f0fe; }
+  #graph { flex: 1; }
+</style>
+</head>
+<body>
+<div id="components">
+  <table>
+    <thead><tr><th>Nodes</th><th>Edges</th><th>Accounts</th><th>Regions</th><th>Resources</th></tr></thead>
+    <tbody id="rows"></tbody>
+  </table>
+</div>
+<div id="graph"></div>
+<script>
+  var components = {{ components }};
+  var physics = {{ physics }};
+  var shards = {};
+  var network = null;
+  var selected = null;
+
+  function summary(values, count) {
+    var text = values.join(", ");
+    return count > values.length ? text + " (+" + (count - values.length) + ")" : text;
+  }
+
+  function draw(shard) {
+    if (network !== null) {
+      network.destroy();
+    }
+    var options = {physics: physics ? {enabled: true, solver: "forceAtlas2Based"} : {enabled: false}};
+    network = new vis.Network(document.getElementById("graph"),
+                              {nodes: new vis.DataSet(shard.nodes), edges: new vis.DataSet(shard.edges)}, options);
+  }
+
+  function topologyShard(file, nodes, edges) {
+    shards[file] = {nodes: nodes, edges: edges};
+    if (selected === file) {
+      draw(shards[file]);
+    }
+  }
+
+  function select(component, row) {
+    var current = document.querySelector("tr.selected");
+    if (current !== null) {
+      current.className = "";
+    }
+    row.className = "selected";
+    selected = component.file;
+    if (component.file in shards) {
+      draw(shards[component.file]);
+      return;
+    }
+    var script = document.createElement("script");
+    script.src = component.file + "?" + component.hash;
+    document.body.appendChild(script);
+  }
+
+  components.forEach(function (component) {
+    var row = document.createElement("tr");
+    var types = Object.keys(component.resource_types).map(function (type) {
+      return component.resource_types[type] + " " + type;
+    });
+    [component.nodes, component.edges, summary(component.accounts, component.account_count),
+     summary(component.regions, component.region_count), types.join(", ")].forEach(function (value) {
+      var cell = document.createElement("td");
+      cell.textContent = value;
+      row.appendChild(cell);
+    });
+    row.onclick = function () { select(component, row); };
+    document.getElementById("rows").appendChild(row);
+  });
+</script>
+</body>
+</html>
+"""
+
+
+def shard_file_name(members):
+    """
+    Return the file name of the shard of a component, stable as long as the
+    smallest node id of the component stays the same.
+    """
+    return f"{SHARD_PREFIX}{hashlib.sha1(min(members).encode()).hexdigest()[:16]}.js"
+
+
+def split_records(node_records, edge_records, components):
+    """
+    Split the node and edge records of a graph by component (lists of node ids).
+    Return {shard file name: (node records, edge records)}, the records sorted by
+    node ids so that a shard does not depend on the order the graph was built in.
+    """
+    shard_of = {}
+    shards = {}
+    for members in components:
+        file_name = shard_file_name(members)
+        shards[file_name] = ([], [])
+        for node_id in members:
+            shard_of[node_id] = file_name
+    for record in node_records:
+        file_name = shard_of.get(record[0])
+        if file_name is not None:
+            shards[file_name][0].append(record)
+    for source, target, kind, title in edge_records:
+        file_name = shard_of.get(source)
+        if file_name is not None:
+            if target < source:
+                source, target = target, source
+            shards[file_name][1].append((source, target, kind, title))
+    for node_records, edge_records in shards.values():
+        node_records.sort()
+        edge_records.sort(key=lambda record: record[:2])
+    return shards
+
+
+def summarize(node_records, edge_records):
+    """
+    Return the index page entry of a shard: node and edge counts, the accounts and
+    regions (first SUMMARY_VALUES by number of nodes) and the resource type counts.
+    """
+    accounts = Counter(record[3] for record in node_records if record[3])
+    regions = Counter(record[4] for record in node_records if record[4])
+    resource_types = Counter(record[1] or "unknown" for record in node_records)
+    return {
+        "nodes": len(node_records),
+        "edges": len(edge_records),
+        "accounts": [account for account, _ in accounts.most_common(SUMMARY_VALUES)],
+        "account_count": len(accounts),
+        "regions": [region for region, _ in regions.most_common(SUMMARY_VALUES)],
+        "region_count": len(regions),
+        "resource_types": dict(resource_types.most_common()),
+    }
+
+
+def render_shard(file_name, node_records, edge_records, positions=None):
+    """
+    Return the script of a shard: a topologyShard call with its vis.js nodes and edges.
+    """
+    positions = positions or {}
+    nodes = [vis_node(record[0], node_attributes(*record), positions.get(record[0])) for record in node_records]
+    edges = [vis_edge(source, target, edge_attributes(kind, title)) for source, target, kind, title in edge_records]
+    arguments = ",".join(json.dumps(value, separators=(",", ":"), sort_keys=True) for value in (file_name, nodes, edges))
+    return f"topologyShard({arguments});\n"
+
+
+def write_if_changed(output_dir, file_name, content, previous_hash):
+    """
+    Write content (bytes) to a file of output_dir unless its content hash is
+    previous_hash and the file exists. Return (file name, content hash, written,
+    size in bytes).
+    """
+    content_hash = hashlib.sha256(content).hexdigest()
+    file_path = os.path.join(output_dir, file_name)
+    if content_hash == previous_hash and os.path.isfile(file_path):
+        return file_name, content_hash, False, len(content)
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    os.replace(temp_path, file_path)
+    return file_name, content_hash, True, len(content)
+
+
+def write_shard(output_dir, previous_hash, shard):
+    """
+    Render a shard (file name, node records, edge records, positions) and write it
+    if it changed, see write_if_changed.
+    """
+    return write_if_changed(output_dir, shard[0], render_shard(*shard).encode(), previous_hash)
+
+
+def _write_shard_item(output_dir, item):
+    previous_hash, shard = item
+    return write_shard(output_dir, previous_hash, shard)
+
+
+def _iter_written_shards(output_dir, items, workers):
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    write = partial(_write_shard_item, output_dir)
+    if workers <= 1 or len(items) <= 1:
+        yield from map(write, items)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(write, items, chunksize=max(1, len(items) // (workers * 4)))
+
+
+def read_manifest(output_dir):
+    """
+    Return the {shard file name: content hash} of the previous write to output_dir.
+    """
+    try:
+        with open(os.path.join(output_dir, SHARD_MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != SHARD_FORMAT_VERSION:
+        return {}
+    return manifest.get("shards", {})
+
+
+def write_manifest(output_dir, hashes, previous=None, prefix=SHARD_PREFIX):
+    """
+    Record the {file name: content hash} written to output_dir, deleting the files
+    of the previous manifest (named with prefix) that were not written again.
+    """
+    for file_name in (previous or {}).keys() - hashes.keys():
+        if file_name.startswith(prefix):
+            try:
+                os.remove(os.path.join(output_dir, file_name))
+            except FileNotFoundError:
+                pass
+    _write_text(os.path.join(output_dir, SHARD_MANIFEST), json.dumps({"version": SHARD_FORMAT_VERSION, "shards": hashes}))
+
+
+def _write_text(file_path, text):
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(text)
+    os.replace(temp_path, file_path)
+
+
+def write_sharded_html(node_records, edge_records, components, output_dir, positions=None, workers=1, stats=None):
+    """
+    Write a graph as one script per component (see render_shard) plus an index
+    page listing the components, which loads a component's script only when it
+    is selected. node_records and edge_records are the records of the graph (see
+    CompactGraph.node_records), components the lists of node ids to write. Shards
+    are rendered in workers processes and only rewritten when their content hash
+    changed since the last write; shards of components that are gone are deleted.
+    positions maps node ids to fixed (x, y) coordinates. Render stats are added to
+    stats if given.
+    """
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    images_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+    if os.path.isdir(images_dir):
+        shutil.copytree(images_dir, os.path.join(output_dir, "images"), dirs_exist_ok=True)
+
+    shards = split_records(node_records, edge_records, components)
+    previous = read_manifest(output_dir)
+    items = []
+    for file_name, (shard_nodes, shard_edges) in shards.items():
+        shard_positions = None
+        if positions is not None:
+            shard_positions = {record[0]: positions[record[0]] for record in shard_nodes if record[0] in positions}
+        items.append((previous.get(file_name), (file_name, shard_nodes, shard_edges, shard_positions)))
+
+    hashes = {}
+    written = size = 0
+    for file_name, content_hash, shard_written, shard_size in _iter_written_shards(output_dir, items, workers):
+        hashes[file_name] = content_hash
+        written += shard_written
+        size += shard_size
+
+    entries = []
+    for file_name, (shard_nodes, shard_edges) in shards.items():
+        entry = summarize(shard_nodes, shard_edges)
+        entry["file"] = file_name
+        entry["hash"] = hashes[file_name][:16]
+        entries.append(entry)
+    entries.sort(key=lambda entry: (-entry["nodes"], entry["file"]))
+    page = Environment(autoescape=False).from_string(INDEX_TEMPLATE).render(
+        vis_network_url=VIS_NETWORK_URL,
+        components=json.dumps(entries).replace("</", "<\\/"),
+        physics=json.dumps(positions is None),
+    )
+    _write_text(os.path.join(output_dir, SHARD_INDEX_PAGE), page)
+    write_manifest(output_dir, hashes, previous)
+
+    if stats is not None:
+        stats["html_shards"] += len(shards)
+        stats["html_shards_written"] += written
+        stats["html_nodes"] += sum(len(shard_nodes) for shard_nodes, _ in shards.values())
+        stats["html_edges"] += sum(len(shard_edges) for _, shard_edges in shards.values())
+        stats["html_bytes"] += size
+        stats["html_seconds"] += time.perf_counter() - start
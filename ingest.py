@@ -0,0 +1,383 @@
+import os
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from prot import build_projection, read_projected_file, read_proto_file
+from te.service.cm.v1 import cm_snapshot_pb2 as cm
+
+from utils.arn_utils import reconstruct_arn
+from utils.azure_id_utils import parent_resource_id
+
+# Compact, picklable stand-ins for the proto messages consumed by AwsTopology.
+# Field names match the proto so the add_* methods accept either.
+TgwAttachmentRecord = namedtuple(
+    "TgwAttachmentRecord",
+    ["tgwArn", "resourceArn", "resourceId", "resourceType", "transitGatewayAttachmentId"],
+)
+DirectConnectVirtualInterfaceRecord = namedtuple(
+    "DirectConnectVirtualInterfaceRecord",
+    ["connectionId", "virtualGatewayId", "directConnectGatewayId", "accountId", "region", "assetId", "virtualInterfaceType"],
+)
+# Attachment of a TGW route table association, propagation or route.
+TgwRouteTableAttachmentRecord = namedtuple(
+    "TgwRouteTableAttachmentRecord",
+    ["transitGatewayAttachmentId", "resourceId", "resourceType"],
+)
+TgwRouteRecord = namedtuple(
+    "TgwRouteRecord",
+    ["destinationCidrBlock", "prefixListId", "transitGatewayAttachments", "type", "state"],
+)
+# associations and propagations only hold the associated and enabled attachments.
+TgwRouteTableRecord = namedtuple(
+    "TgwRouteTableRecord",
+    ["transitGatewayRouteTableId", "transitGatewayId", "associations", "propagations", "routes"],
+)
+# Subnets and VPC route tables, only extracted for path tracing (vpc_routing).
+# routeTableId is the route table the snapshot reports for the subnet, if any.
+SubnetRecord = namedtuple("SubnetRecord", ["subnetId", "vpcArn", "cidrBlocks", "routeTableId"])
+# targetType is one of VPC_ROUTE_TARGET_FIELDS (or "local"), targetId its id.
+VpcRouteRecord = namedtuple("VpcRouteRecord", ["destination", "prefixListId", "targetType", "targetId", "blackhole"])
+VpcRouteTableRecord = namedtuple("VpcRouteTableRecord", ["routeTableId", "vpcArn", "main", "subnetIds", "routes"])
+# Topology records of one AssetsSnapshot or AzrAssetsSnapshot; key is
+# (cloud, aid, account_id, region) or None when the snapshot has no account to de-duplicate on.
+SnapshotRecords = namedtuple("SnapshotRecords", ["key", "time", "records"])
+
+# SnapshotModelsAssets fields read by extract_asset_records, everything else is skipped
+# when loading in topology-only mode.
+TOPOLOGY_ASSET_FIELDS = (
+    "transitGateways",
+    "vpcs",
+    "transitGatewayAttachments",
+    "transitGatewayPeeringAttachments",
+    "vpcPeeringConnections",
+    "vpnGateways",
+    "awsDirectConnectGateway",
+    "directConnectConnections",
+    "directConnectVirtualInterfaces",
+    "transitGatewayRouteTables",
+    "managedPrefixLists",
+)
+# AzrSnapshotModelsAssets fields read by extract_azr_asset_records.
+TOPOLOGY_AZR_ASSET_FIELDS = (
+    "vnets",
+    "vnetPeerings",
+    "virtualHubs",
+    "hubVirtualNetworkConnections",
+    "virtualNetworkGateways",
+    "expressRouteGateways",
+    "expressRouteConnections",
+    "expressRouteCircuits",
+)
+TOPOLOGY_PROJECTION = build_projection("topology", TOPOLOGY_ASSET_FIELDS, TOPOLOGY_AZR_ASSET_FIELDS)
+# SnapshotModelsAssets fields also read with vpc_routing.
+VPC_ROUTING_ASSET_FIELDS = (
+    "subnets",
+    "routeTables",
+)
+VPC_ROUTING_PROJECTION = build_projection("vpc_routing", TOPOLOGY_ASSET_FIELDS + VPC_ROUTING_ASSET_FIELDS, TOPOLOGY_AZR_ASSET_FIELDS)
+# Stats keys of the decoded asset counts by collection, see load_file_records.
+ASSET_COUNT_PREFIX = "assets."
+AZR_ASSET_COUNT_PREFIX = "azr_assets."
+# Route fields naming the target of a VPC route, by target type.
+VPC_ROUTE_TARGET_FIELDS = {
+    "transit-gateway": "transitGatewayId",
+    "vpc-peering": "vpcPeeringConnectionId",
+    "nat-gateway": "natGatewayId",
+    "gateway": "gatewayId",
+    "egress-only-gateway": "egressOnlyInternetGatewayId",
+    "network-interface": "networkInterfaceId",
+    "instance": "instanceId",
+    "local-gateway": "localGatewayId",
+    "carrier-gateway": "carrierGatewayId",
+    "core-network": "coreNetworkArn",
+}
+
+
+def extract_asset_records(assets, vpc_routing=False):
+    """
+    Extract the topology records of a SnapshotModelsAssets message.
+    Each record is a tuple of an AwsTopology method name followed by its arguments.
+    With vpc_routing, subnets and VPC route tables are extracted too.
+    """
+    records = []
+    for tgw in assets.transitGateways:
+        records.append(("add_transit_gateway", tgw.assetId, tgw.name))
+
+    for vpc in assets.vpcs:
+        records.append(("add_vpc", vpc.assetId, vpc.name, vpc_cidr_blocks(vpc)))
+
+    for tgwa in assets.transitGatewayAttachments:
+        if not tgwa.tgwArn:
+            continue
+        records.append(("add_tgw_attachment", TgwAttachmentRecord(
+            tgwa.tgwArn, tgwa.resourceArn, tgwa.resourceId, tgwa.resourceType, tgwa.transitGatewayAttachmentId)))
+
+    for peering in assets.transitGatewayPeeringAttachments:
+        attachment_ids = tuple(attachment_id for attachment_id in (peering.transitGatewayAttachmentId, peering.accepterTransitGatewayAttachmentId) if attachment_id)
+        records.append(("add_tgw_peering", peering.requesterArn, peering.accepterArn, peering.assetId, attachment_ids))
+
+    for vpc in assets.vpcPeeringConnections:
+        records.append(("add_vpc_peering", vpc.requesterVpcInfo.vpcArn, vpc.accepterVpcInfo.vpcArn, vpc.vpcPeeringConnectionId))
+
+    for vpngw in assets.vpnGateways:
+        for vpc in vpngw.vpcAttachments:
+            records.append(("add_vpn_gateway_connection", vpngw.assetId, vpc.vpcArn))
+
+    for dcg in assets.awsDirectConnectGateway:
+        records.append(("add_direct_connect_gateway", dcg.directConnectGatewayId, dcg.directConnectGatewayName))
+        for association in dcg.directConnectGatewayAssociations:
+            if association.associatedGateway.type == cm.DirectConnectGatewayGatewayType.DIRECT_CONNECT_GATEWAY_GATEWAY_TYPE_VIRTUAL_PRIVATE_GATEWAY:
+                vgw = association.associatedGateway
+                vgw_arn = reconstruct_arn('ec2', vgw.ownerAccount, vgw.region, 'vpn-gateway', vgw.id)
+                records.append(("add_direct_connect_gateway_association", dcg.directConnectGatewayId, vgw_arn, association.associationId))
+
+    for dcc in assets.directConnectConnections:
+        records.append(("add_direct_connect_connection", dcc.connectionId, dcc.connectionName))
+
+    for dcvif in assets.directConnectVirtualInterfaces:
+        records.append(("add_direct_connect_virtual_interface", DirectConnectVirtualInterfaceRecord(
+            dcvif.connectionId, dcvif.virtualGatewayId, dcvif.directConnectGatewayId,
+            dcvif.accountId, dcvif.region, dcvif.assetId, dcvif.virtualInterfaceType)))
+
+    for table in assets.transitGatewayRouteTables:
+        records.append(("add_tgw_route_table", tgw_route_table_record(table)))
+
+    for prefix_list in assets.managedPrefixLists:
+        records.append(("add_managed_prefix_list", prefix_list.prefixListId, tuple(prefix_list.entries)))
+
+    if vpc_routing:
+        for subnet in assets.subnets:
+            cidr_blocks = ([subnet.cidrBlock] if subnet.cidrBlock else []) + [block.ipv6CidrBlock for block in subnet.ipv6CidrBlockSet if block.ipv6CidrBlock]
+            records.append(("add_subnet", SubnetRecord(
+                subnet.subnetId or subnet.assetId, subnet.vpcArn or subnet.vpcId, tuple(cidr_blocks), subnet.routeTable.routeTableId)))
+
+        for table in assets.routeTables:
+            records.append(("add_vpc_route_table", vpc_route_table_record(table)))
+
+    return records
+
+
+def vpc_cidr_blocks(vpc):
+    """
+    Return the IPv4 and IPv6 CIDR blocks of an AwsVpc, primary block first.
+    """
+    released = (cm.VpcCidrBlockAssociationStateCode.VPC_CIDR_BLOCK_STATE_DISASSOCIATING,
+                cm.VpcCidrBlockAssociationStateCode.VPC_CIDR_BLOCK_STATE_DISASSOCIATED)
+    cidr_blocks = [vpc.cidrBlock] if vpc.cidrBlock else []
+    for association in vpc.cidrBlockAssociationSet:
+        if association.cidrBlock and association.cidrBlockState.state not in released and association.cidrBlock not in cidr_blocks:
+            cidr_blocks.append(association.cidrBlock)
+    for association in vpc.ipv6CidrBlockAssociationSet:
+        if association.ipv6CidrBlock and association.ipv6CidrBlockState.state not in released:
+            cidr_blocks.append(association.ipv6CidrBlock)
+    return tuple(cidr_blocks)
+
+
+def vpc_route_table_record(table):
+    """
+    Return the VpcRouteTableRecord of an AwsRouteTable.
+    """
+    routes = []
+    for route in table.routes:
+        target_type, target_id = None, None
+        for field_type, field in VPC_ROUTE_TARGET_FIELDS.items():
+            if getattr(route, field):
+                target_type, target_id = field_type, getattr(route, field)
+                break
+        if target_type == "gateway" and target_id == "local":
+            target_type = "local"
+        routes.append(VpcRouteRecord(
+            route.destinationCidrBlock or route.destinationIpv6CidrBlock, route.destinationPrefixListId,
+            target_type, target_id, route.state == cm.RouteTableRouteState.ROUTE_TABLE_ROUTE_STATE_BLACKHOLE))
+    return VpcRouteTableRecord(
+        table.routeTableId or table.assetId,
+        table.vpcArn or table.vpcId,
+        any(association.main for association in table.associations),
+        tuple(association.subnetId for association in table.associations if association.subnetId),
+        tuple(routes),
+    )
+
+
+def tgw_route_table_record(table):
+    """
+    Return the TgwRouteTableRecord of an AwsTransitGatewayRouteTable.
+    """
+    def attachment(item):
+        return TgwRouteTableAttachmentRecord(item.transitGatewayAttachmentId, item.resourceId, item.resourceType)
+
+    return TgwRouteTableRecord(
+        table.transitGatewayRouteTableId or table.assetId,
+        table.transitGatewayId,
+        tuple(attachment(association) for association in table.associations
+              if association.state == cm.TransitGatewayRouteTableAssociationState.TGW_RT_ASSOCIATION_STATE_ASSOCIATED),
+        tuple(attachment(propagation) for propagation in table.propagations
+              if propagation.state == cm.TransitGatewayRouteTablePropagationState.TGW_RT_PROPAGATION_STATE_ENABLED),
+        tuple(TgwRouteRecord(route.destinationCidrBlock, route.prefixListId,
+                             tuple(attachment(target) for target in route.transitGatewayAttachments),
+                             route.type, route.state)
+              for route in table.routes),
+    )
+
+
+def extract_azr_asset_records(assets):
+    """
+    Extract the topology records of an AzrSnapshotModelsAssets message.
+    Child resources are linked to their parent through the parent segment of their ID.
+    """
+    records = []
+    for hub in assets.virtualHubs:
+        records.append(("add_virtual_hub", hub.id, hub.name, hub.azrRegion))
+
+    for vnet in assets.vnets:
+        records.append(("add_vnet", vnet.id, vnet.name, vnet.azrRegion))
+
+    for peering in assets.vnetPeerings:
+        vnet_id = parent_resource_id(peering.id, "virtualNetworkPeerings")
+        if vnet_id and peering.remoteVirtualNetwork:
+            records.append(("add_vnet_peering", vnet_id, peering.remoteVirtualNetwork, peering.id))
+
+    for connection in assets.hubVirtualNetworkConnections:
+        hub_id = parent_resource_id(connection.id, "hubVirtualNetworkConnections")
+        vnet_id = connection.properties.remoteVirtualNetwork.id
+        if hub_id and vnet_id:
+            records.append(("add_hub_vnet_connection", hub_id, vnet_id, connection.id))
+
+    for gateway in assets.virtualNetworkGateways:
+        vnet_id = None
+        for ip_configuration in gateway.properties.ipConfigurations:
+            vnet_id = parent_resource_id(ip_configuration.properties.subnet.id, "subnets")
+            if vnet_id:
+                break
+        records.append(("add_virtual_network_gateway", gateway.id, gateway.name, gateway.azrRegion, vnet_id))
+
+    for gateway in assets.expressRouteGateways:
+        records.append(("add_express_route_gateway", gateway.id, gateway.name, gateway.azrRegion, gateway.virtualHub or None))
+
+    for circuit in assets.expressRouteCircuits:
+        records.append(("add_express_route_circuit", circuit.id, circuit.name, circuit.azrRegion))
+
+    for connection in assets.expressRouteConnections:
+        gateway_id = parent_resource_id(connection.id, "expressRouteConnections")
+        circuit_id = parent_resource_id(connection.expressRouteCircuitPeering, "peerings")
+        if gateway_id and circuit_id:
+            records.append(("add_express_route_connection", gateway_id, circuit_id, connection.id))
+
+    return records
+
+
+def extract_snapshot_records(snapshot, cloud="aws", vpc_routing=False):
+    """
+    Extract the topology records of an AssetsSnapshot (aws) or AzrAssetsSnapshot (azr) message.
+    """
+    key = (cloud, snapshot.aid, snapshot.account_id, snapshot.region) if snapshot.account_id else None
+    if cloud == "azr":
+        return SnapshotRecords(key, snapshot.time, extract_azr_asset_records(snapshot.assets))
+    return SnapshotRecords(key, snapshot.time, extract_asset_records(snapshot.assets, vpc_routing))
+
+
+def load_file_records(file_path, topology_only=True, vpc_routing=False):
+    """
+    Read a snapshot file and return the SnapshotRecords of all its AWS and Azure
+    snapshots and load stats. In topology-only mode only TOPOLOGY_ASSET_FIELDS and
+    TOPOLOGY_AZR_ASSET_FIELDS are decoded, plus VPC_ROUTING_ASSET_FIELDS with vpc_routing.
+    The stats include the decode and extraction times and the number of decoded
+    assets of each collection (keys prefixed with ASSET_COUNT_PREFIX).
+    """
+    stats = Counter()
+    start = time.perf_counter()
+    if topology_only:
+        data = read_projected_file(file_path, VPC_ROUTING_PROJECTION if vpc_routing else TOPOLOGY_PROJECTION, stats)
+    else:
+        data = read_proto_file(file_path)
+        size = os.path.getsize(file_path)
+        stats["bytes_total"] += size
+        stats["bytes_decoded"] += size
+    decoded = time.perf_counter()
+    stats["decode_seconds"] += decoded - start
+    stats["snapshots"] += len(data.snapshot) + len(data.azr_snapshot)
+    for prefix, cloud_snapshots in ((ASSET_COUNT_PREFIX, data.snapshot), (AZR_ASSET_COUNT_PREFIX, data.azr_snapshot)):
+        for snapshot in cloud_snapshots:
+            for field, value in snapshot.assets.ListFields():
+                if field.is_repeated:
+                    stats[prefix + field.name] += len(value)
+    snapshots = [extract_snapshot_records(snapshot, "aws", vpc_routing) for snapshot in data.snapshot]
+    snapshots.extend(extract_snapshot_records(snapshot, "azr") for snapshot in data.azr_snapshot)
+    stats["extract_seconds"] += time.perf_counter() - decoded
+    return snapshots, stats
+
+
+def latest_snapshots(snapshots):
+    """
+    De-duplicate SnapshotRecords by key, keeping the newest of each key.
+    Ties keep the first one. The result keeps the order of snapshots.
+    """
+    latest = {}
+    for position, snapshot in enumerate(snapshots):
+        key = position if snapshot.key is None else snapshot.key
+        if key not in latest or snapshot.time > latest[key][1].time:
+            latest[key] = (position, snapshot)
+    return [snapshot for _, snapshot in sorted(latest.values(), key=lambda item: item[0])]
+
+
+def iter_file_records(file_paths, workers=1, topology_only=True, vpc_routing=False):
+    """
+    Yield the SnapshotRecords list and load stats of every file, in the order of file_paths.
+    With more than one worker the files are decoded in a process pool; 0 uses all CPU cores.
+    """
+    load = partial(load_file_records, topology_only=topology_only, vpc_routing=vpc_routing)
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            yield load(file_path)
+        return
+
+    chunksize = max(1, len(file_paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(load, file_paths, chunksize=chunksize)
+
+
+def iter_cached_file_records(file_paths, cache, workers=1, topology_only=True, vpc_routing=False):
+    """
+    Like iter_file_records, but files with up-to-date entries in cache are not decoded.
+    Decoded files are added to the cache, with their fingerprint from before they
+    were decoded. Records extracted with vpc_routing are cached apart from the others.
+    """
+    variant = "vpc_routing" if vpc_routing else ""
+    cached = {}
+    fingerprints = {}
+    missing = []
+    for file_path in file_paths:
+        fingerprint = cache.fingerprint(file_path)
+        snapshots = cache.get(file_path, variant, fingerprint)
+        if snapshots is None:
+            fingerprints[file_path] = fingerprint
+            missing.append(file_path)
+        else:
+            cached[file_path] = snapshots
+
+    loaded = iter_file_records(missing, workers, topology_only, vpc_routing)
+    for file_path in file_paths:
+        if file_path in cached:
+            snapshots = cached.pop(file_path)
+            yield snapshots, Counter(cache_hits=1, snapshots=len(snapshots))
+        else:
+            snapshots, stats = next(loaded)
+            cache.put(file_path, snapshots, variant, fingerprints.pop(file_path))
+            stats["cache_misses"] += 1
+            yield snapshots, stats
+
+
+def apply_records(net, records, transit_gateways):
+    """
+    Apply topology records to an AwsTopology.
+    transit_gateways holds the ids of the named transit gateways already added, the first one seen wins.
+    """
+    for method, *args in records:
+        if method == "add_transit_gateway":
+            if args[0] in transit_gateways:
+                continue
+            transit_gateways.add(args[0])
+        getattr(net, method)(*args)
@@ -0,0 +1,231 @@
+import hashlib
+import time
+
+import numpy as np
+
+# Layout methods: "physics" leaves the layout to vis.js in the browser.
+LAYOUTS = ["physics", "force", "hierarchical"]
+
+# Distance between neighbor nodes, and between the rows of two levels.
+NODE_SPACING = 150.0
+LEVEL_SPACING = 400.0
+# Level of the nodes without one (e.g. resources only known by an edge).
+DEFAULT_LEVEL = 4
+
+FORCE_ITERATIONS = 100
+# Up to this many nodes the force layout computes every repulsion exactly;
+# beyond, distant nodes repel through the centroids of a grid of cells.
+EXACT_REPULSION_NODES = 2000
+NODES_PER_CELL = 32
+MAX_GRID = 16
+BLOCK_SIZE = 1024
+
+
+def _component_labels(node_count, edges):
+    """
+    Return the connected component label (smallest node index) of every node.
+    """
+    parents = list(range(node_count))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    for source, target in edges.tolist():
+        source, target = find(source), find(target)
+        if source != target:
+            parents[max(source, target)] = min(source, target)
+    return np.array([find(index) for index in range(node_count)], dtype=np.int64)
+
+
+def _group(labels, values):
+    """
+    Split values by label, in label order.
+    """
+    order = np.argsort(labels, kind="stable")
+    splits = np.flatnonzero(np.diff(labels[order])) + 1
+    return dict(zip(labels[order][np.concatenate([[0], splits])].tolist(), np.split(values[order], splits))) if len(values) else {}
+
+
+def hierarchical_layout(levels, edges):
+    """
+    Place the nodes in rows by level, ordering each level by the barycenter of its
+    neighbors in the levels above. Long levels wrap on several rows.
+    """
+    node_count = len(levels)
+    positions = np.zeros((node_count, 2))
+    slots = np.zeros(node_count)
+    placed = np.zeros(node_count, dtype=bool)
+    sources = np.concatenate([edges[:, 0], edges[:, 1]])
+    targets = np.concatenate([edges[:, 1], edges[:, 0]])
+    per_row = max(1, int(np.ceil(np.sqrt(node_count))))
+    row_y = 0.0
+    for level in np.unique(levels):
+        members = np.flatnonzero(levels == level)
+        mask = placed[targets] & (levels[sources] == level)
+        sums = np.bincount(sources[mask], weights=slots[targets[mask]], minlength=node_count)
+        counts = np.bincount(sources[mask], minlength=node_count)
+        barycenters = np.where(counts > 0, sums / np.maximum(counts, 1), np.inf)
+        order = members[np.lexsort((members, barycenters[members]))]
+        ranks = np.arange(len(order))
+        columns = min(len(order), per_row)
+        positions[order, 0] = (ranks % per_row - (columns - 1) / 2) * NODE_SPACING
+        positions[order, 1] = row_y + ranks // per_row * NODE_SPACING
+        slots[order] = ranks / len(order)
+        placed[order] = True
+        row_y = positions[order, 1].max() + LEVEL_SPACING
+    return positions
+
+
+def _repulsion(positions):
+    """
+    Return the Fruchterman-Reingold repulsive displacement (k^2 / d) of every node.
+    """
+    node_count = len(positions)
+    k2 = NODE_SPACING * NODE_SPACING
+    displacement = np.zeros_like(positions)
+    if node_count <= EXACT_REPULSION_NODES:
+        for start in range(0, node_count, BLOCK_SIZE):
+            delta = positions[start:start + BLOCK_SIZE, None, :] - positions[None, :, :]
+            distance2 = np.einsum("ijk,ijk->ij", delta, delta) + 1.0
+            displacement[start:start + BLOCK_SIZE] = np.einsum("ijk,ij->ik", delta, k2 / distance2)
+        return displacement
+
+    # Far field: every other cell repels as its mass at its centroid.
+    grid = min(MAX_GRID, max(1, int(np.sqrt(node_count / NODES_PER_CELL))))
+    low = positions.min(axis=0)
+    span = np.maximum(np.ptp(positions, axis=0), 1.0)
+    cells = np.minimum(((positions - low) / span * grid).astype(np.int64), grid - 1)
+    cell_ids = cells[:, 0] * grid + cells[:, 1]
+    _, node_cells, masses = np.unique(cell_ids, return_inverse=True, return_counts=True)
+    centroids = np.stack([
+        np.bincount(node_cells, weights=positions[:, 0]),
+        np.bincount(node_cells, weights=positions[:, 1]),
+    ], axis=1) / masses[:, None]
+    for start in range(0, node_count, BLOCK_SIZE):
+        block_cells = node_cells[start:start + BLOCK_SIZE]
+        delta = positions[start:start + BLOCK_SIZE, None, :] - centroids[None, :, :]
+        distance2 = np.einsum("ijk,ijk->ij", delta, delta) + 1.0
+        forces = masses * k2 / distance2
+        forces[np.arange(len(block_cells)), block_cells] = 0.0
+        displacement[start:start + BLOCK_SIZE] = np.einsum("ijk,ij->ik", delta, forces)
+
+    # Near field: exact repulsion between the nodes of the same cell.
+    order = np.argsort(node_cells, kind="stable")
+    bounds = np.concatenate([[0], np.cumsum(masses)])
+    for cell in np.flatnonzero(masses > 1):
+        members = order[bounds[cell]:bounds[cell + 1]]
+        delta = positions[members, None, :] - positions[None, members, :]
+        distance2 = np.einsum("ijk,ijk->ij", delta, delta) + 1.0
+        displacement[members] += np.einsum("ijk,ij->ik", delta, k2 / distance2)
+    return displacement
+
+
+def force_layout(levels, edges, iterations=FORCE_ITERATIONS):
+    """
+    Fruchterman-Reingold force-directed layout, vectorized with NumPy and started
+    from the hierarchical layout so the levels stay roughly ordered.
+    """
+    positions = hierarchical_layout(levels, edges)
+    node_count = len(levels)
+    if node_count < 2:
+        return positions
+    sources, targets = edges[:, 0], edges[:, 1]
+    temperature = NODE_SPACING * np.sqrt(node_count) / 4
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        displacement = _repulsion(positions)
+        delta = positions[sources] - positions[targets]
+        attraction = delta * (np.hypot(delta[:, 0], delta[:, 1]) / NODE_SPACING)[:, None]
+        for axis in range(2):
+            displacement[:, axis] -= np.bincount(sources, weights=attraction[:, axis], minlength=node_count)
+            displacement[:, axis] += np.bincount(targets, weights=attraction[:, axis], minlength=node_count)
+        length = np.maximum(np.hypot(displacement[:, 0], displacement[:, 1]), 1e-9)
+        positions += displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+    return positions
+
+
+def _component_key(method, node_ids, levels, edges):
+    digest = hashlib.sha1(method.encode())
+    for node_id, level in zip(node_ids, levels.tolist()):
+        digest.update(f"\n{node_id}\t{level}".encode())
+    digest.update(np.ascontiguousarray(edges, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def _pack(boxes):
+    """
+    Shelf-pack component bounding boxes (width, height), tallest first, on rows
+    about as wide as the square root of their total area. Return the offsets.
+    """
+    gap = NODE_SPACING * 2
+    row_width = max(max(width for width, _ in boxes), np.sqrt(sum((width + gap) * (height + gap) for width, height in boxes)))
+    offsets = [None] * len(boxes)
+    x = y = row_height = 0.0
+    for index in sorted(range(len(boxes)), key=lambda index: -boxes[index][1]):
+        width, height = boxes[index]
+        if x > 0 and x + width > row_width:
+            x, y, row_height = 0.0, y + row_height + gap, 0.0
+        offsets[index] = (x, y)
+        x += width + gap
+        row_height = max(row_height, height)
+    return offsets
+
+
+def compute_layout(graph, method="force", cache=None, stats=None):
+    """
+    Compute fixed node positions for a networkx.Graph or CompactGraph.
+    Each connected component is laid out on its own and the components are packed
+    on a grid. With a LayoutCache, components whose nodes, levels and edges did not
+    change reuse their cached positions. Return a dict of node id to (x, y).
+    """
+    start = time.perf_counter()
+    layouts = {"force": force_layout, "hierarchical": hierarchical_layout}
+    node_ids = []
+    levels = []
+    for node_id, data in graph.nodes(data=True):
+        node_ids.append(node_id)
+        levels.append(data.get("level", DEFAULT_LEVEL))
+    index = {node_id: position for position, node_id in enumerate(node_ids)}
+    edges = np.array([(index[source], index[target]) for source, target in graph.edges()], dtype=np.int64).reshape(-1, 2)
+    levels = np.array(levels, dtype=float)
+
+    cached = cache.load() if cache is not None else {}
+    entries = {}
+    components = []
+    labels = _component_labels(len(node_ids), edges)
+    component_edges = _group(labels[edges[:, 0]], edges)
+    local = np.zeros(len(node_ids), dtype=np.int64)
+    no_edges = np.zeros((0, 2), dtype=np.int64)
+    for label, members in _group(labels, np.arange(len(node_ids))).items():
+        members = members[np.argsort([node_ids[member] for member in members], kind="stable")]
+        local[members] = np.arange(len(members))
+        edges_of = np.sort(local[component_edges.get(label, no_edges)], axis=1)
+        edges_of = edges_of[np.lexsort((edges_of[:, 1], edges_of[:, 0]))]
+        key = _component_key(method, [node_ids[member] for member in members], levels[members], edges_of)
+        positions = cached.get(key)
+        if positions is None:
+            positions = layouts[method](levels[members], edges_of)
+            if stats is not None:
+                stats["layout_components_computed"] += 1
+        elif stats is not None:
+            stats["layout_components_cached"] += 1
+        entries[key] = positions
+        positions = positions - positions.min(axis=0)
+        components.append((members, positions))
+
+    layout = {}
+    # A run that draws nothing keeps the cached positions of the previous one.
+    if components:
+        if cache is not None:
+            cache.save(entries)
+        offsets = _pack([tuple(positions.max(axis=0)) for _, positions in components])
+        for (members, positions), (x, y) in zip(components, offsets):
+            for member, (node_x, node_y) in zip(members.tolist(), (positions + (x, y)).tolist()):
+                layout[node_ids[member]] = (round(node_x, 1), round(node_y, 1))
+    if stats is not None:
+        stats["layout_seconds"] += time.perf_counter() - start
+    return layout
@@ -0,0 +1,325 @@
+import os
+import queue
+import time
+from collections import Counter, namedtuple
+
+from google.protobuf import json_format
+from google.protobuf.message import DecodeError
+
+from cache import RecordCache
+from ingest import apply_records, iter_cached_file_records, iter_file_records
+from snapshot import AwsTopology, build_arg_parser, check_input_dir, get_files, render
+from te.service.cm.v1 import cm_snapshot_kafka_pb2 as kafka
+
+# Nodes and edges a snapshot adds to the topology. order is its (file path, position
+# in file), the order create_graph would apply it in.
+Contribution = namedtuple("Contribution", ["snapshot", "order", "nodes", "edges"])
+# Subdirectory of the spool directory that notifications which cannot be parsed are moved to.
+REJECTED_DIR = "rejected"
+
+
+def snapshot_contribution(records):
+    """
+    Apply the records of one snapshot to an empty topology and return its nodes
+    ({id: (resource_type, name, account, region)}) and edges ({(id, id): (kind, title)}).
+    """
+    scratch = AwsTopology(backend="compact")
+    apply_records(scratch, records, set())
+    nodes = {node_id: attributes for node_id, *attributes in scratch.network.node_records()}
+    edges = {}
+    for source, target, kind, title in scratch.network.edge_records():
+        edges[(source, target) if source <= target else (target, source)] = (kind, title)
+    return nodes, edges
+
+
+class LiveTopology:
+    """
+    AwsTopology kept up to date file by file, instead of being rebuilt.
+    Every snapshot key (cloud, aid, account, region) contributes the nodes and edges
+    of its newest snapshot across all files, like create_graph. When files change,
+    only the contributions of their keys are replaced and the resulting node and
+    edge differences are applied to the live graph. A node or edge shared by several
+    snapshots stays until none of them has it; its attributes come from the last
+    snapshot, in create_graph order, that typed and named it (the first one for
+    transit gateways), so the live graph matches a rebuild.
+    """
+
+    def __init__(self, dir_path, workers=1, topology_only=True, cache=None, backend="networkx"):
+        self.dir_path = dir_path
+        self.workers = workers
+        self.topology_only = topology_only
+        self.cache = cache
+        self.net = AwsTopology(backend=backend)
+        self.file_snapshots = {}
+        self.candidates = {}
+        self.applied = {}
+        self.node_owners = {}
+        self.edge_owners = {}
+
+    def load(self, stats=None):
+        """
+        Load every file of the directory.
+        """
+        return self.update_files(get_files(self.dir_path, ".pb"), stats)
+
+    def update_files(self, file_paths, stats=None):
+        """
+        Reload the given files (missing ones count as deleted) and apply the resulting
+        changes to the graph. Return the Counter of added, removed and updated nodes and
+        edges; updated ones were contributed by a changed snapshot and may be unchanged.
+        Load stats are added to stats if given.
+        """
+        existing = [file_path for file_path in file_paths if os.path.isfile(file_path)]
+        if self.cache is None:
+            file_records = iter_file_records(existing, self.workers, self.topology_only)
+        else:
+            file_records = iter_cached_file_records(existing, self.cache, self.workers, self.topology_only)
+
+        changed_keys = set()
+        for file_path, (snapshots, file_stats) in zip(existing, file_records):
+            changed_keys |= self._set_file_snapshots(file_path, snapshots)
+            if stats is not None:
+                stats.update(file_stats)
+        for file_path in set(file_paths) - set(existing):
+            changed_keys |= self._set_file_snapshots(file_path, [])
+
+        touched_nodes, touched_edges = set(), set()
+        for key in changed_keys:
+            candidates = self.candidates.get(key)
+            order = snapshot = None
+            if candidates:
+                # Newest snapshot, ties keep the first file in name order like create_graph.
+                file_path, (position, snapshot) = min(candidates.items(), key=lambda item: (-item[1][1].time, item[0]))
+                order = (file_path, position)
+            current = self.applied.get(key)
+            if (current.snapshot if current else None) is not snapshot:
+                self._replace_contribution(key, snapshot, order, touched_nodes, touched_edges)
+        return self._apply_changes(touched_nodes, touched_edges)
+
+    def _set_file_snapshots(self, file_path, snapshots):
+        """
+        Record the newest snapshot of each key in a file. Return the keys that changed.
+        Snapshots without key are only replaced by the next version of their file.
+        """
+        newest = {}
+        for position, snapshot in enumerate(snapshots):
+            key = (file_path, position) if snapshot.key is None else snapshot.key
+            if key not in newest or snapshot.time > newest[key][1].time:
+                newest[key] = (position, snapshot)
+        previous = self.file_snapshots.pop(file_path, {})
+        for key in previous.keys() - newest.keys():
+            del self.candidates[key][file_path]
+        for key, candidate in newest.items():
+            self.candidates.setdefault(key, {})[file_path] = candidate
+        if newest:
+            self.file_snapshots[file_path] = newest
+        return {key for key in previous.keys() | newest.keys() if previous.get(key) != newest.get(key)}
+
+    def _replace_contribution(self, key, snapshot, order, touched_nodes, touched_edges):
+        """
+        Replace the nodes and edges contributed by a key with those of snapshot (None
+        removes them), adding the nodes and edges to update to the touched sets.
+        """
+        old = self.applied.pop(key, None)
+        nodes, edges = {}, {}
+        if snapshot is not None:
+            nodes, edges = snapshot_contribution(snapshot.records)
+            self.applied[key] = Contribution(snapshot, order, nodes, edges)
+        old_nodes, old_edges = (old.nodes, old.edges) if old else ({}, {})
+        for owners, old_items, items, touched in ((self.node_owners, old_nodes, nodes, touched_nodes),
+                                                  (self.edge_owners, old_edges, edges, touched_edges)):
+            for item in old_items.keys() - items.keys():
+                owners[item].discard(key)
+            for item in items.keys() - old_items.keys():
+                owners.setdefault(item, set()).add(key)
+            touched.update(old_items.keys() | items.keys())
+
+    def _apply_changes(self, touched_nodes, touched_edges):
+        """
+        Remove the touched nodes and edges no snapshot contributes any more and set
+        the attributes of the others. Return the Counter of differences.
+        """
+        network = self.net.network
+        removed_edges = [edge for edge in touched_edges if not self.edge_owners[edge]]
+        removed_nodes = [node_id for node_id in touched_nodes if not self.node_owners[node_id]]
+        for edge in removed_edges:
+            del self.edge_owners[edge]
+        for node_id in removed_nodes:
+            del self.node_owners[node_id]
+        self.net.remove_edges(removed_edges)
+        self.net.remove_nodes(removed_nodes)
+
+        diff = Counter(nodes_removed=len(removed_nodes), edges_removed=len(removed_edges))
+        for node_id in touched_nodes - set(removed_nodes):
+            diff["nodes_updated" if network.has_node(node_id) else "nodes_added"] += 1
+            self.net._set_node(node_id, *self._node_attributes(node_id))
+        for edge in touched_edges - set(removed_edges):
+            diff["edges_updated" if network.has_edge(*edge) else "edges_added"] += 1
+            owner = max(self.edge_owners[edge], key=lambda owner: self.applied[owner].order)
+            self.net._set_edge(*edge, *self.applied[owner].edges[edge])
+        return diff
+
+    def _node_attributes(self, node_id):
+        """
+        Return the attributes of a node from the last snapshot, in create_graph
+        order, that typed and named it. Transit gateways keep the attributes of the
+        first snapshot that named them, like apply_records.
+        """
+        def priority(owner):
+            resource_type, name, _, _ = self.applied[owner].nodes[node_id]
+            return resource_type is not None, name is not None, self.applied[owner].order
+        owners = self.node_owners[node_id]
+        tgw_owners = [owner for owner in owners if self.applied[owner].nodes[node_id][0] == "tgw"]
+        if tgw_owners:
+            owner = min(tgw_owners, key=lambda owner: (self.applied[owner].nodes[node_id][1] is None, self.applied[owner].order))
+        else:
+            owner = max(owners, key=priority)
+        return self.applied[owner].nodes[node_id]
+
+    def notification_files(self, message):
+        """
+        Return the snapshot files to reload for a SnapshotKafkaMessage.
+        Partitions are paths relative to the input directory: a file (the .pb
+        extension may be omitted) or a directory of files. Without partitions,
+        every known file with snapshots of the message aid is reloaded.
+        """
+        if not message.partitions:
+            return sorted(file_path for file_path, snapshots in self.file_snapshots.items()
+                          if any(len(key) == 4 and key[1] == message.aid for key in snapshots))
+        file_paths = set()
+        root = os.path.abspath(self.dir_path)
+        for partition in message.partitions:
+            path = os.path.join(self.dir_path, partition)
+            if os.path.commonpath([root, os.path.abspath(path)]) != root:
+                print(f"Ignoring partition {partition}, outside {self.dir_path}.")
+                continue
+            if os.path.isdir(path):
+                file_paths.update(get_files(path, ".pb"))
+                # Known files that were deleted from the directory.
+                file_paths.update(file_path for file_path in self.file_snapshots if file_path.startswith(os.path.join(path, "")))
+            elif os.path.exists(path) or path.endswith(".pb"):
+                file_paths.add(path)
+            else:
+                file_paths.add(path + ".pb")
+        return sorted(file_paths)
+
+    def apply_notification(self, message, stats=None):
+        """
+        Reload the files named by a SnapshotKafkaMessage. Return the graph differences.
+        """
+        return self.update_files(self.notification_files(message), stats)
+
+
+class QueueSource:
+    """
+    Notifications put on a queue.Queue by another thread (e.g. a Kafka consumer).
+    Putting None ends the stream. Yields None when idle for idle_timeout seconds.
+    """
+
+    def __init__(self, notifications, idle_timeout=1.0):
+        self.notifications = notifications
+        self.idle_timeout = idle_timeout
+
+    def __iter__(self):
+        while True:
+            try:
+                message = self.notifications.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                yield None
+                continue
+            if message is None:
+                return
+            yield message
+
+
+class SpoolDirectorySource:
+    """
+    Notifications dropped as files in a directory: serialized SnapshotKafkaMessage
+    payloads, or the protobuf JSON form for files ending in .json. Files are read in
+    name order and deleted once applied; names starting with "." or ending in .tmp
+    are ignored so writers can rename complete files into place. Files that cannot
+    be parsed are moved to the REJECTED_DIR subdirectory.
+    Yields None when the directory is empty, then polls it every poll_interval
+    seconds, or stops if once is set.
+    """
+
+    def __init__(self, spool_dir, poll_interval=5.0, once=False):
+        self.spool_dir = spool_dir
+        self.poll_interval = poll_interval
+        self.once = once
+
+    def __iter__(self):
+        while True:
+            names = sorted(name for name in os.listdir(self.spool_dir) if not name.startswith(".") and not name.endswith(".tmp"))
+            for name in names:
+                path = os.path.join(self.spool_dir, name)
+                if not os.path.isfile(path):
+                    continue
+                message = kafka.SnapshotKafkaMessage()
+                try:
+                    if name.endswith(".json"):
+                        with open(path, "r") as f:
+                            json_format.Parse(f.read(), message)
+                    else:
+                        with open(path, "rb") as f:
+                            message.ParseFromString(f.read())
+                except (json_format.ParseError, DecodeError, UnicodeDecodeError) as error:
+                    self._reject(name, error)
+                    continue
+                yield message
+                os.remove(path)
+            yield None
+            if self.once:
+                return
+            time.sleep(self.poll_interval)
+
+    def _reject(self, name, error):
+        rejected_dir = os.path.join(self.spool_dir, REJECTED_DIR)
+        os.makedirs(rejected_dir, exist_ok=True)
+        os.replace(os.path.join(self.spool_dir, name), os.path.join(rejected_dir, name))
+        print(f"Rejected notification {name}: {error}")
+
+
+def run(live, source, on_idle=None):
+    """
+    Apply the notifications of a source to a LiveTopology. on_idle(stats) is called
+    when the source is idle (or exhausted) after changes, e.g. to render the graph.
+    """
+    dirty = False
+    for message in source:
+        if message is None:
+            if dirty and on_idle is not None:
+                on_idle(Counter())
+            dirty = False
+            continue
+        start = time.perf_counter()
+        diff = live.apply_notification(message)
+        print(f"Applied {message.aid or 'notification'} ({len(message.partitions)} partitions) in {time.perf_counter() - start:.2f}s: "
+              f"{diff['nodes_added']} nodes added, {diff['nodes_removed']} removed, "
+              f"{diff['edges_added']} edges added, {diff['edges_removed']} removed.")
+        dirty = dirty or any(diff[change] for change in ("nodes_added", "nodes_removed", "nodes_updated", "edges_added", "edges_removed", "edges_updated"))
+    if dirty and on_idle is not None:
+        on_idle(Counter())
+
+
+def main():
+    parser = build_arg_parser("Keep the topology graph up to date from snapshot notifications.")
+    parser.add_argument("--spool-dir", dest="spool_dir", type=str, required=True,
+                        help="Directory where SnapshotKafkaMessage notifications are dropped.")
+    parser.add_argument("--poll-interval", dest="poll_interval", type=float, default=5.0,
+                        help="Seconds between two scans of the spool directory.")
+    parser.add_argument("--once", dest="once", action="store_true",
+                        help="Exit once the pending notifications are applied.")
+    args = parser.parse_args()
+    if not check_input_dir(args.dir_path) or not check_input_dir(args.spool_dir):
+        return
+    cache = RecordCache(args.cache_dir, rebuild=args.rebuild_cache) if args.use_cache else None
+    live = LiveTopology(args.dir_path, args.workers, args.topology_only, cache, args.backend)
+    stats = Counter()
+    live.load(stats)
+    print(f"Read {stats['snapshots']} snapshots, {len(live.applied)} after de-duplication.")
+    render(live.net, args, stats)
+    run(live, SpoolDirectorySource(args.spool_dir, args.poll_interval, args.once), lambda stats: render(live.net, args, stats))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import json
+import os
+import platform
+import pstats
+import sys
+import time
+
+from ingest import ASSET_COUNT_PREFIX, AZR_ASSET_COUNT_PREFIX
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+# Bump when the layout of the metrics document changes.
+METRICS_VERSION = 1
+# Stats keys ending with this are phase timers (see split_stats).
+SECONDS_SUFFIX = "_seconds"
+# Functions listed in the metrics of a profiled run, by cumulative time.
+PROFILE_TOP_FUNCTIONS = 30
+
+
+def peak_rss_bytes(children=False):
+    """
+    Return the peak resident set size of this process (or, with children, of its
+    largest terminated child process, e.g. a parse worker) in bytes, None where the
+    resource module is not available.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def split_stats(stats):
+    """
+    Split a stats Counter into phase timers ({phase: seconds} from the *_seconds
+    keys), decoded asset counts by collection ({"aws": {...}, "azr": {...}}) and the
+    other counters.
+    """
+    phases = {}
+    assets = {"aws": {}, "azr": {}}
+    counters = {}
+    for key, value in stats.items():
+        if key.endswith(SECONDS_SUFFIX):
+            phases[key[:-len(SECONDS_SUFFIX)]] = round(value, 6)
+        elif key.startswith(ASSET_COUNT_PREFIX):
+            assets["aws"][key[len(ASSET_COUNT_PREFIX):]] = value
+        elif key.startswith(AZR_ASSET_COUNT_PREFIX):
+            assets["azr"][key[len(AZR_ASSET_COUNT_PREFIX):]] = value
+        else:
+            counters[key] = value
+    return phases, assets, counters
+
+
+def file_metrics(file_path, file_stats):
+    """
+    Return the metrics entry of a snapshot file from its load stats (see
+    ingest.load_file_records): bytes, decode and extraction times, asset counts.
+    """
+    phases, assets, counters = split_stats(file_stats)
+    entry = {"path": file_path, **counters, "seconds": phases}
+    for cloud, counts in assets.items():
+        if counts:
+            entry[f"{cloud}_assets"] = counts
+    return entry
+
+
+def profile_functions(profiler, top=PROFILE_TOP_FUNCTIONS):
+    """
+    Return the top functions of a cProfile.Profile by cumulative time, with their
+    call counts and own (total) and cumulative times.
+    """
+    functions = []
+    for (file_name, line, name), (_, calls, total, cumulative, _) in pstats.Stats(profiler).stats.items():
+        functions.append({
+            "function": f"{file_name}:{line}({name})",
+            "calls": calls,
+            "total_seconds": round(total, 6),
+            "cumulative_seconds": round(cumulative, 6),
+        })
+    functions.sort(key=lambda function: -function["cumulative_seconds"])
+    return functions[:top]
+
+
+def build_metrics(stats, files=(), net=None, seconds=None, profile=None):
+    """
+    Return the metrics document of a run: phase timers, counters and asset counts
+    from stats, per-file entries of files ((file path, load stats) pairs), the node
+    counts by resource type and edge counts by kind of the topology net, peak memory
+    and, for a profiled run, the profile summary.
+    """
+    # Before platform.platform(), which may fork a uname process.
+    peak, children_peak = peak_rss_bytes(), peak_rss_bytes(children=True)
+    phases, assets, counters = split_stats(stats)
+    metrics = {
+        "version": METRICS_VERSION,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "command": sys.argv,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seconds": None if seconds is None else round(seconds, 6),
+        "phases": phases,
+        "peak_rss_bytes": peak,
+        "children_peak_rss_bytes": children_peak,
+        "stats": counters,
+        "assets": assets,
+        "files": [file_metrics(file_path, file_stats) for file_path, file_stats in files],
+    }
+    if net is not None:
+        node_types, edge_kinds = net.type_counts()
+        metrics["graph"] = {
+            "nodes": sum(node_types.values()),
+            "edges": sum(edge_kinds.values()),
+            "node_types": dict(node_types.most_common()),
+            "edge_kinds": dict(edge_kinds.most_common()),
+        }
+    if profile is not None:
+        metrics["profile"] = profile
+    return metrics
+
+
+def write_metrics(file_path, metrics):
+    """
+    Write a metrics document as JSON, replacing the file atomically.
+    """
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(metrics, f, indent=2)
+    os.replace(temp_path, file_path)
+
+
+def format_phases(stats):
+    """
+    Return a one-line summary of the phase timers of a stats Counter.
+    """
+    phases, _, _ = split_stats(stats)
+    return ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in phases.items())
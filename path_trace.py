@@ -0,0 +1,264 @@
+import argparse
+import time
+from collections import Counter, OrderedDict, namedtuple
+
+from cache import DEFAULT_CACHE_DIR, RecordCache
+from reachability import ReachabilityEngine
+from snapshot import load_topology
+from topology_file import is_topology_file
+from utils.arn_utils import extract_resource_id, extract_resource_type, normalize_arn
+from utils.prefix_trie import PrefixTrie, format_prefix, parse_prefix
+
+# Number of (route table, destination prefix) walks kept by PathTracer.
+TRACE_CACHE_SIZE = 1 << 16
+
+# layer is "subnet", "vpc-route-table", "vpc-peering" or "tgw-route-table"; prefix
+# is the matched route, target where the hop sends the traffic.
+PathHop = namedtuple("PathHop", ["layer", "id", "prefix", "target"])
+# reason is "delivered", "no route table", "no route", "blackhole", "no destination
+# subnet", "leaves through <target>", "no attachment to <tgw>", "unknown VPC peering"
+# or a TGW trace reason (see reachability.Trace).
+PathTrace = namedtuple("PathTrace", ["source", "destination", "reachable", "hops", "reason"])
+
+
+class PathTracer:
+    """
+    End-to-end paths from a subnet: its VPC route table, then either the local VPC,
+    a VPC peering, or a TGW attachment and the TGW route tables across peerings
+    (see ReachabilityEngine), up to the subnet of the destination VPC holding the
+    destination. The return path starts at the route table of that subnet.
+    Every VPC route table is indexed in a PrefixTrie on first use, and the walk from
+    a route table to a destination prefix is cached, so the subnets sharing a route
+    table share their traces.
+    Needs a topology loaded with vpc_routing (see create_graph) or saved from one.
+    """
+
+    def __init__(self, engine, cache_size=TRACE_CACHE_SIZE):
+        self.engine = engine
+        self.net = net = engine.net
+        self.cache_size = cache_size
+        self.stats = Counter()
+        self._walks = OrderedDict()
+        self._tables = {}
+
+        self._vpc_ids = {}
+        for vpc_id in list(net.vpc_cidr_blocks) + [resource_id for _, resource_id in net.tgw_attachments.values()]:
+            if extract_resource_type(vpc_id) == "vpc":
+                self._vpc_ids[extract_resource_id(vpc_id)] = vpc_id
+        self.tgw_attachments = {}
+        for attachment_id, (tgw_id, resource_id) in net.tgw_attachments.items():
+            self.tgw_attachments[(self.vpc_id(resource_id), extract_resource_id(tgw_id))] = attachment_id
+
+        self.main_route_tables = {}
+        self.subnet_route_tables = {}
+        for route_table_id, record in net.vpc_route_tables.items():
+            if record.main:
+                self.main_route_tables[self.vpc_id(record.vpcArn)] = route_table_id
+            for subnet_id in record.subnetIds:
+                self.subnet_route_tables[normalize_arn(subnet_id)] = route_table_id
+        self.vpc_subnets = {}
+        for subnet_id, record in net.subnets.items():
+            trie = self.vpc_subnets.setdefault(self.vpc_id(record.vpcArn), PrefixTrie())
+            for cidr_block in record.cidrBlocks:
+                try:
+                    trie.insert(cidr_block, subnet_id)
+                except ValueError:
+                    continue
+
+    def vpc_id(self, vpc):
+        """
+        Return the id of a VPC (its normalized ARN when known) from its ARN or vpc-... id.
+        """
+        vpc = normalize_arn(vpc)
+        return self._vpc_ids.get(vpc, vpc)
+
+    def route_table_of(self, subnet_id):
+        """
+        Return the id of the route table of a subnet: its explicit association,
+        else the one reported with the subnet, else the main route table of its VPC.
+        """
+        subnet_id = normalize_arn(subnet_id)
+        route_table_id = self.subnet_route_tables.get(subnet_id)
+        if route_table_id is not None:
+            return route_table_id
+        subnet = self.net.subnets.get(subnet_id)
+        if subnet is None:
+            return None
+        route_table_id = normalize_arn(subnet.routeTableId)
+        if route_table_id in self.net.vpc_route_tables:
+            return route_table_id
+        return self.main_route_tables.get(self.vpc_id(subnet.vpcArn))
+
+    def _table(self, route_table_id):
+        """
+        Return the PrefixTrie of a VPC route table, indexing it on first use.
+        """
+        trie = self._tables.get(route_table_id)
+        if trie is None:
+            trie = PrefixTrie()
+            for route in self.net.vpc_route_tables[route_table_id].routes:
+                prefixes = [route.destination] if route.destination else self.net.prefix_lists.get(normalize_arn(route.prefixListId), ())
+                for prefix in prefixes:
+                    try:
+                        trie.insert(prefix, route)
+                    except ValueError:
+                        continue
+            self._tables[route_table_id] = trie
+        return trie
+
+    def _arrive(self, vpc_id, destination, hops):
+        match = self.vpc_subnets.get(vpc_id, PrefixTrie()).longest_match(destination)
+        if match is None:
+            return tuple(hops), False, "no destination subnet"
+        prefix, subnet_id = match
+        hops.append(PathHop("subnet", subnet_id, prefix, vpc_id))
+        return tuple(hops), True, "delivered"
+
+    def _follow(self, route_table_id, destination):
+        """
+        Walk from a VPC route table to a destination prefix. Return (hops, reachable, reason).
+        """
+        record = self.net.vpc_route_tables[route_table_id]
+        vpc_id = self.vpc_id(record.vpcArn)
+        match = self._table(route_table_id).longest_match(destination)
+        if match is None:
+            return (PathHop("vpc-route-table", route_table_id, None, None),), False, "no route"
+        prefix, route = match
+        target_id = normalize_arn(route.targetId) if route.targetId else None
+        hops = [PathHop("vpc-route-table", route_table_id, prefix, target_id or route.targetType)]
+        if route.blackhole:
+            return tuple(hops), False, "blackhole"
+        if route.targetType == "local":
+            return self._arrive(vpc_id, destination, hops)
+
+        if route.targetType == "vpc-peering":
+            vpc_ids = self.net.vpc_peerings.get(target_id)
+            if vpc_ids is None:
+                return tuple(hops), False, "unknown VPC peering"
+            peer_vpc_id = self.vpc_id(vpc_ids[1] if self.vpc_id(vpc_ids[0]) == vpc_id else vpc_ids[0])
+            hops.append(PathHop("vpc-peering", target_id, None, peer_vpc_id))
+            return self._arrive(peer_vpc_id, destination, hops)
+
+        if route.targetType != "transit-gateway":
+            return tuple(hops), False, f"leaves through {target_id}"
+        attachment_id = self.tgw_attachments.get((vpc_id, extract_resource_id(target_id)))
+        if attachment_id is None:
+            return tuple(hops), False, f"no attachment to {target_id}"
+        trace = self.engine.trace(attachment_id, destination)
+        for hop in trace.hops:
+            target = None if hop.route.blackhole else hop.route.attachments[0]
+            hops.append(PathHop("tgw-route-table", hop.route_table, hop.route.prefix, target))
+        if not trace.reachable:
+            return tuple(hops), False, trace.reason
+        resource_id = self.engine.resources.get(trace.attachment)
+        if resource_id is None or not extract_resource_id(resource_id).startswith("vpc-"):
+            return tuple(hops), True, "delivered"
+        return self._arrive(self.vpc_id(resource_id), destination, hops)
+
+    def _walk(self, route_table_id, destination):
+        """
+        Cached _follow, least recently used walks are dropped beyond cache_size.
+        """
+        key = (route_table_id, destination)
+        walk = self._walks.get(key)
+        if walk is not None:
+            self._walks.move_to_end(key)
+            self.stats["trace_cache_hits"] += 1
+            return walk
+        self.stats["trace_cache_misses"] += 1
+        walk = self._follow(route_table_id, destination)
+        self._walks[key] = walk
+        if len(self._walks) > self.cache_size:
+            self._walks.popitem(last=False)
+        return walk
+
+    def trace(self, subnet_id, destination):
+        """
+        Trace the path from a subnet to a destination address or CIDR block. Return a PathTrace.
+        """
+        subnet_id = normalize_arn(subnet_id)
+        destination = format_prefix(parse_prefix(destination))
+        route_table_id = self.route_table_of(subnet_id)
+        if route_table_id is None:
+            return PathTrace(subnet_id, destination, False, (), "no route table")
+        hops, reachable, reason = self._walk(route_table_id, destination)
+        return PathTrace(subnet_id, destination, reachable, (PathHop("subnet", subnet_id, None, route_table_id),) + hops, reason)
+
+    def return_trace(self, trace):
+        """
+        Trace the way back of a delivered PathTrace, from the destination subnet to
+        the CIDR block of the source subnet. Return None if it was not delivered to a subnet.
+        """
+        if not trace.reachable or trace.hops[-1].layer != "subnet":
+            return None
+        source = self.net.subnets.get(trace.source)
+        cidr_blocks = [cidr_block for cidr_block in source.cidrBlocks if ":" not in cidr_block] if source else []
+        if not cidr_blocks:
+            return None
+        return self.trace(trace.hops[-1].id, cidr_blocks[0])
+
+    def subnets_of(self, source):
+        """
+        Return the subnet ids of a subnet, a VPC (ARN or id) or "all".
+        """
+        if source == "all":
+            return sorted(self.net.subnets)
+        source = normalize_arn(source)
+        if source in self.net.subnets:
+            return [source]
+        vpc_id = self.vpc_id(source)
+        return sorted(subnet_id for subnet_id, record in self.net.subnets.items() if self.vpc_id(record.vpcArn) == vpc_id)
+
+
+def _format_hops(hops):
+    return " -> ".join(f"{hop.id}" + (f" ({hop.prefix})" if hop.prefix else "") for hop in hops)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trace network paths from subnets through VPC and transit gateway route tables.")
+    parser.add_argument("--input_dir", dest="dir_path", type=str, required=True,
+                        help="Path to the directory containing .pb files, or a saved .topo topology file.")
+    parser.add_argument("--from", dest="sources", type=str, nargs="+", required=True,
+                        help="Source subnets: subnet ids, VPC ARNs or ids (all their subnets), or all.")
+    parser.add_argument("--to", dest="destination", type=str, required=True,
+                        help="Destination address or CIDR block.")
+    parser.add_argument("--return", dest="trace_return", action="store_true",
+                        help="Also trace the way back from the destination subnet.")
+    parser.add_argument("--workers", dest="workers", type=int, default=1,
+                        help="Number of processes used to parse the .pb files (0 uses all CPU cores).")
+    parser.add_argument("--full-decode", dest="topology_only", action="store_false",
+                        help="Decode every snapshot field instead of only the topology ones.")
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, default=DEFAULT_CACHE_DIR,
+                        help="Directory of the per-file topology records cache.")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                        help="Do not read or write the records cache.")
+    args = parser.parse_args()
+    cache = RecordCache(args.cache_dir) if args.use_cache else None
+    net = load_topology(args.dir_path, args.workers, args.topology_only, cache=cache, backend="compact", vpc_routing=True)
+    if net is None:
+        return
+    if not net.subnets and not net.vpc_route_tables:
+        print(f"{args.dir_path} has no subnets or VPC route tables"
+              + (", save it with snapshot.py --save-topology ... --vpc-routing." if is_topology_file(args.dir_path) else "."))
+        return
+    tracer = PathTracer(ReachabilityEngine(net))
+    subnet_ids = sorted({subnet_id for source in args.sources for subnet_id in tracer.subnets_of(source)})
+    if not subnet_ids:
+        print(f"No subnet found for {' '.join(args.sources)}.")
+        return
+
+    start = time.perf_counter()
+    outcomes = Counter()
+    for subnet_id in subnet_ids:
+        trace = tracer.trace(subnet_id, args.destination)
+        outcomes[trace.reason] += 1
+        print(f"{trace.source} -> {trace.destination}: {'reachable' if trace.reachable else 'unreachable'}, {trace.reason}. {_format_hops(trace.hops)}")
+        back = tracer.return_trace(trace) if args.trace_return else None
+        if back is not None:
+            print(f"  back -> {back.destination}: {'reachable' if back.reachable else 'unreachable'}, {back.reason}. {_format_hops(back.hops)}")
+    print(f"Traced {len(subnet_ids)} subnets in {time.perf_counter() - start:.2f}s "
+          f"({tracer.stats['trace_cache_hits']} cached walks): "
+          + ", ".join(f"{count} {reason}" for reason, count in outcomes.most_common()) + ".")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,16 @@
 import google.protobuf.json_format as MessageToDict
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.internal import type_checkers
+import argparse
+import base64
+import hashlib
 import json
+import math
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from os import path
 
 import sys
@@ -11,50 +22,394 @@ sys.path.append(temp_dir + '/te/service/cm')
 sys.path.append(temp_dir + '/te/service/cm/v1')
 
 from te.service.cm.v1 import cm_snapshot_file_response_pb2
+import io
+import mmap
 import os
+import stat
 
-snapshot_files_response = cm_snapshot_file_response_pb2.SnapshotFilesResponse()
-def convert_to_json_file(proto_message, output_file):
+# Separators of the compact JSON and NDJSON exports.
+JSON_SEPARATORS = (",", ":")
+# Write buffer of the exported files.
+EXPORT_BUFFER_SIZE = 1 << 20
+
+# (JSON name, converter) of each field, see message_to_dict.
+_FIELD_CONVERTERS = {}
+
+def convert_to_json_file(proto_message, output_file, indent=4):
     """
     Convert a protobuf message to JSON and write it to a file.
     """
     json_output = MessageToDict.MessageToDict(proto_message)
     with open(output_file, "w") as json_file:
-        json.dump(json_output, json_file, indent=4)
+        json.dump(json_output, json_file, indent=indent)
     print(f"JSON output written to {output_file}")
 
 
-def read_proto_file(file_path):
+def parse_proto_buffer(buffer, message=None):
+    """
+    Parse a SnapshotFilesResponse from a bytes-like object (bytes, memoryview, mmap).
+    The buffer is parsed in place without copying. Pass message to reuse an
+    existing message in hot loops; by default a new message is returned.
+    """
+    if message is None:
+        message = cm_snapshot_file_response_pb2.SnapshotFilesResponse()
+    with memoryview(buffer) as view:
+        message.ParseFromString(view)
+    return message
+
+
+def read_proto_stream(f, message=None):
+    """
+    Read a SnapshotFilesResponse from an already open binary file object, from its
+    current position to the end. Regular files are memory mapped instead of read
+    into a bytes copy; pipes, sockets and in-memory streams are read.
+    """
+    try:
+        fileno = f.fileno()
+        file_stat = os.fstat(fileno)
+        offset = f.tell()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return parse_proto_buffer(f.read(), message)
+    if not stat.S_ISREG(file_stat.st_mode):
+        return parse_proto_buffer(f.read(), message)
+    if offset >= file_stat.st_size:
+        return parse_proto_buffer(b"", message)
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view, view[offset:] as data:
+            message = parse_proto_buffer(data, message)
+    f.seek(0, os.SEEK_END)
+    return message
+
+
+def read_proto_file(file_path, message=None):
     """
     Read a protobuf file and return the parsed message.
+    Every call returns an independent message unless message is given, so it is
+    safe to call from several threads.
     """
     with open(file_path, "rb") as f:
-        pb_data = f.read()
-    snapshot_files_response.ParseFromString(pb_data)
-    return snapshot_files_response
+        return read_proto_stream(f, message)
+
+def _trimmed_message_proto(descriptor, field_names, type_names=None):
+    """
+    Copy a message descriptor keeping only field_names, optionally retyping fields.
+    Synthetic oneofs of proto3 optional fields are dropped, the wire format is the same.
+    """
+    full_proto = descriptor_pb2.DescriptorProto()
+    descriptor.CopyToProto(full_proto)
+    trimmed_proto = descriptor_pb2.DescriptorProto(name=descriptor.name)
+    for field_proto in full_proto.field:
+        if field_proto.name not in field_names:
+            continue
+        field_proto.ClearField("oneof_index")
+        field_proto.ClearField("proto3_optional")
+        if type_names and field_proto.name in type_names:
+            field_proto.type_name = type_names[field_proto.name]
+        trimmed_proto.field.add().CopyFrom(field_proto)
+    return trimmed_proto
+
+
+def build_projection(name, asset_fields, azr_asset_fields=()):
+    """
+    Build a trimmed SnapshotFilesResponse message class that declares only the
+    snapshot metadata, the given SnapshotModelsAssets fields and, if any, the given
+    AzrSnapshotModelsAssets fields.
+    It is wire compatible with SnapshotFilesResponse: the parser steps over every
+    other field (events, unused assets, azr_snapshot when no Azure field is
+    requested) without decoding it.
+    """
+    package = f"te.service.cm.v1.projection.{name}"
+    pool = descriptor_pool.Default()
+    try:
+        return message_factory.GetMessageClass(pool.FindMessageTypeByName(f"{package}.SnapshotFilesResponse"))
+    except KeyError:
+        pass
+
+    response = cm_snapshot_file_response_pb2.SnapshotFilesResponse.DESCRIPTOR
+    file_proto = descriptor_pb2.FileDescriptorProto(name=f"te/service/cm/v1/projection/{name}.proto", package=package, syntax="proto3")
+    response_fields = {}
+    for snapshot_field_name, fields in (("snapshot", asset_fields), ("azr_snapshot", azr_asset_fields)):
+        if not fields:
+            continue
+        assets_snapshot = response.fields_by_name[snapshot_field_name].message_type
+        assets = assets_snapshot.fields_by_name["assets"].message_type
+        snapshot_fields = [field.name for field in assets_snapshot.fields if field.name != "events"]
+        file_proto.dependency.append(assets.file.name)
+        file_proto.message_type.append(_trimmed_message_proto(assets, fields))
+        file_proto.message_type.append(_trimmed_message_proto(assets_snapshot, snapshot_fields, {"assets": f".{package}.{assets.name}"}))
+        response_fields[snapshot_field_name] = f".{package}.{assets_snapshot.name}"
+    file_proto.message_type.append(_trimmed_message_proto(response, response_fields, response_fields))
+
+    pool.Add(file_proto)
+    return message_factory.GetMessageClass(pool.FindMessageTypeByName(f"{package}.SnapshotFilesResponse"))
+
+
+def read_projected_file(file_path, projection, stats=None):
+    """
+    Read a protobuf file into a projection message class (see build_projection).
+    Skipped fields are dropped after parsing. If stats is given, bytes_total,
+    bytes_decoded and bytes_skipped are added to it.
+    """
+    message = read_proto_file(file_path, projection())
+    message.DiscardUnknownFields()
+    if stats is not None:
+        size = os.path.getsize(file_path)
+        decoded = message.ByteSize()
+        stats["bytes_total"] += size
+        stats["bytes_decoded"] += decoded
+        stats["bytes_skipped"] += size - decoded
+    return message
+
+def _float_converter(field):
+    shortest = field.cpp_type == FieldDescriptor.CPPTYPE_FLOAT
+
+    def convert(value):
+        if math.isinf(value):
+            return "-Infinity" if value < 0.0 else "Infinity"
+        if math.isnan(value):
+            return "NaN"
+        return type_checkers.ToShortestFloat(value) if shortest else value
+
+    return convert
+
+
+def _enum_converter(field):
+    names = {number: value.name for number, value in field.enum_type.values_by_number.items()}
+
+    def convert(value):
+        return names.get(value, value)
+
+    return convert
+
+
+def _identity(value):
+    return value
+
 
-def convert_file(filepath):
+def _bytes_converter(value):
+    return base64.b64encode(value).decode("utf-8")
+
+
+def _value_converter(field):
+    """
+    Return the function converting a value of a (non-map) field as MessageToDict
+    does, or None when the value is used as is.
     """
-    Convert a protobuf file to JSON.
+    if field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE:
+        # Well-known types (Timestamp, Struct, wrappers...) have their own JSON forms.
+        return MessageToDict.MessageToDict if field.message_type.full_name.startswith("google.protobuf.") else message_to_dict
+    if field.cpp_type == FieldDescriptor.CPPTYPE_ENUM:
+        return _enum_converter(field)
+    if field.type == FieldDescriptor.TYPE_BYTES:
+        return _bytes_converter
+    if field.cpp_type in (FieldDescriptor.CPPTYPE_INT64, FieldDescriptor.CPPTYPE_UINT64):
+        return str
+    if field.cpp_type in (FieldDescriptor.CPPTYPE_FLOAT, FieldDescriptor.CPPTYPE_DOUBLE):
+        return _float_converter(field)
+    return None
+
+
+def _field_converter(field):
     """
-    filename = path.basename(filepath)
-    output_file = "output/huron/" + path.splitext(filename)[0] + ".json"
-    pb_data = read_proto_file(filepath)
-    convert_to_json_file(pb_data, output_file)
+    Return the (JSON name, converter of the whole field value) of a field, cached per field.
+    """
+    converter = _FIELD_CONVERTERS.get(field)
+    if converter is not None:
+        return converter
+    name = f"[{field.full_name}]" if field.is_extension else field.json_name
+    if field.message_type is not None and field.message_type.GetOptions().map_entry:
+        convert_value = _value_converter(field.message_type.fields_by_name["value"])
+
+        def convert(value):
+            return {
+                ("true" if key else "false") if isinstance(key, bool) else str(key): item if convert_value is None else convert_value(item)
+                for key, item in value.items()
+            }
+    elif field.is_repeated:
+        convert_value = _value_converter(field)
+
+        def convert(value):
+            return list(value) if convert_value is None else [convert_value(item) for item in value]
+    else:
+        convert = _value_converter(field) or _identity
+    converter = _FIELD_CONVERTERS[field] = (name, convert)
+    return converter
+
+
+def message_to_dict(message):
+    """
+    Same result as json_format.MessageToDict with the default options, several times
+    faster: the conversion of every field is resolved once from its descriptor.
+    """
+    if message.DESCRIPTOR.full_name.startswith("google.protobuf."):
+        return MessageToDict.MessageToDict(message)
+    result = {}
+    for field, value in message.ListFields():
+        name, convert = _field_converter(field)
+        result[name] = convert(value)
+    return result
+
+
+def export_projection(asset_fields=None, azr_asset_fields=None):
+    """
+    Return the projection message class of an export keeping only the given asset
+    collections, or None to export whole files. Raise ValueError for names that are
+    not asset collections.
+    """
+    if asset_fields is None and azr_asset_fields is None:
+        return None
+    asset_fields = tuple(asset_fields or ())
+    azr_asset_fields = tuple(azr_asset_fields or ())
+    response = cm_snapshot_file_response_pb2.SnapshotFilesResponse.DESCRIPTOR
+    for snapshot_field_name, fields in (("snapshot", asset_fields), ("azr_snapshot", azr_asset_fields)):
+        assets = response.fields_by_name[snapshot_field_name].message_type.fields_by_name["assets"].message_type
+        unknown = [name for name in fields if name not in assets.fields_by_name]
+        if unknown:
+            raise ValueError(f"Unknown {assets.name} collections: {', '.join(unknown)}")
+    key = hashlib.sha1(repr((asset_fields, azr_asset_fields)).encode()).hexdigest()[:16]
+    return build_projection(f"export_{key}", asset_fields, azr_asset_fields)
+
 
-def discover_and_convert_files(directory):
+def iter_asset_lines(message):
     """
-    Discover all .pb files in a specific directory and convert them to JSON.
+    Yield one compact JSON line per asset (and per event) of a SnapshotFilesResponse:
+    the snapshot cloud, aid, account, region and time, the collection name and the
+    asset as MessageToDict renders it.
     """
-    if not os.path.exists("output"):
-        os.makedirs("output")
+    for cloud, snapshot_field_name in (("aws", "snapshot"), ("azr", "azr_snapshot")):
+        # Projections (see export_projection) leave out the snapshots of a cloud
+        # without requested collections.
+        if snapshot_field_name not in message.DESCRIPTOR.fields_by_name:
+            continue
+        for snapshot in getattr(message, snapshot_field_name):
+            header = json.dumps({
+                "cloud": cloud,
+                "aid": snapshot.aid,
+                "accountId": snapshot.account_id,
+                "region": snapshot.region,
+                "time": snapshot.time,
+            }, separators=JSON_SEPARATORS)[:-1]
+            groups = [("", snapshot.assets)]
+            if "events" in snapshot.DESCRIPTOR.fields_by_name:
+                groups.append(("events.", snapshot.events))
+            for prefix, assets in groups:
+                for field, values in assets.ListFields():
+                    collection = json.dumps(prefix + field.json_name)
+                    for value in values:
+                        asset = json.dumps(message_to_dict(value), separators=JSON_SEPARATORS)
+                        yield f'{header},"collection":{collection},"asset":{asset}}}\n'
+
+
+def export_file(file_path, output_path, output_format="json", asset_fields=None, azr_asset_fields=None, indent=None):
+    """
+    Convert a protobuf file to a JSON (one document) or NDJSON (one line per asset,
+    streamed) file, keeping only the given asset collections if any. The output
+    replaces output_path once complete. Return the export stats.
+    """
+    start = time.perf_counter()
+    projection = export_projection(asset_fields, azr_asset_fields)
+    message = read_proto_file(file_path) if projection is None else read_proto_file(file_path, projection())
+    os.makedirs(path.dirname(output_path) or ".", exist_ok=True)
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    lines = 0
+    with open(temp_path, "w", buffering=EXPORT_BUFFER_SIZE) as f:
+        if output_format == "ndjson":
+            for line in iter_asset_lines(message):
+                f.write(line)
+                lines += 1
+        else:
+            f.write(json.dumps(message_to_dict(message), indent=indent, separators=None if indent else JSON_SEPARATORS))
+    os.replace(temp_path, output_path)
+    return Counter(
+        files=1,
+        bytes_read=os.path.getsize(file_path),
+        bytes_written=os.path.getsize(output_path),
+        lines=lines,
+        seconds=time.perf_counter() - start,
+    )
+
+
+def discover_files(directory, extension=".pb"):
+    """
+    Return the sorted paths of the files of a directory tree with the given extension.
+    """
+    file_paths = []
     for root, _, files in os.walk(directory):
         for file in files:
-            if file.endswith(".pb"):
-                file_path = os.path.join(root, file)
-                print(f"Processing file: {file_path}")
-                convert_file(file_path)
+            if file.endswith(extension):
+                file_paths.append(path.join(root, file))
+    return sorted(file_paths)
+
+
+def discover_and_convert_files(directory, output_dir="output", output_format="json", workers=1,
+                               asset_fields=None, azr_asset_fields=None, indent=None):
+    """
+    Discover all .pb files in a directory tree and export them with export_file to
+    output_dir, keeping their relative paths. With more than one worker the files
+    are exported in a process pool; 0 uses all CPU cores. Return the total stats.
+    """
+    extension = ".ndjson" if output_format == "ndjson" else ".json"
+    file_paths = discover_files(directory)
+    output_paths = [path.join(output_dir, path.splitext(path.relpath(file_path, directory))[0] + extension) for file_path in file_paths]
+    export = partial(export_file, output_format=output_format, asset_fields=asset_fields,
+                     azr_asset_fields=azr_asset_fields, indent=indent)
+    stats = Counter()
+    for output_path, file_stats in zip(output_paths, _iter_exports(export, file_paths, output_paths, workers)):
+        print(f"Exported {output_path} ({file_stats['bytes_written']} bytes) in {file_stats['seconds']:.2f}s")
+        stats.update(file_stats)
+    return stats
+
+
+def _iter_exports(export, file_paths, output_paths, workers):
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(file_paths) <= 1:
+        yield from map(export, file_paths, output_paths)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(export, file_paths, output_paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export snapshot .pb files to JSON or NDJSON.")
+    parser.add_argument("--input_dir", dest="dir_path", type=str, required=True,
+                        help="Path to the directory containing .pb files.")
+    parser.add_argument("--output_dir", dest="output_dir", type=str, default="output",
+                        help="Directory of the exported files, which keep the relative paths of the .pb files.")
+    parser.add_argument("--format", dest="output_format", choices=["json", "ndjson"], default="json",
+                        help="json: one compact document per file; ndjson: one line per asset, streamed.")
+    parser.add_argument("--indent", dest="indent", type=int, default=None,
+                        help="Indent the json documents (compact by default).")
+    parser.add_argument("--workers", dest="workers", type=int, default=1,
+                        help="Number of processes exporting the files (0 uses all CPU cores).")
+    parser.add_argument("--fields", dest="asset_fields", type=str, nargs="+", default=None,
+                        help="Only export these AWS asset collections (e.g. vpcs transitGateways).")
+    parser.add_argument("--azr-fields", dest="azr_asset_fields", type=str, nargs="+", default=None,
+                        help="Only export these Azure asset collections (e.g. vnets vnetPeerings).")
+    parser.add_argument("--topology-only", dest="topology_only", action="store_true",
+                        help="Only export the asset collections used by the topology.")
+    args = parser.parse_args()
+    if not path.isdir(args.dir_path):
+        print(f"{args.dir_path} is not a directory.")
+        return
+    asset_fields, azr_asset_fields = args.asset_fields, args.azr_asset_fields
+    if args.topology_only:
+        # ingest imports this module, import it once both are loaded.
+        from ingest import TOPOLOGY_ASSET_FIELDS, TOPOLOGY_AZR_ASSET_FIELDS
+        asset_fields, azr_asset_fields = TOPOLOGY_ASSET_FIELDS, TOPOLOGY_AZR_ASSET_FIELDS
+    elif (asset_fields is None) != (azr_asset_fields is None):
+        asset_fields, azr_asset_fields = asset_fields or (), azr_asset_fields or ()
+    try:
+        export_projection(asset_fields, azr_asset_fields)
+    except ValueError as error:
+        print(error)
+        return
+    start = time.perf_counter()
+    stats = discover_and_convert_files(args.dir_path, args.output_dir, args.output_format, args.workers,
+                                       asset_fields, azr_asset_fields, args.indent)
+    print(f"Exported {stats['files']} files ({stats['bytes_read']} bytes) to {stats['bytes_written']} bytes"
+          + (f", {stats['lines']} lines" if args.output_format == "ndjson" else "")
+          + f" in {time.perf_counter() - start:.2f}s.")
 
 if __name__ == "__main__":
-    discover_and_convert_files("source/562949953427311")
-    
\ No newline at end of file
+    main()
@@ -0,0 +1,317 @@
+import argparse
+import time
+from collections import namedtuple
+
+from cache import DEFAULT_CACHE_DIR, RecordCache
+from snapshot import load_topology
+from te.service.cm.v1 import cm_snapshot_pb2 as cm
+from utils.arn_utils import extract_resource_id, normalize_arn
+from utils.prefix_trie import PrefixTrie, format_prefix, parse_prefix
+
+# Route origins, by precedence between routes of the same destination.
+ROUTE_PRECEDENCE = {"static": 0, "prefix-list": 1, "propagated": 2}
+
+PEERING_RESOURCE_TYPES = (
+    cm.TransitGatewayRouteTableAttachmentResourceType.TGW_RT_RESOURCE_TYPE_PEERING,
+    cm.TransitGatewayRouteTableAttachmentResourceType.TGW_RT_RESOURCE_TYPE_TGW_PEERING,
+)
+INACTIVE_ROUTE_STATES = (
+    cm.TransitGatewayRouteTableRouteState.TGW_RT_ROUTE_STATE_DELETING,
+    cm.TransitGatewayRouteTableRouteState.TGW_RT_ROUTE_STATE_DELETED,
+)
+
+# attachments are the target attachment ids (several for ECMP, the first is followed).
+Route = namedtuple("Route", ["prefix", "attachments", "blackhole", "origin"])
+RouteTable = namedtuple("RouteTable", ["route_table_id", "transit_gateway", "trie"])
+Hop = namedtuple("Hop", ["route_table", "transit_gateway", "route"])
+# reason is "delivered", "not associated", "no route", "blackhole", "peer not associated",
+# "routing loop" or "delivered to <attachment>" when it is not the requested destination.
+Trace = namedtuple("Trace", ["source", "destination", "reachable", "attachment", "hops", "reason"])
+# Blackholed prefixes have reachable False and no attachment, see reachable_cidrs.
+ReachableCidr = namedtuple("ReachableCidr", ["prefix", "attachment", "resource", "hops", "reachable"], defaults=(True,))
+
+
+class ReachabilityEngine:
+    """
+    Transit gateway routing of an AwsTopology.
+    Traffic entering a TGW from an attachment is routed by the route table the
+    attachment is associated with: the longest prefix match of the destination
+    gives the target attachment, or drops the traffic for blackhole routes. Traffic
+    sent to a TGW peering attachment enters the peer TGW and is routed again by the
+    peer route table associated with the peering.
+    Each route table is indexed in a PrefixTrie the first time it is used, merging
+    its static, prefix-list and propagated routes, plus the CIDR blocks of the VPCs
+    propagating to it.
+    """
+
+    def __init__(self, net):
+        self.net = net
+        self.peerings = dict(net.tgw_peering_attachments)
+        self.associations = {}
+        self.resources = {}
+        self.resource_attachments = {}
+        self._tables = {}
+        for attachment_id, (_, resource_id) in net.tgw_attachments.items():
+            self._add_resource(attachment_id, resource_id)
+        for route_table_id, record in net.tgw_route_tables.items():
+            transit_gateway = normalize_arn(record.transitGatewayId)
+            for association in record.associations:
+                attachment_id = normalize_arn(association.transitGatewayAttachmentId)
+                self.associations.setdefault(attachment_id, {})[transit_gateway] = route_table_id
+                self._add_resource(attachment_id, association.resourceId, association.resourceType)
+            for propagation in record.propagations:
+                self._add_resource(normalize_arn(propagation.transitGatewayAttachmentId), propagation.resourceId, propagation.resourceType)
+        self.vpc_cidr_blocks = dict(net.vpc_cidr_blocks)
+        self.vpc_cidr_blocks.update((extract_resource_id(vpc_id), cidr_blocks) for vpc_id, cidr_blocks in net.vpc_cidr_blocks.items())
+
+    def _add_resource(self, attachment_id, resource_id, resource_type=None):
+        if not attachment_id or not resource_id:
+            return
+        resource_id = normalize_arn(resource_id)
+        self.resources.setdefault(attachment_id, resource_id)
+        if resource_type in PEERING_RESOURCE_TYPES:
+            self.peerings.setdefault(attachment_id, (attachment_id,))
+        for key in (resource_id, extract_resource_id(resource_id)):
+            self.resource_attachments.setdefault(key, set()).add(attachment_id)
+
+    # Index
+
+    def table_routes(self, route_table_id):
+        """
+        Return the routes of a route table as a dict of parsed prefix (see
+        parse_prefix) to Route, keeping the route of highest precedence per prefix.
+        """
+        record = self.net.tgw_route_tables[route_table_id]
+        routes = {}
+
+        def add(prefix, route):
+            try:
+                network = parse_prefix(prefix)
+            except ValueError:
+                return
+            current = routes.get(network)
+            if current is None or ROUTE_PRECEDENCE[route.origin] < ROUTE_PRECEDENCE[current.origin]:
+                routes[network] = route
+
+        for route in record.routes:
+            if route.state in INACTIVE_ROUTE_STATES:
+                continue
+            attachments = tuple(normalize_arn(target.transitGatewayAttachmentId) for target in route.transitGatewayAttachments)
+            blackhole = route.state == cm.TransitGatewayRouteTableRouteState.TGW_RT_ROUTE_STATE_BLACKHOLE or not attachments
+            if route.type == cm.TransitGatewayRouteTableRouteType.TGW_RT_ROUTE_TYPE_PROPAGATED:
+                origin = "propagated"
+            else:
+                origin = "static" if route.destinationCidrBlock else "prefix-list"
+            if route.destinationCidrBlock:
+                add(route.destinationCidrBlock, Route(None, attachments, blackhole, origin))
+            elif route.prefixListId:
+                for entry in self.net.prefix_lists.get(normalize_arn(route.prefixListId), ()):
+                    add(entry, Route(None, attachments, blackhole, origin))
+        for propagation in record.propagations:
+            attachment_id = normalize_arn(propagation.transitGatewayAttachmentId)
+            for cidr_block in self.vpc_cidr_blocks.get(normalize_arn(propagation.resourceId), ()):
+                add(cidr_block, Route(None, (attachment_id,), False, "propagated"))
+        return {network: route._replace(prefix=format_prefix(network)) for network, route in routes.items()}
+
+    def _table(self, route_table_id):
+        """
+        Return the RouteTable of a route table id, indexing its routes on first use.
+        """
+        table = self._tables.get(route_table_id)
+        if table is not None:
+            return table
+        trie = PrefixTrie()
+        for network, route in self.table_routes(route_table_id).items():
+            trie.insert(network, route)
+        table = RouteTable(route_table_id, normalize_arn(self.net.tgw_route_tables[route_table_id].transitGatewayId), trie)
+        self._tables[route_table_id] = table
+        return table
+
+    def build(self):
+        """
+        Index every route table now instead of on first use. Return the number of routes.
+        """
+        return sum(len(self._table(route_table_id).trie) for route_table_id in self.net.tgw_route_tables)
+
+    def lookup(self, route_table_id, destination):
+        """
+        Return the Route a route table selects for a destination address or CIDR block, or None.
+        """
+        match = self._table(normalize_arn(route_table_id)).trie.longest_match(destination)
+        return None if match is None else match[1]
+
+    # Queries
+
+    def attachments_of(self, source):
+        """
+        Return the attachment ids of a TGW attachment id, or of a resource ARN or id (e.g. a VPC).
+        """
+        key = normalize_arn(source)
+        if key in self.associations or key in self.resources:
+            return [key]
+        return sorted(self.resource_attachments.get(key) or self.resource_attachments.get(extract_resource_id(key), ()))
+
+    def route_table_of(self, attachment_id):
+        """
+        Return the id of the route table an attachment is associated with, or None.
+        """
+        route_tables = self.associations.get(attachment_id)
+        return next(iter(route_tables.values())) if route_tables else None
+
+    def peer_route_table(self, attachment_id, transit_gateway):
+        """
+        Return the route table of the other side of a TGW peering attachment, or None.
+        """
+        for peering_id in self.peerings.get(attachment_id, ()):
+            for peer_transit_gateway, route_table_id in self.associations.get(peering_id, {}).items():
+                if peer_transit_gateway != transit_gateway:
+                    return route_table_id
+        return None
+
+    def trace(self, attachment_id, destination):
+        """
+        Follow the traffic entering the TGW of an attachment towards a destination
+        address or CIDR block, across TGW peerings. Return a Trace.
+        """
+        attachment_id = normalize_arn(attachment_id)
+        network = parse_prefix(destination)
+        destination = format_prefix(network)
+        route_table_id = self.route_table_of(attachment_id)
+        if route_table_id is None:
+            return Trace(attachment_id, destination, False, None, (), "not associated")
+        hops = []
+        seen = set()
+        while True:
+            if route_table_id in seen:
+                return Trace(attachment_id, destination, False, None, tuple(hops), "routing loop")
+            seen.add(route_table_id)
+            table = self._table(route_table_id)
+            match = table.trie.longest_match(network)
+            if match is None:
+                return Trace(attachment_id, destination, False, None, tuple(hops), "no route")
+            route = match[1]
+            hops.append(Hop(route_table_id, table.transit_gateway, route))
+            if route.blackhole:
+                return Trace(attachment_id, destination, False, None, tuple(hops), "blackhole")
+            target = route.attachments[0]
+            if target not in self.peerings:
+                return Trace(attachment_id, destination, True, target, tuple(hops), "delivered")
+            route_table_id = self.peer_route_table(target, table.transit_gateway)
+            if route_table_id is None:
+                return Trace(attachment_id, destination, False, target, tuple(hops), "peer not associated")
+
+    def traces(self, source, destination):
+        """
+        Trace every attachment of source to destination: an address, a CIDR block,
+        or a resource (e.g. a VPC ARN or id), whose CIDR blocks must then be
+        delivered to one of its own attachments.
+        """
+        try:
+            destinations = [format_prefix(parse_prefix(destination))]
+            targets = None
+        except ValueError:
+            key = normalize_arn(destination)
+            destinations = self.vpc_cidr_blocks.get(key) or self.vpc_cidr_blocks.get(extract_resource_id(key), ())
+            targets = set(self.attachments_of(destination))
+        traces = []
+        for attachment_id in self.attachments_of(source):
+            for cidr_block in destinations:
+                trace = self.trace(attachment_id, cidr_block)
+                if targets is not None and trace.reachable and trace.attachment not in targets:
+                    trace = trace._replace(reachable=False, reason=f"delivered to {trace.attachment}")
+                traces.append(trace)
+        return traces
+
+    def can_reach(self, source, destination):
+        """
+        Return True if traffic from source reaches destination (see traces).
+        """
+        return any(trace.reachable for trace in self.traces(source, destination))
+
+    def reachable_cidrs(self, attachment_id):
+        """
+        Return the ReachableCidr of every prefix the traffic entering the TGW of an
+        attachment is delivered for, across TGW peerings, as route entries: prefixes
+        may overlap, and the most specific one decides (longest prefix match). The
+        blackholed prefixes are returned too, with reachable False, since the parts of
+        the less specific prefixes they overlap are not reachable.
+        """
+        route_table_id = self.route_table_of(normalize_arn(attachment_id))
+        reachable = []
+        if route_table_id is None:
+            return reachable
+
+        def walk(route_table_id, within, hops, seen):
+            table = self._table(route_table_id)
+            if within is None:
+                candidates = list(table.trie.items())
+            else:
+                candidates = list(table.trie.covered(within))
+                covering = table.trie.longest_match(within)
+                if covering is not None and covering[0] != within:
+                    candidates.insert(0, (within, covering[1]))
+            for network, route in candidates:
+                path = hops + (Hop(route_table_id, table.transit_gateway, route),)
+                if route.blackhole:
+                    reachable.append(ReachableCidr(network, None, None, path, False))
+                    continue
+                target = route.attachments[0]
+                if target not in self.peerings:
+                    reachable.append(ReachableCidr(network, target, self.resources.get(target), path))
+                    continue
+                peer_route_table_id = self.peer_route_table(target, table.transit_gateway)
+                if peer_route_table_id is not None and peer_route_table_id not in seen:
+                    walk(peer_route_table_id, network, path, seen | {peer_route_table_id})
+
+        walk(route_table_id, None, (), {route_table_id})
+        return reachable
+
+
+def _format_hops(hops):
+    return " -> ".join(f"{hop.route_table} ({hop.route.prefix} {hop.route.origin})" for hop in hops)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer transit gateway reachability questions from snapshots.")
+    parser.add_argument("--input_dir", dest="dir_path", type=str, required=True,
+                        help="Path to the directory containing .pb files, or a saved .topo topology file.")
+    parser.add_argument("--from", dest="source", type=str, required=True,
+                        help="Source TGW attachment id, or resource (VPC ARN or id).")
+    parser.add_argument("--to", dest="destination", type=str, default=None,
+                        help="Destination address, CIDR block or VPC. Lists every reachable CIDR block if not set.")
+    parser.add_argument("--workers", dest="workers", type=int, default=1,
+                        help="Number of processes used to parse the .pb files (0 uses all CPU cores).")
+    parser.add_argument("--full-decode", dest="topology_only", action="store_false",
+                        help="Decode every snapshot field instead of only the topology ones.")
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, default=DEFAULT_CACHE_DIR,
+                        help="Directory of the per-file topology records cache.")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                        help="Do not read or write the records cache.")
+    args = parser.parse_args()
+    cache = RecordCache(args.cache_dir) if args.use_cache else None
+    net = load_topology(args.dir_path, args.workers, args.topology_only, cache=cache, backend="compact")
+    if net is None:
+        return
+    engine = ReachabilityEngine(net)
+    start = time.perf_counter()
+    routes = engine.build()
+    print(f"Indexed {routes} routes of {len(net.tgw_route_tables)} route tables in {time.perf_counter() - start:.2f}s.")
+
+    if not engine.attachments_of(args.source):
+        print(f"No TGW attachment found for {args.source}.")
+        return
+    if args.destination is None:
+        for item in engine.reachable_cidrs(engine.attachments_of(args.source)[0]):
+            if not item.reachable:
+                print(f"{item.prefix} blackhole via {_format_hops(item.hops)}")
+                continue
+            print(f"{item.prefix} -> {item.attachment} ({item.resource or 'unknown resource'}) via {_format_hops(item.hops)}")
+        return
+    traces = engine.traces(args.source, args.destination)
+    for trace in traces:
+        status = "reachable" if trace.reachable else "unreachable"
+        print(f"{trace.source} -> {trace.destination}: {status}, {trace.reason}. {_format_hops(trace.hops)}")
+    print(f"{args.source} {'can' if any(trace.reachable for trace in traces) else 'cannot'} reach {args.destination}.")
+
+if __name__ == "__main__":
+    main()
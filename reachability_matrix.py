@@ -0,0 +1,405 @@
+import argparse
+import hashlib
+import json
+import time
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from cache import DEFAULT_CACHE_DIR, RecordCache
+from reachability import ReachabilityEngine
+from snapshot import load_topology
+from utils.arn_utils import normalize_arn, parse_arn
+from utils.prefix_trie import PrefixTrie, format_prefix, parse_prefix
+
+# Routing state of (route table, destination) cells: the index of the next route
+# table (traffic sent to a TGW peering), or one of these outcomes.
+DROPPED = -1
+DELIVERED = -2
+ELSEWHERE = -3
+_ATTACHMENT = -4
+
+# Hop counts are the number of route tables crossed, 0 when unreachable.
+UNREACHABLE = 0
+MAX_HOPS = 254
+_NO_HOPS = 255
+
+# Number of (route table, destination) cells resolved at once.
+BLOCK_CELLS = 1 << 22
+
+# VPC-to-VPC reachability of all VPCs. Sources sharing the same route tables share
+# a row of group_hops (source_groups maps VPCs to rows, -1 when not attached);
+# columns are destination VPCs. states holds the (route table, destination CIDR)
+# routing states reused by incremental updates.
+ReachabilityMatrix = namedtuple("ReachabilityMatrix", [
+    "vpc_ids", "table_ids", "table_fingerprints", "topology_fingerprint",
+    "destination_vpcs", "destination_cidrs", "states", "source_groups", "group_hops",
+])
+
+
+def _fingerprint(value):
+    return hashlib.sha1(repr(value).encode()).hexdigest()
+
+
+def topology_fingerprint(engine):
+    """
+    Fingerprint of what routing states depend on beyond the routes of their route
+    table: associations, peerings and the resources of the attachments.
+    """
+    return _fingerprint((
+        sorted((attachment_id, sorted(tables.items())) for attachment_id, tables in engine.associations.items()),
+        sorted(engine.peerings.items()),
+        sorted(engine.resources.items()),
+    ))
+
+
+def table_fingerprint(engine, route_table_id):
+    """
+    Fingerprint of the routes of a route table, propagated VPC CIDR blocks and
+    referenced prefix lists included.
+    """
+    record = engine.net.tgw_route_tables[route_table_id]
+    return _fingerprint((
+        record,
+        [engine.vpc_cidr_blocks.get(normalize_arn(propagation.resourceId)) for propagation in record.propagations],
+        [engine.net.prefix_lists.get(normalize_arn(route.prefixListId)) for route in record.routes if route.prefixListId],
+    ))
+
+
+def _vpc_ids(engine):
+    vpc_ids = set(engine.net.vpc_cidr_blocks)
+    vpc_ids.update(resource_id for _, resource_id in engine.net.tgw_attachments.values() if parse_arn(resource_id).resource_type == "vpc")
+    return sorted(vpc_ids)
+
+
+def _table_states(engine, route_table_id, table_index, destinations, attachment_codes, member_codes, vpc_count):
+    """
+    Return the routing state of a route table for every destination, a tuple of
+    (version, IPv4 network or 0, network, length, vpc index) arrays. member_codes holds the
+    attachment code * vpc_count + vpc index of every VPC attachment.
+    IPv4 destinations are matched with one vectorized search per route prefix length.
+    """
+    versions, keys, networks, lengths, vpcs = destinations
+    transit_gateway = normalize_arn(engine.net.tgw_route_tables[route_table_id].transitGatewayId)
+    routes = engine.table_routes(route_table_id)
+
+    targets = {}
+    route_states = []
+    route_attachments = []
+    for route in routes.values():
+        target = route.attachments[0] if route.attachments else None
+        if route.blackhole:
+            route_states.append(DROPPED)
+        elif target in engine.peerings:
+            peer = engine.peer_route_table(target, transit_gateway)
+            route_states.append(DROPPED if peer is None else table_index[peer])
+        else:
+            route_states.append(_ATTACHMENT)
+        route_attachments.append(targets.setdefault(target, len(targets)) if target else -1)
+    route_states.append(DROPPED)
+    route_attachments.append(-1)
+    route_states = np.array(route_states, dtype=np.int64)
+    route_attachments = np.array(route_attachments, dtype=np.int64)
+
+    # Index of the matched route of every destination, len(routes) when none.
+    matches = np.full(len(keys), len(routes), dtype=np.int64)
+    prefixes = list(routes)
+    ipv4 = np.array([version == 4 for version, _, _ in prefixes], dtype=bool)
+    route_keys = np.array([key for _, key, _ in prefixes], dtype=object)
+    route_lengths = np.array([length for _, _, length in prefixes], dtype=np.int64)
+    pending = np.flatnonzero(versions == 4)
+    for length in sorted(set(route_lengths[ipv4].tolist()), reverse=True):
+        selected = np.flatnonzero(ipv4 & (route_lengths == length))
+        order = np.argsort(route_keys[selected].astype(np.int64), kind="stable")
+        selected = selected[order]
+        sorted_keys = route_keys[selected].astype(np.int64)
+        candidates = pending[lengths[pending] >= length]
+        masked = keys[candidates] >> (32 - length) << (32 - length)
+        positions = np.minimum(np.searchsorted(sorted_keys, masked), len(sorted_keys) - 1)
+        hits = sorted_keys[positions] == masked
+        matches[candidates[hits]] = selected[positions[hits]]
+        pending = np.setdiff1d(pending, candidates[hits], assume_unique=True)
+    ipv6 = np.flatnonzero(versions == 6)
+    if len(ipv6):
+        trie = PrefixTrie()
+        for index, prefix in enumerate(prefixes):
+            if prefix[0] == 6:
+                trie.insert(prefix, index)
+        for destination in ipv6.tolist():
+            match = trie.longest_match((6, networks[destination], int(lengths[destination])))
+            if match is not None:
+                matches[destination] = match[1]
+
+    states = route_states[matches]
+    attached = np.flatnonzero(states == _ATTACHMENT)
+    if len(attached):
+        codes = np.array([attachment_codes.get(target, -1) for target in targets], dtype=np.int64)
+        attachments = codes[route_attachments[matches[attached]]]
+        delivered = (attachments >= 0) & np.isin(attachments * vpc_count + vpcs[attached], member_codes)
+        states[attached] = np.where(delivered, DELIVERED, ELSEWHERE)
+    return states.astype(np.int32)
+
+
+def _resolve(states):
+    """
+    Follow the route table chains of a block of routing states by pointer jumping.
+    Return the hop counts (_NO_HOPS when not delivered) as uint8.
+    """
+    table_count = states.shape[0]
+    failed, delivered = table_count, table_count + 1
+    following = np.empty((table_count + 2, states.shape[1]), dtype=np.int64)
+    following[:table_count] = np.where(states >= 0, states, np.where(states == DELIVERED, delivered, failed))
+    following[failed] = failed
+    following[delivered] = delivered
+    hops = np.ones_like(following)
+    hops[table_count:] = 0
+    for _ in range(max(1, int(np.ceil(np.log2(table_count + 2)))) + 1):
+        hops = hops + np.take_along_axis(hops, following, axis=0)
+        following = np.take_along_axis(following, following, axis=0)
+    reached = following[:table_count] == delivered
+    return np.where(reached, np.minimum(hops[:table_count], MAX_HOPS), _NO_HOPS).astype(np.uint8)
+
+
+def compute_matrix(engine, previous=None, stats=None):
+    """
+    Compute the ReachabilityMatrix of a ReachabilityEngine. Every route table is
+    matched against every VPC CIDR block in bulk, then the chains across TGW
+    peerings are resolved for all cells at once (a transitive closure of the
+    route tables). With a previous matrix of the same topology fingerprint, the
+    states of route tables whose routes did not change are reused and only new
+    destinations are matched. Stats are added to stats if given.
+    """
+    start = time.perf_counter()
+    vpc_ids = _vpc_ids(engine)
+    vpc_index = {vpc_id: index for index, vpc_id in enumerate(vpc_ids)}
+    table_ids = sorted(engine.net.tgw_route_tables)
+    table_index = {table_id: index for index, table_id in enumerate(table_ids)}
+    fingerprints = [table_fingerprint(engine, table_id) for table_id in table_ids]
+    topology = topology_fingerprint(engine)
+
+    destination_vpcs, destination_cidrs, parsed = [], [], []
+    for vpc_id in vpc_ids:
+        for cidr_block in sorted(set(engine.vpc_cidr_blocks.get(vpc_id, ()))):
+            try:
+                prefix = parse_prefix(cidr_block)
+            except ValueError:
+                continue
+            destination_vpcs.append(vpc_index[vpc_id])
+            destination_cidrs.append(format_prefix(prefix))
+            parsed.append(prefix)
+    # IPv6 networks do not fit in int64, they are kept as Python ints.
+    networks = np.empty(len(parsed), dtype=object)
+    networks[:] = [key for _, key, _ in parsed]
+    destinations = (
+        np.array([version for version, _, _ in parsed], dtype=np.int64),
+        np.array([key if version == 4 else 0 for version, key, _ in parsed], dtype=np.int64),
+        networks,
+        np.array([length for _, _, length in parsed], dtype=np.int64),
+        np.array(destination_vpcs, dtype=np.int64),
+    )
+
+    attachment_codes = {}
+    member_codes = []
+    for vpc_id in vpc_ids:
+        for attachment_id in engine.attachments_of(vpc_id):
+            code = attachment_codes.setdefault(attachment_id, len(attachment_codes))
+            member_codes.append(code * len(vpc_ids) + vpc_index[vpc_id])
+    member_codes = np.array(member_codes, dtype=np.int64)
+
+    def match(table_id, subset):
+        return _table_states(engine, table_id, table_index, subset, attachment_codes, member_codes, len(vpc_ids))
+
+    states = np.empty((len(table_ids), len(parsed)), dtype=np.int32)
+    reusable = previous is not None and previous.topology_fingerprint == topology and len(previous.destination_cidrs) > 0
+    old_tables = {table_id: index for index, table_id in enumerate(previous.table_ids)} if reusable else {}
+    old_columns = {}
+    if reusable:
+        old_columns = {(previous.vpc_ids[vpc], cidr): index for index, (vpc, cidr) in enumerate(zip(previous.destination_vpcs.tolist(), previous.destination_cidrs))}
+    columns = np.array([old_columns.get((vpc_ids[vpc], cidr), -1) for vpc, cidr in zip(destination_vpcs, destination_cidrs)], dtype=np.int64)
+    new_columns = np.flatnonzero(columns < 0)
+    remap = np.array([table_index.get(table_id, DROPPED) for table_id in (previous.table_ids if reusable else [])], dtype=np.int32)
+    counts = Counter()
+    for index, table_id in enumerate(table_ids):
+        old = old_tables.get(table_id)
+        if old is None or previous.table_fingerprints[old] != fingerprints[index]:
+            states[index] = match(table_id, destinations)
+            counts["matrix_tables_matched"] += 1
+            continue
+        row = previous.states[old, np.maximum(columns, 0)]
+        states[index] = np.where(row >= 0, remap[np.maximum(row, 0)], row)
+        if len(new_columns):
+            subset = tuple(array[new_columns] for array in destinations)
+            states[index, new_columns] = match(table_id, subset)
+        counts["matrix_tables_reused"] += 1
+
+    # Hops of every route table to every VPC, the best over its CIDR blocks.
+    table_hops = np.full((len(table_ids), len(vpc_ids)), _NO_HOPS, dtype=np.uint8)
+    block = max(1, BLOCK_CELLS // max(1, len(table_ids)))
+    vpcs = destinations[4]
+    for begin in range(0, len(parsed), block):
+        hops = _resolve(states[:, begin:begin + block])
+        block_vpcs = vpcs[begin:begin + block]
+        starts = np.flatnonzero(np.concatenate([[True], block_vpcs[1:] != block_vpcs[:-1]]))
+        reduced = np.minimum.reduceat(hops, starts, axis=1)
+        targets = block_vpcs[starts]
+        table_hops[:, targets] = np.minimum(table_hops[:, targets], reduced)
+
+    groups = {}
+    source_groups = np.full(len(vpc_ids), -1, dtype=np.int32)
+    for vpc_id in vpc_ids:
+        tables = tuple(sorted({table_index[table_id] for table_id in
+                               (engine.route_table_of(attachment_id) for attachment_id in engine.attachments_of(vpc_id))
+                               if table_id is not None}))
+        if tables:
+            source_groups[vpc_index[vpc_id]] = groups.setdefault(tables, len(groups))
+    group_hops = np.full((len(groups), len(vpc_ids)), _NO_HOPS, dtype=np.uint8)
+    for tables, group in groups.items():
+        group_hops[group] = table_hops[list(tables)].min(axis=0)
+    group_hops[group_hops == _NO_HOPS] = UNREACHABLE
+
+    if stats is not None:
+        stats.update(counts)
+        stats["matrix_vpcs"] += len(vpc_ids)
+        stats["matrix_destinations"] += len(parsed)
+        stats["matrix_route_tables"] += len(table_ids)
+        stats["matrix_seconds"] += time.perf_counter() - start
+    return ReachabilityMatrix(vpc_ids, table_ids, fingerprints, topology,
+                              np.array(destination_vpcs, dtype=np.int32), destination_cidrs, states, source_groups, group_hops)
+
+
+def _rows(matrix, sources, destinations=None):
+    """
+    Return the hops from the given source VPC indices to all VPCs, or to the
+    given destination VPC indices.
+    """
+    group_hops = matrix.group_hops if destinations is None else matrix.group_hops[:, destinations]
+    padded = np.vstack([group_hops, np.zeros((1, group_hops.shape[1]), dtype=np.uint8)])
+    return padded[matrix.source_groups[sources]]
+
+
+def vpc_hops(matrix, source, destination):
+    """
+    Return the route tables crossed from a VPC to another (0 when unreachable).
+    """
+    index = {vpc_id: position for position, vpc_id in enumerate(matrix.vpc_ids)}
+    source, destination = index[normalize_arn(source)], index[normalize_arn(destination)]
+    group = matrix.source_groups[source]
+    return 0 if group < 0 else int(matrix.group_hops[group, destination])
+
+
+def dense_matrix(matrix):
+    """
+    Return the full VPC x VPC hop matrix (uint8). Needs vpc count squared bytes.
+    """
+    return _rows(matrix, np.arange(len(matrix.vpc_ids)))
+
+
+def matrix_summary(matrix, block=1024):
+    """
+    Return the JSON-serializable summary of a ReachabilityMatrix: reachable pairs
+    (a VPC and itself excluded), hop histogram, isolated VPCs and asymmetric pairs.
+    """
+    vpc_count = len(matrix.vpc_ids)
+    histogram = Counter()
+    asymmetric = 0
+    isolated = 0
+    for begin in range(0, vpc_count, block):
+        sources = np.arange(begin, min(begin + block, vpc_count))
+        rows = _rows(matrix, sources)
+        rows[np.arange(len(sources)), sources] = UNREACHABLE
+        counts = np.bincount(rows.ravel(), minlength=MAX_HOPS + 1)
+        histogram.update({hops: int(count) for hops, count in enumerate(counts.tolist()) if hops and count})
+        isolated += int(np.count_nonzero(~rows.any(axis=1)))
+        # Reverse direction: the rows of every VPC restricted to the block columns.
+        reverse = _rows(matrix, np.arange(vpc_count), sources).T
+        reverse[np.arange(len(sources)), sources] = UNREACHABLE
+        asymmetric += int(np.count_nonzero((rows > 0) != (reverse > 0)))
+    return {
+        "vpcs": vpc_count,
+        "attached_vpcs": int(np.count_nonzero(matrix.source_groups >= 0)),
+        "route_tables": len(matrix.table_ids),
+        "source_groups": len(matrix.group_hops),
+        "reachable_pairs": sum(histogram.values()),
+        "unreachable_pairs": vpc_count * (vpc_count - 1) - sum(histogram.values()),
+        "asymmetric_pairs": asymmetric,
+        "isolated_vpcs": isolated,
+        "hops": {str(hops): count for hops, count in sorted(histogram.items())},
+    }
+
+
+def save_matrix(matrix, path):
+    """
+    Write a ReachabilityMatrix to a compressed .npz file.
+    """
+    np.savez_compressed(
+        path,
+        vpc_ids=np.array(matrix.vpc_ids, dtype=str),
+        table_ids=np.array(matrix.table_ids, dtype=str),
+        table_fingerprints=np.array(matrix.table_fingerprints, dtype=str),
+        topology_fingerprint=np.array(matrix.topology_fingerprint),
+        destination_vpcs=matrix.destination_vpcs,
+        destination_cidrs=np.array(matrix.destination_cidrs, dtype=str),
+        states=matrix.states,
+        source_groups=matrix.source_groups,
+        group_hops=matrix.group_hops,
+    )
+
+
+def load_matrix(path):
+    """
+    Read a ReachabilityMatrix written by save_matrix.
+    """
+    with np.load(path) as data:
+        return ReachabilityMatrix(
+            data["vpc_ids"].tolist(),
+            data["table_ids"].tolist(),
+            data["table_fingerprints"].tolist(),
+            str(data["topology_fingerprint"]),
+            data["destination_vpcs"],
+            data["destination_cidrs"].tolist(),
+            data["states"],
+            data["source_groups"],
+            data["group_hops"],
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute the VPC-to-VPC transit gateway reachability matrix.")
+    parser.add_argument("--input_dir", dest="dir_path", type=str, required=True,
+                        help="Path to the directory containing .pb files, or a saved .topo topology file.")
+    parser.add_argument("--output", dest="output_file", type=str, default="reachability_matrix.npz",
+                        help="Path to the compressed matrix file.")
+    parser.add_argument("--summary", dest="summary_file", type=str, default=None,
+                        help="Path to the JSON summary (printed to stdout if not set).")
+    parser.add_argument("--previous", dest="previous_file", type=str, default=None,
+                        help="Matrix file of a previous run to update incrementally.")
+    parser.add_argument("--workers", dest="workers", type=int, default=1,
+                        help="Number of processes used to parse the .pb files (0 uses all CPU cores).")
+    parser.add_argument("--full-decode", dest="topology_only", action="store_false",
+                        help="Decode every snapshot field instead of only the topology ones.")
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, default=DEFAULT_CACHE_DIR,
+                        help="Directory of the per-file topology records cache.")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                        help="Do not read or write the records cache.")
+    args = parser.parse_args()
+    cache = RecordCache(args.cache_dir) if args.use_cache else None
+    net = load_topology(args.dir_path, args.workers, args.topology_only, cache=cache, backend="compact")
+    if net is None:
+        return
+    previous = load_matrix(args.previous_file) if args.previous_file else None
+    stats = Counter()
+    matrix = compute_matrix(ReachabilityEngine(net), previous, stats)
+    save_matrix(matrix, args.output_file)
+    print(f"Computed the reachability of {stats['matrix_vpcs']} VPCs ({stats['matrix_destinations']} CIDR blocks) through "
+          f"{stats['matrix_route_tables']} route tables in {stats['matrix_seconds']:.2f}s, "
+          f"{stats['matrix_tables_reused']} route tables reused from the previous matrix.")
+    summary = matrix_summary(matrix)
+    if args.summary_file is None:
+        print(json.dumps(summary, indent=2))
+    else:
+        with open(args.summary_file, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"{summary['reachable_pairs']} of {summary['vpcs'] * (summary['vpcs'] - 1)} VPC pairs are reachable.")
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,31 @@ import json
 from pyvis.network import Network
 import networkx as nx
 import os
-from prot import read_proto_file
+from cache import DEFAULT_CACHE_DIR, LayoutCache, RecordCache
+from ingest import iter_cached_file_records, iter_file_records, apply_records, latest_snapshots
 from te.service.cm.v1 import cm_snapshot_pb2 as cm
 import argparse
+import cProfile
+import time
+from collections import Counter
+
+from compact_graph import CompactGraph
+from html_lod import LOD_MODES, write_lod_html
+from html_renderer import write_html
+from html_shards import write_sharded_html
+from layout import LAYOUTS, compute_layout
+from metrics import build_metrics, format_phases, profile_functions, write_metrics
+from styles import topology_edge_attributes, topology_node_attributes
+from topology_file import MappedGraph, is_topology_file, write_topology_file
+from topology_components import ComponentTracker
+from topology_groups import GROUPINGS, GroupedView
+from topology_index import INDEX_FIELDS, TopologyIndex
+from utils.arn_utils import normalize_arn, parse_arn, reconstruct_arn
+from utils.azure_id_utils import extract_subscription_from_id, normalize_azure_id
+
+# Smallest connected component drawn by default.
+MIN_COMPONENT_SIZE = 10
 
-from utils.arn_utils import extract_account_region_from_arn, reconstruct_arn
-from constants import *
-
-TGW_URL = "images/tgw.svg"
 def read_json_file(file_path):
     """
     Read a JSON file and return the parsed data.
@@ -28,124 +45,368 @@ def get_files(directory, extension=".pb"):
             if file.endswith(extension):
                 file_path = os.path.join(root, file)
                 file_paths.append(file_path)
-    return file_paths
+    return sorted(file_paths)
 
+def render_graph(graph, output_file, stats=None, layout="physics", layout_cache=None):
+    """
+    Write the HTML page of a graph (networkx.Graph or CompactGraph).
+    With layout "force" or "hierarchical" the node positions are computed here
+    (see compute_layout, cached in layout_cache) and the browser physics is disabled.
+    """
+    pyvis_graph = Network(notebook=True, cdn_resources="remote", height="1440px", width="100%",select_menu=True, filter_menu=True)
+    positions = None
+    if layout == "physics":
+        pyvis_graph.toggle_physics(True)
+        pyvis_graph.force_atlas_2based()
+    else:
+        positions = compute_layout(graph, layout, layout_cache, stats)
+        pyvis_graph.toggle_physics(False)
+    write_html(graph, output_file, pyvis_graph, positions, stats=stats)
 
-class AwsTopology:
-    def __init__(self):
-        self.network = nx.Graph()
 
-    def __init__(self, network=None):
-        if network is None:
+# AwsTopology routing data (not drawn), saved with the graph in topology files.
+ROUTING_ATTRIBUTES = (
+    "vpc_cidr_blocks",
+    "tgw_attachments",
+    "tgw_peering_attachments",
+    "tgw_route_tables",
+    "prefix_lists",
+    "vpc_peerings",
+    "subnets",
+    "vpc_route_tables",
+)
+
+
+class AwsTopology:
+    def __init__(self, network=None, backend="networkx"):
+        if network is not None:
+            self.network = network.copy()
+        elif backend == "compact":
+            self.network = CompactGraph()
+        else:
             self.network = nx.Graph()
+        self.compact = isinstance(self.network, CompactGraph)
+        # Built on first query so that building the topology does not pay for it, see
+        # index and grouped_view.
+        self._index = None
+        self._grouped_views = {}
+        # The built views, kept up to date by the node and edge methods. Components
+        # are tracked from the start for a new topology (see components).
+        self._views = []
+        self._components = None
+        if network is None:
+            self._components = ComponentTracker()
+            self._views.append(self._components)
+        # Routing data used by the reachability module, keyed by normalized ids.
+        self.vpc_cidr_blocks = {}
+        self.tgw_attachments = {}
+        self.tgw_peering_attachments = {}
+        self.tgw_route_tables = {}
+        self.prefix_lists = {}
+        self.vpc_peerings = {}
+        # Subnets and VPC route tables, only loaded with vpc_routing (see create_graph).
+        self.subnets = {}
+        self.vpc_route_tables = {}
+
+    def _add_node(self, node_id, resource_type, name=None, account=None, region=None):
+        """
+        Add or update a node. Only the topology attributes are stored: presentation
+        is derived from them when drawn (see styles.node_attributes).
+        """
+        if self.compact:
+            self.network.add_node(node_id, resource_type, name, account, region)
         else:
-            self.network = network.copy()
+            self.network.add_node(node_id, **topology_node_attributes(resource_type, name, account, region))
+        for view in self._views:
+            view.add_node(node_id, resource_type, name, account, region)
+
+    def _add_edge(self, node_id, other_node_id, kind, title=None):
+        """
+        Add or update an edge. Only the kind and title are stored, see _add_node.
+        """
+        if self.compact:
+            self.network.add_edge(node_id, other_node_id, kind, title)
+        else:
+            self.network.add_edge(node_id, other_node_id, **topology_edge_attributes(kind, title))
+        for view in self._views:
+            view.set_edge(node_id, other_node_id, kind, title)
+
+    def _set_node(self, node_id, resource_type, name=None, account=None, region=None):
+        """
+        Add a node or replace all its attributes. Untyped nodes have no attributes.
+        """
+        if not self.compact:
+            # networkx nodes only keep account and region with a type and both set,
+            # untyped nodes no name either.
+            if resource_type is None:
+                name = None
+            if not (resource_type is not None and account and region):
+                account = region = None
+        for view in self._views:
+            view.set_node(node_id, resource_type, name, account, region)
+        if self.compact:
+            self.network.set_node(node_id, resource_type, name, account, region)
+            return
+        self.network.add_node(node_id)
+        data = self.network.nodes[node_id]
+        data.clear()
+        if resource_type is not None:
+            data.update(topology_node_attributes(resource_type, name, account, region))
+
+    def _set_edge(self, node_id, other_node_id, kind, title=None):
+        """
+        Add an edge or replace all its attributes.
+        """
+        for view in self._views:
+            view.set_edge(node_id, other_node_id, kind, title)
+        if self.compact:
+            self.network.add_edge(node_id, other_node_id, kind, title)
+            return
+        self.network.add_edge(node_id, other_node_id)
+        data = self.network.edges[node_id, other_node_id]
+        data.clear()
+        data.update(topology_edge_attributes(kind, title))
+
+    def remove_edges(self, edges):
+        """
+        Remove the given (source, target) edges; missing edges are ignored.
+        """
+        edges = [edge for edge in edges if self.network.has_edge(*edge)]
+        for view in self._views:
+            for edge in edges:
+                view.remove_edge(*edge)
+        self.network.remove_edges_from(edges)
+
+    def remove_nodes(self, node_ids):
+        """
+        Remove the given nodes and their edges; missing nodes are ignored.
+        """
+        for view in self._views:
+            for node_id in node_ids:
+                view.remove_node(node_id)
+        self.network.remove_nodes_from(node_ids)
+
+    def _records(self):
+        """
+        Return the node and edge records of the graph, see CompactGraph.node_records.
+        """
+        if self.compact:
+            return self.network.node_records(), self.network.edge_records()
+        node_records = ((node_id, data.get("resource_type"), data.get("name"), data.get("account"), data.get("region"))
+                        for node_id, data in self.network.nodes(data=True))
+        edge_records = ((source, target, data.get("kind"), data.get("title")) for source, target, data in self.network.edges(data=True))
+        return node_records, edge_records
+
+    @property
+    def index(self):
+        """
+        The TopologyIndex of the topology. It is built from the graph on first use,
+        then kept up to date by the add_*, _set_* and remove_* methods.
+        """
+        if self._index is None:
+            self._index = TopologyIndex.from_records(*self._records())
+            self._views.append(self._index)
+        return self._index
+
+    @property
+    def components(self):
+        """
+        The ComponentTracker of the topology: maintained while the topology is built,
+        built on first use for an existing graph or file, and rebuilt after edges or
+        nodes were removed.
+        """
+        if self._components is None or self._components.stale:
+            if self._components is not None:
+                self._views.remove(self._components)
+            if isinstance(self.network, MappedGraph):
+                self._components = ComponentTracker.from_components(self.network.connected_components())
+            else:
+                self._components = ComponentTracker.from_records(*self._records())
+            self._views.append(self._components)
+        return self._components
+
+    def component_size(self, node_id):
+        """
+        Return the number of nodes of the connected component of a node.
+        """
+        return self.components.component_size(node_id)
+
+    def grouped_view(self, grouping="account-region"):
+        """
+        Return the GroupedView of the topology for a grouping of GROUPINGS. Like the
+        index it is built on first use, then kept up to date.
+        """
+        if grouping not in GROUPINGS:
+            raise ValueError(f"Unknown grouping: {grouping}")
+        view = self._grouped_views.get(grouping)
+        if view is None:
+            view = self._grouped_views[grouping] = GroupedView.from_records(*self._records(), grouping)
+            self._views.append(view)
+        return view
+
+    def query(self, resource_type=None, account=None, region=None, tgw=None):
+        """
+        Return the sorted ids of the nodes of a resource type, account and region,
+        attached to a transit gateway (ARN or tgw-... id); see TopologyIndex.query.
+        """
+        return self.index.query(resource_type, account, region, tgw)
+
+    def count(self, field="resource_type", value=None):
+        """
+        Return the number of nodes whose field ("resource_type", "account" or
+        "region") has this value, or the counts of every value if value is None.
+        """
+        if field not in INDEX_FIELDS:
+            raise ValueError(f"Unknown index field: {field}")
+        return self.index.counts(field) if value is None else self.index.count(field, value)
+
+    def type_counts(self):
+        """
+        Return the Counters of the nodes by resource type ("unknown" for untyped
+        nodes) and of the edges by kind, in one pass over the graph.
+        """
+        node_records, edge_records = self._records()
+        return Counter(record[1] or "unknown" for record in node_records), Counter(record[2] for record in edge_records)
+
+    def to_networkx(self):
+        """
+        Return the topology as a networkx.Graph with its presentation attributes,
+        converting the graph on demand.
+        """
+        graph = self.network if self.compact else CompactGraph.from_networkx(self.network)
+        return graph.to_networkx()
+
+    def save(self, file_path):
+        """
+        Write the topology and its routing data to a topology file (see topology_file).
+        """
+        graph = self.network if self.compact else CompactGraph.from_networkx(self.network)
+        write_topology_file(file_path, graph, {name: getattr(self, name) for name in ROUTING_ATTRIBUTES})
+
+    @classmethod
+    def load(cls, file_path, writable=False):
+        """
+        Open a topology file written by save. The graph is memory-mapped and read-only
+        (a MappedGraph, queried like the compact backend) unless writable, in which
+        case it is copied to a CompactGraph.
+        """
+        graph = MappedGraph(file_path)
+        net = cls(backend="compact")
+        net.network = graph.to_compact() if writable else graph
+        net._components = None
+        net._views.clear()
+        # The routing data is only unpickled when first used (see __getattr__): its
+        # size grows with the topology and drawing or querying it does not need it.
+        for name in ROUTING_ATTRIBUTES:
+            delattr(net, name)
+        net._routing_graph = graph
+        return net
+
+    def __getattr__(self, name):
+        """
+        Load the routing data of a topology opened with load on first access.
+        """
+        graph = self.__dict__.get("_routing_graph")
+        if name not in ROUTING_ATTRIBUTES or graph is None:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        del self._routing_graph
+        routing = graph.routing()
+        for routing_name in ROUTING_ATTRIBUTES:
+            setattr(self, routing_name, routing.get(routing_name, {}))
+        return getattr(self, name)
 
     def add_transit_gateway(self, tgw_id, name=None):
         """ 
         Add a transit gateway to the network.
         """
-        if tgw_id in self.network.nodes and name is None:
+        arn = parse_arn(tgw_id)
+        if self.network.has_node(arn.id) and name is None:
             return
-        
-        self.network.add_node(tgw_id, label="TGW", title=f"{tgw_id}\n{name}", name=name, image=TGW_URL, shape="image", resource_type="tgw", level=1, size=TRANSIT_GATEAWAY_NODE_SIZE)
-        account_id, region_id = extract_account_region_from_arn(tgw_id)
-        if account_id and region_id:
-            self.network.nodes[tgw_id]['account'] = account_id
-            self.network.nodes[tgw_id]['region'] = region_id
+        self._add_node(arn.id, "tgw", name, arn.account, arn.region)
 
-    def add_vpc(self, vpc_arn, name=None):
+    def add_vpc(self, vpc_arn, name=None, cidr_blocks=()):
         """ 
         Add a VPC to the network with data account and region.
         """
-        vpc_id = vpc_arn.replace("garn:", "arn:").lower()
-        # vpc_id = self.arn_group_by_account_region(vpc_id)
-        if vpc_id in self.network.nodes and name is None:
+        arn = parse_arn(vpc_arn)
+        if cidr_blocks:
+            self.vpc_cidr_blocks[arn.id] = cidr_blocks
+        if self.network.has_node(arn.id) and name is None:
             return
-        account_id, region_id = extract_account_region_from_arn(vpc_arn)
-        
-        self.network.add_node(vpc_id, label="VPC",resource_type="vpc", title=f"{vpc_id}\n{name}", image="images/vpc.svg", shape="image", level=2, size=VPC_NODE_SIZE)
-        if account_id and region_id:
-            self.network.nodes[vpc_id]['account'] = account_id
-            self.network.nodes[vpc_id]['region'] = region_id
+        self._add_node(arn.id, "vpc", name, arn.account, arn.region)
     
-    def add_vpn_gateway(self, arn, name=None):
+    def add_vpn_gateway(self, vpn_arn, name=None):
         """ 
         Add a VPN gateway to the network.
         """
-        vpn_id = arn.replace("garn:", "arn:").lower()
-        account_id, region_id = extract_account_region_from_arn(vpn_id)
-        self.network.add_node(vpn_id, label="VPN", resource_type="vpn-gateway", title=vpn_id, image="images/vpn-gateway.svg", shape="image", level=3, size=VPN_NODE_SIZE)
-        if account_id and region_id:
-            self.network.nodes[vpn_id]['account'] = account_id
-            self.network.nodes[vpn_id]['region'] = region_id
+        arn = parse_arn(vpn_arn)
+        self._add_node(arn.id, "vpn-gateway", name, arn.account, arn.region)
         
-    def add_vpn_connection(self, arn):
+    def add_vpn_connection(self, vpn_arn):
         """ 
         Add a VPN connection to the network.
         """
-        vpn_id = arn.replace("garn:", "arn:").lower()
-        account_id, region_id = extract_account_region_from_arn(vpn_id)
-        self.network.add_node(vpn_id, label="VPN", resource_type="vpn-connection", title=vpn_id, image="images/vpn-connection.svg", shape="image", level=3, size=VPN_NODE_SIZE)
-        if account_id and region_id:
-            self.network.nodes[vpn_id]['account'] = account_id
-            self.network.nodes[vpn_id]['region'] = region_id
+        arn = parse_arn(vpn_arn)
+        self._add_node(arn.id, "vpn-connection", None, arn.account, arn.region)
 
-    def add_direct_connect_gateway(self, arn, name=None):
+    def add_direct_connect_gateway(self, dcg_arn, name=None):
         """ 
         Add a Direct Connect gateway to the network.
         """
-        if arn in self.network.nodes and name is None:
+        arn = parse_arn(dcg_arn)
+        if self.network.has_node(arn.id) and name is None:
             return
-        dcg_id = arn.replace("garn:", "arn:").lower()
-        account_id, region_id = extract_account_region_from_arn(dcg_id)
-        self.network.add_node(dcg_id, label="DCG", resource_type="direct-connect-gateway", title=f"{dcg_id}\n{name}", image="images/direct-connect-gateway.svg", shape="image", level=0, size=DIRECT_CONNECT_NODE_SIZE)
-        if account_id and region_id:
-            self.network.nodes[dcg_id]['account'] = account_id
-            self.network.nodes[dcg_id]['region'] = region_id
-
-    def add_direct_connect_connection(self, arn, name=None):
+        self._add_node(arn.id, "direct-connect-gateway", name, arn.account, arn.region)
+
+    def add_direct_connect_connection(self, dc_arn, name=None):
         """ 
         Add a Direct Connect connection to the network.
         """
-        dc_id = arn.replace("garn:", "arn:").lower()
-        account_id, region_id = extract_account_region_from_arn(dc_id)
-        self.network.add_node(dc_id, label="DC", resource_type="direct-connect-connection", title=f"{dc_id}\n{name}", image="images/direct-connect-connection.svg", shape="image", level=0, size=DIRECT_CONNECT_NODE_SIZE)
-        if account_id and region_id:
-            self.network.nodes[dc_id]['resource_type'] = "direct-connect-connection"
-            self.network.nodes[dc_id]['account'] = account_id
-            self.network.nodes[dc_id]['region'] = region_id
+        arn = parse_arn(dc_arn)
+        self._add_node(arn.id, "direct-connect-connection", name, arn.account, arn.region)
 
     def add_vpc_peering(self, vpc_id, peer_vpc_id, connection_id):
         """ 
         Add a VPC peering connection to the network.
         """
-        vpc_id = vpc_id.replace("garn:", "arn:").lower()
-        peer_vpc_id = peer_vpc_id.replace("garn:", "arn:").lower()
+        vpc_id = normalize_arn(vpc_id)
+        peer_vpc_id = normalize_arn(peer_vpc_id)
         self.add_vpc(vpc_id)
         self.add_vpc(peer_vpc_id)
-        self.network.add_edge(vpc_id, peer_vpc_id, color="green", title=connection_id, weight=VPC_PEER_WIDTH)
+        self._add_edge(vpc_id, peer_vpc_id, "vpc-peering", connection_id)
+        if connection_id:
+            self.vpc_peerings[normalize_arn(connection_id)] = (vpc_id, peer_vpc_id)
 
 
+    def add_direct_connect_gateway_association(self, dcg_id, vgw_arn, association_id):
+        """
+        Add a Direct Connect gateway association to a virtual private gateway.
+        """
+        dcg_id = normalize_arn(dcg_id)
+        vgw_id = normalize_arn(vgw_arn)
+        self.add_vpn_gateway(vgw_id)
+        self._add_edge(dcg_id, vgw_id, "dcg-vgw-association", association_id)
+
     def add_vpn_gateway_connection(self, node_id, vpc_id):
         """
         Add a VPN gateway to the network.
         """
-        node_id = node_id.replace("garn:", "arn:").lower()
-        vpc_id = vpc_id.replace("garn:", "arn:").lower()
+        node_id = normalize_arn(node_id)
+        vpc_id = normalize_arn(vpc_id)
         self.add_vpn_gateway(node_id)
         self.add_vpc(vpc_id)
-        self.network.add_edge(node_id, vpc_id, color="black",weight=VPC_VPN_EDGE_WIDTH)
+        self._add_edge(node_id, vpc_id, "vpn-gateway-vpc")
 
     def add_direct_connect_virtual_interface(self, dcvif):
-        if not self.network.has_node(dcvif.connectionId):
-            self.add_direct_connect_connection(dcvif.connectionId)
+        connection_id = normalize_arn(dcvif.connectionId)
+        if not self.network.has_node(connection_id):
+            self.add_direct_connect_connection(connection_id)
         if dcvif.virtualGatewayId:    
-            vgw_arn = reconstruct_arn('ec2', dcvif.accountId, dcvif.region, 'vpn-gateway', dcvif.virtualGatewayId)
-            self.add_vpn_gateway(vgw_arn)
-            self.network.add_edge(dcvif.connectionId, vgw_arn, color="blue", title=dcvif.assetId)
+            vgw_id = normalize_arn(reconstruct_arn('ec2', dcvif.accountId, dcvif.region, 'vpn-gateway', dcvif.virtualGatewayId))
+            self.add_vpn_gateway(vgw_id)
+            self._add_edge(connection_id, vgw_id, "dc-vgw-interface", dcvif.assetId)
         elif dcvif.directConnectGatewayId:
-            self.network.add_edge(dcvif.connectionId, dcvif.directConnectGatewayId, color="blue", title=dcvif.assetId, weight=DIRECT_CONNECT_CONNECTION_GATEWAY_WIDTH)
+            self._add_edge(connection_id, normalize_arn(dcvif.directConnectGatewayId), "dc-dcg-interface", dcvif.assetId)
         else:
             print(f"Unknown virtual interface type: {dcvif.virtualInterfaceType}")
 
@@ -153,31 +414,73 @@ class AwsTopology:
         """
         Get the subgraph of connected components with a minimum size.
         """
-        connected_components = list(nx.connected_components(self.network))
-        filtered_nodes =  [node for component in connected_components if len(component) >= min_size for node in component]
-        subgraph = self.network.subgraph(filtered_nodes)
-        return subgraph
+        return self._min_size_connected_components_subgraph(min_size).to_networkx()
 
-    def show(self, output_file="example.html", min_size_connected_components=10):
+    def _min_size_connected_components_subgraph(self, min_size):
+        """
+        Same as get_min_size_connected_componnents_subgraph, as a CompactGraph
+        (which derives the presentation attributes of its nodes and edges).
+        """
+        if isinstance(self.network, MappedGraph):
+            # A mapped graph does not change: one pass over its stored adjacency,
+            # without looking its node ids up one by one.
+            filtered_nodes = [index for component in self.network.component_indices() if len(component) >= min_size for index in component]
+            return self.network.subgraph_indices(filtered_nodes)
+        filtered_nodes = self.components.nodes(min_size)
+        if self.compact:
+            codes = self.network.node_ids.codes
+            return self.network.subgraph_indices([codes[node_id] for node_id in filtered_nodes])
+        return CompactGraph.from_networkx(self.network.subgraph(filtered_nodes))
+
+    def show(self, output_file="example.html", min_size_connected_components=MIN_COMPONENT_SIZE, stats=None, layout="physics", layout_cache=None, grouping=None):
         """
         Display the network.
+        The HTML is streamed from the graph (see html_renderer and render_graph);
+        render stats are added to stats if given.
+        With a grouping of GROUPINGS the grouped view is drawn instead (see
+        grouped_view), whole: its components are not filtered by size.
         """
-        
-        # displaygraph = Network(notebook=True, cdn_resources="remote", height="1440px", width="100%",select_menu=True, filter_menu=True)
-        # #displaygraph.from_nx(self.network)
-        # #displaygraph.force_atlas_2based()
-        # displaygraph.from_nx(self.get_acount_region_groupped_graph())
-        
-        # displaygraph.toggle_physics(True)
-        # #displaygraph.show_buttons(filter_=['layout'])
+        start = time.perf_counter()
+        if grouping is not None:
+            graph = self.grouped_view(grouping).to_networkx()
+            phase = "group_seconds"
+        else:
+            graph = self._min_size_connected_components_subgraph(min_size_connected_components)
+            phase = "filter_seconds"
+        if stats is not None:
+            stats[phase] += time.perf_counter() - start
+        render_graph(graph, output_file, stats, layout, layout_cache)
 
-        # displaygraph.show("example_groupped.html")
-        graph = self.get_min_size_connected_componnents_subgraph(min_size_connected_components)
-        pyvis_graph = Network(notebook=True, cdn_resources="remote", height="1440px", width="100%",select_menu=True, filter_menu=True)
-        pyvis_graph.from_nx(graph)
-        pyvis_graph.toggle_physics(True)
-        pyvis_graph.force_atlas_2based()
-        pyvis_graph.show(output_file)
+    def show_lod(self, output_file="example.html", mode="account", min_size_connected_components=MIN_COMPONENT_SIZE, stats=None):
+        """
+        Write the level-of-detail page of the network: VPCs and other leaf resources
+        are collapsed into clusters by account, account and region, or TGW (mode),
+        expanded on click (see html_lod.write_lod_html).
+        """
+        start = time.perf_counter()
+        kept = set(self.components.nodes(min_size_connected_components))
+        if stats is not None:
+            stats["filter_seconds"] += time.perf_counter() - start
+        node_records, edge_records = self._records()
+        node_records = (record for record in node_records if record[0] in kept)
+        edge_records = (record for record in edge_records if record[0] in kept)
+        write_lod_html(node_records, edge_records, output_file, mode, stats)
+
+    def show_sharded(self, output_dir, min_size_connected_components=MIN_COMPONENT_SIZE, stats=None, layout="physics", layout_cache=None, workers=1):
+        """
+        Write the network as an index page of its connected components and one script
+        per component, loaded when selected (see html_shards.write_sharded_html).
+        Only the shards whose content changed are rewritten.
+        """
+        start = time.perf_counter()
+        components = list(self.components.components(min_size_connected_components))
+        if stats is not None:
+            stats["filter_seconds"] += time.perf_counter() - start
+        positions = None
+        if layout != "physics":
+            graph = self._min_size_connected_components_subgraph(min_size_connected_components)
+            positions = compute_layout(graph, layout, layout_cache, stats)
+        write_sharded_html(*self._records(), components, output_dir, positions, workers, stats)
 
 
 
@@ -185,127 +488,208 @@ class AwsTopology:
         """
         Add a TGW attachment to the network.
         """
-        tgw_id = transit_gateway_attachment.tgwArn.replace("garn:", "arn:").lower()
+        tgw_id = normalize_arn(transit_gateway_attachment.tgwArn)
         self.add_transit_gateway(tgw_id)
 
-        node_id = transit_gateway_attachment.resourceArn.replace("garn:", "arn:").lower()
+        node_id = normalize_arn(transit_gateway_attachment.resourceArn)
         resource_types = cm.TgwAttachmentResourceType
-        weight = 1
+        kind = "tgw-attachment"
         match transit_gateway_attachment.resourceType:
             case resource_types.TGW_RESOURCE_TYPE_VPC:
                 self.add_vpc(node_id)
-                weight=TGW_VPC_ATTCH_WIDTH
+                kind = "tgw-vpc-attachment"
             case resource_types.TGW_RESOURCE_TYPE_VPN:
                 self.add_vpn_connection(node_id)
-                weight=TGW_VPN_ATTACH_WIDTH
+                kind = "tgw-vpn-attachment"
             case resource_types.TGW_RESOURCE_TYPE_DIRECT_CONNECT_GATEWAY:
-                node_id = transit_gateway_attachment.resourceId.lower()
+                node_id = normalize_arn(transit_gateway_attachment.resourceId)
                 self.add_direct_connect_gateway(node_id)
-                weight=TGW_DIRECT_CONNECT_WIDTH
+                kind = "tgw-dcg-attachment"
 
             case _:
                 print(f"Unknown resource type: {transit_gateway_attachment.resourceType}")
             
-        attachment_id = transit_gateway_attachment.transitGatewayAttachmentId.replace("garn:", "arn:").lower()
-        self.network.add_edge(node_id, tgw_id,title=attachment_id, color='black', weight=weight)
+        attachment_id = normalize_arn(transit_gateway_attachment.transitGatewayAttachmentId)
+        self._add_edge(node_id, tgw_id, kind, attachment_id)
+        if attachment_id:
+            self.tgw_attachments[attachment_id] = (tgw_id, node_id)
     
-    def add_tgw_peering(self, tgw_id, peer_tgw_id, attachment_id):
+    def add_tgw_peering(self, tgw_id, peer_tgw_id, attachment_id, attachment_ids=()):
         """
         Add a TGW peering connection to the network.
+        attachment_ids are the ids of the peering attachment on each side.
         """
-        tgw_id = tgw_id.replace("garn:", "arn:").lower()
-        peer_tgw_id = peer_tgw_id.replace("garn:", "arn:").lower()
+        tgw_id = normalize_arn(tgw_id)
+        peer_tgw_id = normalize_arn(peer_tgw_id)
         self.add_transit_gateway(tgw_id)
         self.add_transit_gateway(peer_tgw_id)
-        self.network.add_edge(tgw_id, peer_tgw_id, color="red", title=attachment_id, weight=TRANSIT_GATEWAY_PEER_WIDTH)
+        self._add_edge(tgw_id, peer_tgw_id, "tgw-peering", attachment_id)
+        attachment_ids = tuple(normalize_arn(peering_id) for peering_id in attachment_ids)
+        for peering_id in attachment_ids:
+            self.tgw_peering_attachments[peering_id] = attachment_ids
+
+    def add_tgw_route_table(self, route_table):
+        """
+        Record a TGW route table (TgwRouteTableRecord) for the reachability engine.
+        Route tables are not drawn.
+        """
+        self.tgw_route_tables[normalize_arn(route_table.transitGatewayRouteTableId)] = route_table
+
+    def add_managed_prefix_list(self, prefix_list_id, entries):
+        """
+        Record the CIDR blocks of a managed prefix list referenced by TGW routes.
+        """
+        self.prefix_lists[normalize_arn(prefix_list_id)] = entries
+
+    def add_subnet(self, subnet):
+        """
+        Record a subnet (SubnetRecord) for path tracing. Subnets are not drawn.
+        """
+        self.subnets[normalize_arn(subnet.subnetId)] = subnet
+
+    def add_vpc_route_table(self, route_table):
+        """
+        Record a VPC route table (VpcRouteTableRecord) for path tracing.
+        """
+        self.vpc_route_tables[normalize_arn(route_table.routeTableId)] = route_table
+
+    def _add_azure_node(self, resource_id, resource_type, name=None, region=None):
+        """
+        Add an Azure resource to the network with data account (subscription) and region.
+        """
+        node_id = normalize_azure_id(resource_id)
+        if self.network.has_node(node_id) and name is None:
+            return node_id
+        self._add_node(node_id, resource_type, name, extract_subscription_from_id(node_id), region)
+        return node_id
+
+    def add_vnet(self, vnet_id, name=None, region=None):
+        """
+        Add an Azure virtual network to the network.
+        """
+        return self._add_azure_node(vnet_id, "vnet", name, region)
+
+    def add_virtual_hub(self, hub_id, name=None, region=None):
+        """
+        Add an Azure Virtual WAN hub to the network.
+        """
+        return self._add_azure_node(hub_id, "virtual-hub", name, region)
+
+    def add_virtual_network_gateway(self, gateway_id, name=None, region=None, vnet_id=None):
+        """
+        Add an Azure virtual network gateway to the network, connected to its virtual network.
+        """
+        gateway_id = self._add_azure_node(gateway_id, "virtual-network-gateway", name, region)
+        if vnet_id:
+            vnet_id = self.add_vnet(vnet_id)
+            self._add_edge(gateway_id, vnet_id, "vnet-gateway")
+        return gateway_id
+
+    def add_express_route_gateway(self, gateway_id, name=None, region=None, hub_id=None):
+        """
+        Add an Azure ExpressRoute gateway to the network, connected to its virtual hub.
+        """
+        gateway_id = self._add_azure_node(gateway_id, "express-route-gateway", name, region)
+        if hub_id:
+            hub_id = self.add_virtual_hub(hub_id)
+            self._add_edge(gateway_id, hub_id, "express-route-gateway-hub")
+        return gateway_id
+
+    def add_express_route_circuit(self, circuit_id, name=None, region=None):
+        """
+        Add an Azure ExpressRoute circuit to the network.
+        """
+        return self._add_azure_node(circuit_id, "express-route-circuit", name, region)
+
+    def add_vnet_peering(self, vnet_id, peer_vnet_id, peering_id):
+        """
+        Add an Azure virtual network peering to the network.
+        """
+        vnet_id = self.add_vnet(vnet_id)
+        peer_vnet_id = self.add_vnet(peer_vnet_id)
+        self._add_edge(vnet_id, peer_vnet_id, "vnet-peering", normalize_azure_id(peering_id))
+
+    def add_hub_vnet_connection(self, hub_id, vnet_id, connection_id):
+        """
+        Add an Azure virtual hub connection to a virtual network.
+        """
+        hub_id = self.add_virtual_hub(hub_id)
+        vnet_id = self.add_vnet(vnet_id)
+        self._add_edge(vnet_id, hub_id, "hub-vnet-connection", normalize_azure_id(connection_id))
+
+    def add_express_route_connection(self, gateway_id, circuit_id, connection_id):
+        """
+        Add an Azure ExpressRoute connection between a gateway and a circuit.
+        """
+        gateway_id = self.add_express_route_gateway(gateway_id)
+        circuit_id = self.add_express_route_circuit(circuit_id)
+        self._add_edge(circuit_id, gateway_id, "express-route-connection", normalize_azure_id(connection_id))
 
     def get_acount_region_groupped_graph(self):
         """
         Get the account-region grouped graph.
         """
-        new_graph = nx.Graph()
-        for node in self.network.nodes(data=True):
-            node_id, data = node
-            if data['resource_type'] == "vpc":
-                account_id = data['account']
-                region_id = data['region']
-                new_node_id = f"{account_id}:{region_id}"
-                if not new_graph.has_node(new_node_id):
-                    new_graph.add_node(new_node_id, label="VPC", title=new_node_id, image="images/vpc.svg", shape="image")
-                    new_graph.nodes[new_node_id]['resource_type'] = "vpc"
-                    new_graph.nodes[new_node_id]['vpcs'] = [node_id]
-                else:
-                    new_graph.nodes[new_node_id]['vpcs'].append(node_id)
-            else:
-                new_graph.add_node(node_id, **data)
-        for edge in self.network.edges(data=True):
-            node1, node2, data = edge
-            if self.network.nodes[node1]['resource_type'] == "vpc":
-                account_id = self.network.nodes[node1]['account']
-                region_id = self.network.nodes[node1]['region']
-                node1 = f"{account_id}:{region_id}"
-            if self.network.nodes[node2]['resource_type'] == "vpc":
-                account_id = self.network.nodes[node2]['account']
-                region_id = self.network.nodes[node2]['region']
-                node2 = f"{account_id}:{region_id}"
-            # if node1 != node2:
-            new_graph.add_edge(node1, node2, **data)
-        return new_graph
-
-
-def create_graph(dir_path):
-
-    net = AwsTopology()
-    trasnsit_gateways = dict()
-
-    for filepath in get_files(dir_path, ".pb"):
-        data = read_proto_file(filepath)
-        assets = data.snapshot[0].assets
-        
-        for tgw in assets.transitGateways:
-            if tgw.assetId not in trasnsit_gateways:
-                trasnsit_gateways[tgw.assetId] = tgw
-                net.add_transit_gateway(tgw.assetId, tgw.name)
-
-        for vpc in assets.vpcs:
-            net.add_vpc(vpc.assetId, vpc.name)
-
-        for tgwa in assets.transitGatewayAttachments:
-            if not tgwa.tgwArn:
-                #print(f"TGW ARN not found for {tgwa}")
-                continue
-            else:
-                net.add_tgw_attachment(tgwa)
+        return self.grouped_view("account-region").to_networkx()
 
-        for peering in assets.transitGatewayPeeringAttachments:
-            net.add_tgw_peering(peering.requesterArn, peering.accepterArn, peering.assetId)
-            
-        for vpc in assets.vpcPeeringConnections:
-            net.add_vpc_peering(vpc.requesterVpcInfo.vpcArn, vpc.accepterVpcInfo.vpcArn, vpc.vpcPeeringConnectionId)    
-
-        for vpngw in assets.vpnGateways:
-            for vpc in vpngw.vpcAttachments:
-                net.add_vpn_gateway_connection(vpngw.assetId, vpc.vpcArn)
-
-        for dcg in assets.awsDirectConnectGateway:
-            net.add_direct_connect_gateway(dcg.directConnectGatewayId, dcg.directConnectGatewayName)
-            for association in dcg.directConnectGatewayAssociations:
-                if association.associatedGateway.type == cm.DirectConnectGatewayGatewayType.DIRECT_CONNECT_GATEWAY_GATEWAY_TYPE_VIRTUAL_PRIVATE_GATEWAY:
-                    vgw = association.associatedGateway
-                    vgw_arn = reconstruct_arn('ec2', vgw.ownerAccount, vgw.region, 'vpn-gateway', vgw.id)
-                    net.add_vpn_gateway(vgw_arn)
-                    net.network.add_edge(dcg.directConnectGatewayId, vgw_arn, color="blue", title=association.associationId, weight=DIRECT_CONNECT_VPN_CONNECTION_WIDTH)
-                
-
-        for dcc in assets.directConnectConnections:
-            net.add_direct_connect_connection(dcc.connectionId, dcc.connectionName)
-        
-        for dcvif in assets.directConnectVirtualInterfaces:
-            net.add_direct_connect_virtual_interface(dcvif)
-            
+
+def create_graph(dir_path, workers=1, topology_only=True, stats=None, cache=None, backend="networkx", vpc_routing=False, files=None):
+    """
+    Build the topology from all .pb files of a directory.
+    Every snapshot of every file is used; snapshots of the same aid, account and
+    region are de-duplicated, keeping the newest.
+    With workers > 1 the files are parsed in a process pool and merged in file order.
+    In topology-only mode the snapshot fields the graph does not use are skipped
+    without being decoded. With a RecordCache only changed files are decoded.
+    backend is "networkx" or "compact" (see CompactGraph). With vpc_routing the
+    subnets and VPC route tables are loaded too, for path tracing.
+    Load stats (bytes, decode, extraction and build times, asset counts, see
+    load_file_records) are added to stats if given, and the (file path, load stats)
+    of each file are appended to files if given.
+    """
+    start = time.perf_counter()
+    file_paths = get_files(dir_path, ".pb")
+    if cache is None:
+        file_records = iter_file_records(file_paths, workers, topology_only, vpc_routing)
+    else:
+        file_records = iter_cached_file_records(file_paths, cache, workers, topology_only, vpc_routing)
+
+    snapshots = []
+    for file_path, (file_snapshots, file_stats) in zip(file_paths, file_records):
+        snapshots.extend(file_snapshots)
+        if stats is not None:
+            stats.update(file_stats)
+        if files is not None:
+            files.append((file_path, file_stats))
+    if stats is not None:
+        stats["load_seconds"] += time.perf_counter() - start
+
+    net = build_topology(snapshots, backend, stats)
+    if cache is not None:
+        cache.evict()
+    return net
+
+def build_topology(snapshots, backend="networkx", stats=None):
+    """
+    Build the topology from the decoded snapshots of load_file_records, keeping
+    the newest snapshot of each aid, account and region.
+    """
+    start = time.perf_counter()
+    net = AwsTopology(backend=backend)
+    transit_gateways = set()
+    snapshots = latest_snapshots(snapshots)
+    for snapshot in snapshots:
+        apply_records(net, snapshot.records, transit_gateways)
+    if stats is not None:
+        stats["snapshots_used"] += len(snapshots)
+        stats["build_seconds"] += time.perf_counter() - start
     return net
 
 def count_resource_type(graph,resource_type):
+    """
+    Count the nodes of a resource type in a graph, or through the index of an AwsTopology.
+    """
+    if isinstance(graph, AwsTopology):
+        return graph.count("resource_type", resource_type)
     count = 0
     for node in graph.nodes(data=True):
         if node[1].get("resource_type", "") == resource_type:
@@ -313,23 +697,152 @@ def count_resource_type(graph,resource_type):
 
     return count
 
-def main():
-    parser = argparse.ArgumentParser(description="Generate AWS topology graph.")
+def build_arg_parser(description="Generate AWS topology graph."):
+    """
+    Return the command line parser shared by the batch and live (live.py) modes.
+    """
+    parser = argparse.ArgumentParser(description=description)
     parser.add_argument("--input_dir", dest="dir_path", type=str, required=True,
                         help="Path to the directory containing .pb files.")
     parser.add_argument("--output", dest="output_file", type=str, default="example.html",
                         help="Path to the output HTML file.")
-    args = parser.parse_args()
-    dir_path = args.dir_path
-    output_file = args.output_file
+    parser.add_argument("--workers", dest="workers", type=int, default=1,
+                        help="Number of processes used to parse the .pb files (0 uses all CPU cores).")
+    parser.add_argument("--full-decode", dest="topology_only", action="store_false",
+                        help="Decode every snapshot field instead of only the topology ones.")
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, default=DEFAULT_CACHE_DIR,
+                        help="Directory of the per-file topology records cache.")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                        help="Do not read or write the records cache.")
+    parser.add_argument("--rebuild-cache", dest="rebuild_cache", action="store_true",
+                        help="Decode every file and overwrite its cache entry.")
+    parser.add_argument("--backend", dest="backend", choices=["networkx", "compact"], default="networkx",
+                        help="Graph storage: networkx, or compact integer arrays for large estates.")
+    parser.add_argument("--layout", dest="layout", choices=LAYOUTS, default="physics",
+                        help="Node placement: physics in the browser, or positions computed here (force, hierarchical).")
+    views = parser.add_mutually_exclusive_group()
+    views.add_argument("--group-by", dest="grouping", choices=GROUPINGS, default=None,
+                       help="Draw one node per account and region (or account, or region) for the VPCs, with merged edges.")
+    views.add_argument("--lod", dest="lod", choices=LOD_MODES, default=None,
+                       help="Collapse the VPCs and other leaf resources into clusters by account, account and region, or TGW, expanded on click.")
+    views.add_argument("--shard-dir", dest="shard_dir", type=str, default=None,
+                       help="Instead of --output, write an index page of the components and one file per component to this directory.")
+    parser.add_argument("--min-component-size", dest="min_component_size", type=int, default=MIN_COMPONENT_SIZE,
+                        help="Only draw the connected components of at least this many nodes.")
+    return parser
+
+def check_input_dir(dir_path):
+    """
+    Return True if dir_path is an existing directory, printing why otherwise.
+    """
     if not os.path.exists(dir_path):
         print(f"Directory {dir_path} does not exist.")
-        return
+        return False
     if not os.path.isdir(dir_path):
         print(f"{dir_path} is not a directory.")
+        return False
+    return True
+
+def render(net, args, stats):
+    """
+    Write the HTML of the topology as configured on the command line.
+    """
+    layout_cache = LayoutCache(args.cache_dir) if args.use_cache else None
+    if args.shard_dir is not None:
+        net.show_sharded(args.shard_dir, args.min_component_size, stats, args.layout, layout_cache, args.workers)
+    elif args.lod is not None:
+        net.show_lod(args.output_file, args.lod, args.min_component_size, stats)
+    else:
+        net.show(args.output_file, args.min_component_size, stats, args.layout, layout_cache, args.grouping)
+    if args.layout != "physics":
+        print(f"Laid out {stats['layout_components_computed']} components, {stats['layout_components_cached']} from cache, in {stats['layout_seconds']:.2f}s.")
+    if args.lod is not None:
+        print(f"Wrote {stats['html_nodes']} nodes and {stats['html_edges']} edges to {args.output_file} ({stats['html_bytes']} bytes) "
+              f"and {stats['html_clusters']} clusters ({stats['html_clusters_written']} changed, {stats['html_cluster_bytes']} bytes) in {stats['html_seconds']:.2f}s.")
+        return
+    if args.shard_dir is not None:
+        print(f"Wrote {stats['html_nodes']} nodes and {stats['html_edges']} edges in {stats['html_shards']} components to {args.shard_dir} "
+              f"({stats['html_shards_written']} changed, {stats['html_bytes']} bytes) in {stats['html_seconds']:.2f}s.")
+        return
+    print(f"Wrote {stats['html_nodes']} nodes and {stats['html_edges']} edges to {args.output_file} ({stats['html_bytes']} bytes) in {stats['html_seconds']:.2f}s.")
+
+def load_topology(dir_path, workers=1, topology_only=True, stats=None, cache=None, backend="networkx", vpc_routing=False, files=None):
+    """
+    Open a saved topology file (see AwsTopology.save), or build the topology of a
+    directory of .pb files with create_graph. Return None if dir_path is neither.
+    """
+    if is_topology_file(dir_path):
+        start = time.perf_counter()
+        net = AwsTopology.load(dir_path)
+        if stats is not None:
+            stats["open_seconds"] += time.perf_counter() - start
+        return net
+    if not check_input_dir(dir_path):
+        return None
+    return create_graph(dir_path, workers, topology_only, stats, cache, backend, vpc_routing, files)
+
+def run(args, stats, files=None):
+    """
+    Build or open the topology and write its HTML as configured on the command
+    line. Return the topology, or None if the input is neither a directory nor a
+    topology file.
+    """
+    dir_path = args.dir_path
+    cache = RecordCache(args.cache_dir, rebuild=args.rebuild_cache) if args.use_cache else None
+    net = load_topology(dir_path, args.workers, args.topology_only, stats, cache, args.backend, args.vpc_routing, files)
+    if net is None:
+        return None
+    if is_topology_file(dir_path):
+        print(f"Opened {net.network.number_of_nodes()} nodes and {net.network.number_of_edges()} edges from {dir_path}.")
+    else:
+        if cache is not None:
+            print(f"Loaded {stats['cache_hits']} files from cache, decoded {stats['cache_misses']}.")
+        print(f"Read {stats['snapshots']} snapshots, {stats['snapshots_used']} after de-duplication.")
+        print(f"Decoded {stats['bytes_decoded']} of {stats['bytes_total']} bytes ({stats['bytes_skipped']} skipped).")
+    if args.topology_file is not None:
+        start = time.perf_counter()
+        net.save(args.topology_file)
+        stats["save_seconds"] += time.perf_counter() - start
+        print(f"Saved the topology to {args.topology_file}.")
+    render(net, args, stats)
+    return net
+
+def main():
+    parser = build_arg_parser()
+    parser.add_argument("--save-topology", dest="topology_file", type=str, default=None,
+                        help="Also write the topology to this .topo file, which --input_dir then opens instantly.")
+    parser.add_argument("--vpc-routing", dest="vpc_routing", action="store_true",
+                        help="Also load the subnets and VPC route tables, so that the --save-topology file can be used by path_trace.py.")
+    parser.add_argument("--metrics", dest="metrics_file", type=str, default=None,
+                        help="Write the run metrics (phase times, per-file bytes, decode times and asset counts, "
+                             "node and edge counts by type, peak memory) as JSON to this file.")
+    parser.add_argument("--profile", dest="profile_file", type=str, default=None,
+                        help="Profile the run with cProfile and dump the stats to this file (see pstats); "
+                             "parse workers are not profiled.")
+    args = parser.parse_args()
+    stats = Counter()
+    files = [] if args.metrics_file is not None else None
+    profiler = cProfile.Profile() if args.profile_file is not None else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        net = run(args, stats, files)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+    seconds = time.perf_counter() - start
+    if net is None:
         return
-    net = create_graph(dir_path)
-    net.show(output_file)
+    print(f"Done in {seconds:.2f}s: {format_phases(stats)}.")
+    profile = None
+    if profiler is not None:
+        profiler.dump_stats(args.profile_file)
+        profile = {"file": args.profile_file, "functions": profile_functions(profiler)}
+        print(f"Wrote the profile to {args.profile_file} (python3 -m pstats {args.profile_file}).")
+    if args.metrics_file is not None:
+        write_metrics(args.metrics_file, build_metrics(stats, files, net, seconds, profile))
+        print(f"Wrote the metrics to {args.metrics_file}.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
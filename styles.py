@@ -0,0 +1,175 @@
+import math
+
+from constants import *
+
+# Presentation of the nodes by resource type, derived at render time.
+NODE_STYLES = {
+    "tgw": dict(label="TGW", image="images/tgw.svg", shape="image", level=1, size=TRANSIT_GATEAWAY_NODE_SIZE),
+    "vpc": dict(label="VPC", image="images/vpc.svg", shape="image", level=2, size=VPC_NODE_SIZE),
+    "vpn-gateway": dict(label="VPN", image="images/vpn-gateway.svg", shape="image", level=3, size=VPN_NODE_SIZE),
+    "vpn-connection": dict(label="VPN", image="images/vpn-connection.svg", shape="image", level=3, size=VPN_NODE_SIZE),
+    "direct-connect-gateway": dict(label="DCG", image="images/direct-connect-gateway.svg", shape="image", level=0, size=DIRECT_CONNECT_NODE_SIZE),
+    "direct-connect-connection": dict(label="DC", image="images/direct-connect-connection.svg", shape="image", level=0, size=DIRECT_CONNECT_NODE_SIZE),
+    "vnet": dict(label="VNET", image="images/vnet.svg", shape="image", level=2, size=VNET_NODE_SIZE),
+    "virtual-hub": dict(label="HUB", image="images/virtual-hub.svg", shape="image", level=1, size=VIRTUAL_HUB_NODE_SIZE),
+    "virtual-network-gateway": dict(label="VNG", image="images/virtual-network-gateway.svg", shape="image", level=3, size=VIRTUAL_NETWORK_GATEWAY_NODE_SIZE),
+    "express-route-gateway": dict(label="ERGW", image="images/express-route-gateway.svg", shape="image", level=0, size=EXPRESS_ROUTE_NODE_SIZE),
+    "express-route-circuit": dict(label="ERC", image="images/express-route-circuit.svg", shape="image", level=0, size=EXPRESS_ROUTE_NODE_SIZE),
+}
+
+# Presentation of the edges by kind, derived at render time.
+EDGE_STYLES = {
+    "tgw-vpc-attachment": dict(color="black", weight=TGW_VPC_ATTCH_WIDTH),
+    "tgw-vpn-attachment": dict(color="black", weight=TGW_VPN_ATTACH_WIDTH),
+    "tgw-dcg-attachment": dict(color="black", weight=TGW_DIRECT_CONNECT_WIDTH),
+    "tgw-attachment": dict(color="black", weight=1),
+    "tgw-peering": dict(color="red", weight=TRANSIT_GATEWAY_PEER_WIDTH),
+    "vpc-peering": dict(color="green", weight=VPC_PEER_WIDTH),
+    "vpn-gateway-vpc": dict(color="black", weight=VPC_VPN_EDGE_WIDTH),
+    "dcg-vgw-association": dict(color="blue", weight=DIRECT_CONNECT_VPN_CONNECTION_WIDTH),
+    "dc-vgw-interface": dict(color="blue"),
+    "dc-dcg-interface": dict(color="blue", weight=DIRECT_CONNECT_CONNECTION_GATEWAY_WIDTH),
+    "vnet-peering": dict(color="green", weight=VNET_PEER_WIDTH),
+    "hub-vnet-connection": dict(color="black", weight=HUB_VNET_CONNECTION_WIDTH),
+    "vnet-gateway": dict(color="black", weight=VNET_GATEWAY_EDGE_WIDTH),
+    "express-route-gateway-hub": dict(color="blue", weight=EXPRESS_ROUTE_GATEWAY_HUB_WIDTH),
+    "express-route-connection": dict(color="blue", weight=EXPRESS_ROUTE_CONNECTION_WIDTH),
+}
+
+
+def node_attributes(node_id, resource_type, name=None, account=None, region=None):
+    """
+    Return the full attribute dict of a node, presentation included.
+    """
+    attributes = dict(NODE_STYLES.get(resource_type, {}))
+    attributes["title"] = f"{node_id}\n{name}" if name else node_id
+    attributes["resource_type"] = resource_type
+    attributes["name"] = name
+    if account and region:
+        attributes["account"] = account
+        attributes["region"] = region
+    return attributes
+
+
+def edge_attributes(kind, title=None):
+    """
+    Return the full attribute dict of an edge, presentation included.
+    """
+    attributes = dict(EDGE_STYLES.get(kind, {}))
+    attributes["kind"] = kind
+    if title is not None:
+        attributes["title"] = title
+    return attributes
+
+
+def topology_node_attributes(resource_type, name=None, account=None, region=None):
+    """
+    Return the stored attribute dict of a node, without presentation.
+    """
+    attributes = {"resource_type": resource_type, "name": name}
+    if account and region:
+        attributes["account"] = account
+        attributes["region"] = region
+    return attributes
+
+
+def topology_edge_attributes(kind, title=None):
+    """
+    Return the stored attribute dict of an edge, without presentation.
+    """
+    attributes = {"kind": kind}
+    if title is not None:
+        attributes["title"] = title
+    return attributes
+
+# Highlight of the nodes and edges of a topology diff, by change.
+DIFF_COLORS = {
+    "added": "#2ca02c",
+    "removed": "#d62728",
+    "modified": "#ff7f0e",
+    "unchanged": "#c8c8c8",
+}
+
+
+def diff_node_attributes(node_id, change, resource_type, name=None, account=None, region=None):
+    """
+    Return the attributes of a node of a diff graph: its usual style with a border
+    colored by change ("added", "removed", "modified" or "unchanged").
+    """
+    attributes = node_attributes(node_id, resource_type, name, account, region)
+    attributes["change"] = change
+    attributes["title"] = f"{attributes['title']}\n({change})"
+    attributes["borderWidth"] = 1 if change == "unchanged" else 6
+    attributes["color"] = {"border": DIFF_COLORS[change], "background": "#ffffff"}
+    attributes["shapeProperties"] = {"useBorderWithImage": True}
+    return attributes
+
+
+def diff_edge_attributes(change, kind, title=None):
+    """
+    Return the attributes of an edge of a diff graph, colored by change.
+    """
+    attributes = edge_attributes(kind, title)
+    attributes["change"] = change
+    attributes["color"] = DIFF_COLORS[change]
+    if change != "unchanged":
+        attributes["weight"] = max(attributes.get("weight", 1), 4)
+    return attributes
+
+
+def grouped_node_attributes(group_id, values, count):
+    """
+    Return the attributes of a group node of a grouped view: the VPC style, labeled
+    with its number of VPCs. values are its {"account": ..., "region": ...} fields.
+    """
+    attributes = dict(NODE_STYLES["vpc"])
+    attributes["label"] = f"{count} VPC" if count == 1 else f"{count} VPCs"
+    attributes["title"] = f"{group_id}\n{attributes['label']}"
+    attributes["resource_type"] = "vpc"
+    attributes["vpcs"] = count
+    attributes.update(values)
+    return attributes
+
+
+def _most_common(counter):
+    """
+    Return the (value, count) pairs of a Counter by decreasing count, ties by value,
+    so that the result does not depend on the order the values were counted in.
+    """
+    return sorted(counter.items(), key=lambda item: (-item[1], str(item[0])))
+
+
+def grouped_edge_attributes(kinds):
+    """
+    Return the attributes of an aggregated edge of a grouped view from the Counter
+    of its merged edge kinds: the style of the most common kind, wider with the
+    number of edges. Ties go to the first kind by name.
+    """
+    kinds = _most_common(kinds)
+    kind, _ = kinds[0]
+    multiplicity = sum(count for _, count in kinds)
+    attributes = edge_attributes(kind, "\n".join(f"{count} x {edge_kind}" for edge_kind, count in kinds))
+    attributes["multiplicity"] = multiplicity
+    attributes["weight"] = attributes.get("weight", 1) + math.log2(multiplicity)
+    return attributes
+
+
+def cluster_node_attributes(cluster_id, resource_types, values):
+    """
+    Return the attributes of a cluster node of the level-of-detail view: the style
+    of its most common resource type, sized by its number of members and labeled
+    with the count of each type (ties by name). resource_types is the Counter of the
+    member types, values its {"account": ..., "region": ..., "tgw": ...} fields.
+    """
+    resource_types = _most_common(resource_types)
+    resource_type, _ = resource_types[0]
+    count = sum(type_count for _, type_count in resource_types)
+    attributes = dict(NODE_STYLES.get(resource_type, {}))
+    attributes["label"] = "\n".join(f"{type_count} {NODE_STYLES.get(member_type, {}).get('label', member_type)}"
+                                    for member_type, type_count in resource_types)
+    attributes["title"] = f"{cluster_id}\n{count} resources, click to expand"
+    attributes["size"] = attributes.get("size", VPC_NODE_SIZE) * (1 + math.log2(count))
+    attributes["resource_type"] = resource_type
+    attributes["members"] = count
+    attributes.update(values)
+    return attributes
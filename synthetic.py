@@ -0,0 +1,305 @@
+import argparse
+import ipaddress
+import os
+import random
+import time
+from collections import Counter, namedtuple
+
+import prot  # noqa: F401 (adds the generated protobuf modules to sys.path)
+from te.service.cm.v1 import cm_snapshot_file_response_pb2 as cm_response
+from te.service.cm.v1 import cm_snapshot_pb2 as cm
+
+# Bump when the generated files change for the same scale and seed.
+SYNTHETIC_VERSION = 1
+REGIONS = (
+    "us-east-1", "eu-west-1", "us-west-2", "ap-southeast-2", "eu-central-1",
+    "ap-northeast-1", "us-east-2", "sa-east-1", "ca-central-1", "ap-south-1",
+)
+# The network account owns the TGWs, TGW route tables and DX gateways, like in a
+# landing zone where they are shared with the workload accounts.
+NETWORK_ACCOUNT = 0
+SNAPSHOT_TIME = 1700000000
+# VPC CIDR blocks are carved from this range, one /24 per VPC.
+VPC_SUPERNET = ipaddress.ip_network("10.0.0.0/8")
+TAGS_PER_ASSET = 5
+
+# Size of a synthetic estate. TGWs are per region, with their VPCs spread over the
+# accounts; peerings are drawn at random; DX gateways attach to a TGW and associate
+# with the VPN gateway of a VPC. subnets_per_vpc (with a route table per VPC),
+# enis_per_vpc and instances_per_vpc add the assets the topology does not use.
+SyntheticScale = namedtuple("SyntheticScale", [
+    "accounts",
+    "regions",
+    "tgws_per_region",
+    "vpcs_per_tgw",
+    "vpns_per_tgw",
+    "tgw_peerings",
+    "vpc_peerings",
+    "dx_gateways",
+    "vifs_per_dx",
+    "subnets_per_vpc",
+    "enis_per_vpc",
+    "instances_per_vpc",
+], defaults=(10, 2, 1, 50, 2, 2, 20, 2, 2, 2, 4, 2))
+
+
+def _arn(region, account, resource_type, resource_id):
+    return f"garn:aws:ec2:{region}:{account}:{resource_type}/{resource_id}"
+
+
+def _account_id(index):
+    return f"{100000000000 + index}"
+
+
+def _region(index):
+    if index < len(REGIONS):
+        return REGIONS[index]
+    return f"{REGIONS[index % len(REGIONS)]}-{index // len(REGIONS)}"
+
+
+def _tag(asset, key, value):
+    tag = asset.tags.add()
+    tag.key = key
+    tag.value = value
+
+
+def _vpc_cidr(index):
+    return VPC_SUPERNET.network_address + (index << 8) % VPC_SUPERNET.num_addresses
+
+
+def _add_noise(assets, rng, account, region, vpc_id, vpc_arn, cidr, tgw_id, scale):
+    """
+    Add the subnets, route table, ENIs and instances of a VPC.
+    """
+    table = assets.routeTables.add()
+    table.routeTableId = f"rtb-{vpc_id[4:]}"
+    table.vpcArn = vpc_arn
+    table.accountId = account
+    table.awsRegion = region
+    table.associations.add().main = True
+    route = table.routes.add()
+    route.destinationCidrBlock = f"{cidr}/24"
+    route.gatewayId = "local"
+    route = table.routes.add()
+    route.destinationCidrBlock = "10.0.0.0/8"
+    route.transitGatewayId = tgw_id
+    subnet_ids = []
+    prefix = 24 + max(scale.subnets_per_vpc - 1, 0).bit_length()
+    for subnet_index in range(scale.subnets_per_vpc):
+        subnet = assets.subnets.add()
+        subnet.subnetId = f"subnet-{vpc_id[4:]}-{subnet_index}"
+        subnet.vpcArn = vpc_arn
+        subnet.accountId = account
+        subnet.awsRegion = region
+        subnet.availabilityZone = f"{region}{'abc'[subnet_index % 3]}"
+        subnet.cidrBlock = f"{cidr + (subnet_index << (32 - prefix))}/{prefix}"
+        subnet_ids.append(subnet.subnetId)
+    for eni_index in range(scale.enis_per_vpc):
+        eni = assets.interfaces.add()
+        eni.accountId = account
+        eni.awsRegion = region
+        eni.eniId = f"eni-{vpc_id[4:]}-{eni_index}"
+        eni.assetId = _arn(region, account, "network-interface", eni.eniId)
+        eni.vpcId = vpc_id
+        eni.vpcArn = vpc_arn
+        eni.privateIpAddress = str(cidr + 10 + eni_index % 240)
+        eni.macAddress = ":".join(f"{rng.randrange(256):02x}" for _ in range(6))
+        if subnet_ids:
+            eni.subnetId = subnet_ids[eni_index % len(subnet_ids)]
+        for tag_index in range(TAGS_PER_ASSET):
+            _tag(eni, f"tag-{tag_index}", f"value-{rng.randrange(1 << 32):08x}")
+    for instance_index in range(scale.instances_per_vpc):
+        instance = assets.instances.add()
+        instance.accountId = account
+        instance.awsRegion = region
+        instance.instanceId = f"i-{vpc_id[4:]}-{instance_index}"
+        instance.assetId = _arn(region, account, "instance", instance.instanceId)
+        instance.instanceType = rng.choice(("t3.micro", "m5.large", "c6i.xlarge", "r6g.2xlarge"))
+        instance.vpcId = vpc_id
+        instance.privateIpAddress = str(cidr + 100 + instance_index % 150)
+        for tag_index in range(TAGS_PER_ASSET):
+            _tag(instance, f"tag-{tag_index}", f"value-{rng.randrange(1 << 32):08x}")
+
+
+def generate_snapshot_files(output_dir, scale=SyntheticScale(), seed=0):
+    """
+    Write a synthetic estate as SnapshotFilesResponse .pb files, one per account
+    with one snapshot per region. Return the counts of the generated files, bytes
+    and assets.
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    counts = Counter()
+    messages = {}
+    snapshots = {}
+    for account_index in range(scale.accounts):
+        message = messages[account_index] = cm_response.SnapshotFilesResponse()
+        for region_index in range(scale.regions):
+            snapshot = message.snapshot.add()
+            snapshot.aid = "1"
+            snapshot.account_id = _account_id(account_index)
+            snapshot.region = _region(region_index)
+            snapshot.time = SNAPSHOT_TIME + account_index
+            snapshots[account_index, region_index] = snapshot.assets
+            counts["snapshots"] += 1
+
+    network_account = _account_id(NETWORK_ACCOUNT)
+    vpc_index = 0
+    tgws = []
+    vpcs = []
+    vpn_gateways = []
+    for region_index in range(scale.regions):
+        region = _region(region_index)
+        network_assets = snapshots[NETWORK_ACCOUNT, region_index]
+        for tgw_index in range(scale.tgws_per_region):
+            tgw_id = f"tgw-{region_index:03d}{tgw_index:03d}"
+            tgw_arn = _arn(region, network_account, "transit-gateway", tgw_id)
+            tgw = network_assets.transitGateways.add()
+            tgw.assetId = tgw_arn
+            tgw.transitGatewayId = tgw_id
+            tgw.name = f"tgw {region} {tgw_index}"
+            tgws.append((region_index, tgw_id, tgw_arn))
+            counts["tgws"] += 1
+            route_table = network_assets.transitGatewayRouteTables.add()
+            route_table.transitGatewayRouteTableId = f"tgw-rtb-{tgw_id[4:]}"
+            route_table.transitGatewayId = tgw_id
+            route = route_table.routes.add()
+            route.destinationCidrBlock = "0.0.0.0/0"
+            route.state = cm.TGW_RT_ROUTE_STATE_BLACKHOLE
+
+            for tgw_vpc_index in range(scale.vpcs_per_tgw):
+                account_index = vpc_index % scale.accounts
+                account = _account_id(account_index)
+                assets = snapshots[account_index, region_index]
+                vpc_id = f"vpc-{vpc_index:08x}"
+                vpc_arn = _arn(region, account, "vpc", vpc_id)
+                cidr = _vpc_cidr(vpc_index)
+                vpc = assets.vpcs.add()
+                vpc.assetId = vpc_arn
+                vpc.vpcId = vpc_id
+                vpc.name = f"vpc {vpc_index}"
+                vpc.cidrBlock = f"{cidr}/24"
+                vpc.accountId = account
+                vpc.awsRegion = region
+                attachment = assets.transitGatewayAttachments.add()
+                attachment.tgwArn = tgw_arn
+                attachment.resourceArn = vpc_arn
+                attachment.resourceId = vpc_id
+                attachment.resourceType = cm.TGW_RESOURCE_TYPE_VPC
+                attachment.transitGatewayAttachmentId = f"tgw-attach-{vpc_index:08x}"
+                association = route_table.associations.add()
+                association.transitGatewayAttachmentId = attachment.transitGatewayAttachmentId
+                association.resourceId = vpc_id
+                association.resourceType = cm.TransitGatewayRouteTableAttachmentResourceType.TGW_RT_RESOURCE_TYPE_VPC
+                association.state = cm.TGW_RT_ASSOCIATION_STATE_ASSOCIATED
+                propagation = route_table.propagations.add()
+                propagation.transitGatewayAttachmentId = attachment.transitGatewayAttachmentId
+                propagation.resourceId = vpc_id
+                propagation.resourceType = cm.TransitGatewayRouteTableAttachmentResourceType.TGW_RT_RESOURCE_TYPE_VPC
+                propagation.state = cm.TGW_RT_PROPAGATION_STATE_ENABLED
+                vpcs.append((account_index, region_index, vpc_id, vpc_arn))
+                counts["vpcs"] += 1
+                if tgw_vpc_index % 10 == 0:
+                    vpn_gateway = assets.vpnGateways.add()
+                    vpn_gateway.vpnGatewayId = f"vgw-{vpc_index:08x}"
+                    vpn_gateway.assetId = _arn(region, account, "vpn-gateway", vpn_gateway.vpnGatewayId)
+                    vpn_gateway.vpcAttachments.add().vpcArn = vpc_arn
+                    vpn_gateways.append((account, region, vpn_gateway.vpnGatewayId))
+                    counts["vpn_gateways"] += 1
+                _add_noise(assets, rng, account, region, vpc_id, vpc_arn, cidr, tgw_id, scale)
+                counts["subnets"] += scale.subnets_per_vpc
+                counts["enis"] += scale.enis_per_vpc
+                counts["instances"] += scale.instances_per_vpc
+                vpc_index += 1
+
+            for vpn_index in range(scale.vpns_per_tgw):
+                attachment = network_assets.transitGatewayAttachments.add()
+                attachment.tgwArn = tgw_arn
+                attachment.resourceArn = _arn(region, network_account, "vpn-connection", f"vpn-{tgw_id[4:]}{vpn_index:03d}")
+                attachment.resourceType = cm.TGW_RESOURCE_TYPE_VPN
+                attachment.transitGatewayAttachmentId = f"tgw-attach-vpn-{tgw_id[4:]}{vpn_index:03d}"
+                counts["vpn_connections"] += 1
+
+    for peering_index in range(scale.tgw_peerings if len(tgws) > 1 else 0):
+        (region_index, _, requester), (_, _, accepter) = rng.sample(tgws, 2)
+        peering = snapshots[NETWORK_ACCOUNT, region_index].transitGatewayPeeringAttachments.add()
+        peering.requesterArn = requester
+        peering.accepterArn = accepter
+        peering.assetId = f"tgw-peering-{peering_index}"
+        peering.transitGatewayAttachmentId = f"tgw-attach-peering-{peering_index}"
+        counts["tgw_peerings"] += 1
+
+    for peering_index in range(scale.vpc_peerings if len(vpcs) > 1 else 0):
+        (account_index, region_index, _, requester), (_, _, _, accepter) = rng.sample(vpcs, 2)
+        peering = snapshots[account_index, region_index].vpcPeeringConnections.add()
+        peering.requesterVpcInfo.vpcArn = requester
+        peering.accepterVpcInfo.vpcArn = accepter
+        peering.vpcPeeringConnectionId = f"pcx-{peering_index:08x}"
+        counts["vpc_peerings"] += 1
+
+    network_assets = snapshots[NETWORK_ACCOUNT, 0]
+    for dx_index in range(scale.dx_gateways if tgws else 0):
+        dx_gateway_id = f"dxgw-{dx_index:04d}"
+        dx_gateway = network_assets.awsDirectConnectGateway.add()
+        dx_gateway.directConnectGatewayId = dx_gateway_id
+        dx_gateway.directConnectGatewayName = f"dx gateway {dx_index}"
+        region_index, _, tgw_arn = rng.choice(tgws)
+        attachment = snapshots[NETWORK_ACCOUNT, region_index].transitGatewayAttachments.add()
+        attachment.tgwArn = tgw_arn
+        attachment.resourceId = dx_gateway_id
+        attachment.resourceType = cm.TGW_RESOURCE_TYPE_DIRECT_CONNECT_GATEWAY
+        attachment.transitGatewayAttachmentId = f"tgw-attach-dx-{dx_index:04d}"
+        if vpn_gateways:
+            account, region, vgw_id = rng.choice(vpn_gateways)
+            association = dx_gateway.directConnectGatewayAssociations.add()
+            association.associationId = f"dxa-{dx_index:04d}"
+            association.associatedGateway.type = cm.DIRECT_CONNECT_GATEWAY_GATEWAY_TYPE_VIRTUAL_PRIVATE_GATEWAY
+            association.associatedGateway.ownerAccount = account
+            association.associatedGateway.region = region
+            association.associatedGateway.id = vgw_id
+        connection = network_assets.directConnectConnections.add()
+        connection.connectionId = f"dxcon-{dx_index:04d}"
+        connection.connectionName = f"dx connection {dx_index}"
+        for vif_index in range(scale.vifs_per_dx):
+            vif = network_assets.directConnectVirtualInterfaces.add()
+            vif.connectionId = connection.connectionId
+            vif.assetId = f"dxvif-{dx_index:04d}-{vif_index}"
+            vif.virtualInterfaceId = vif.assetId
+            if vif_index % 2 == 0 or not vpn_gateways:
+                vif.directConnectGatewayId = dx_gateway_id
+                vif.virtualInterfaceType = "transit"
+            else:
+                vif.accountId, vif.region, vif.virtualGatewayId = rng.choice(vpn_gateways)
+                vif.virtualInterfaceType = "private"
+            counts["dx_vifs"] += 1
+        counts["dx_gateways"] += 1
+
+    for account_index, message in messages.items():
+        file_path = os.path.join(output_dir, f"{_account_id(account_index)}.pb")
+        data = message.SerializeToString()
+        with open(file_path, "wb") as f:
+            f.write(data)
+        counts["files"] += 1
+        counts["bytes"] += len(data)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic .pb snapshot files of an AWS estate.")
+    parser.add_argument("--output_dir", dest="output_dir", type=str, required=True,
+                        help="Directory of the generated .pb files (one per account).")
+    parser.add_argument("--seed", dest="seed", type=int, default=0,
+                        help="Seed of the random peerings and noise; the same seed gives the same files.")
+    for field, default in SyntheticScale._field_defaults.items():
+        parser.add_argument(f"--{field.replace('_', '-')}", dest=field, type=int, default=default,
+                            help=f"Default: {default}.")
+    args = parser.parse_args()
+    scale = SyntheticScale(**{field: getattr(args, field) for field in SyntheticScale._fields})
+    start = time.perf_counter()
+    counts = generate_snapshot_files(args.output_dir, scale, args.seed)
+    print(f"Wrote {counts['files']} files ({counts['bytes']} bytes, {counts['snapshots']} snapshots) to {args.output_dir} "
+          f"in {time.perf_counter() - start:.2f}s: {counts['tgws']} TGWs, {counts['vpcs']} VPCs, "
+          f"{counts['tgw_peerings']} TGW peerings, {counts['vpc_peerings']} VPC peerings, {counts['dx_gateways']} DX gateways.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+class ComponentTracker:
+    """
+    Connected components of an AwsTopology, maintained with a union-find as nodes
+    and edges are added: component sizes are known at any time without traversing
+    the graph, and the nodes of the components of a minimum size are listed in
+    proportion to the result. Removing an edge or a node can split a component,
+    which a union-find cannot undo: the tracker is then marked stale and
+    AwsTopology rebuilds it on next use.
+    """
+
+    def __init__(self):
+        # node id: parent node id, the root of a component is its own parent
+        self.parent = {}
+        # root id: node ids of its component
+        self.members = {}
+        self.stale = False
+
+    @classmethod
+    def from_records(cls, node_records, edge_records):
+        """
+        Build the components of a graph from its node and edge records.
+        """
+        tracker = cls()
+        for node_record in node_records:
+            tracker.add_node(node_record[0])
+        for source, target, _, _ in edge_records:
+            tracker.set_edge(source, target)
+        return tracker
+
+    @classmethod
+    def from_components(cls, components):
+        """
+        Build the tracker from already computed components (iterables of node ids).
+        """
+        tracker = cls()
+        for component in components:
+            members = list(component)
+            if not members:
+                continue
+            root = members[0]
+            for node_id in members:
+                tracker.parent[node_id] = root
+            tracker.members[root] = members
+        return tracker
+
+    # Maintenance
+
+    def add_node(self, node_id, resource_type=None, name=None, account=None, region=None):
+        if node_id not in self.parent:
+            self.parent[node_id] = node_id
+            self.members[node_id] = [node_id]
+
+    set_node = add_node
+
+    def set_edge(self, source, target, kind=None, title=None):
+        """
+        Merge the components of the endpoints of an edge, the smaller into the larger.
+        """
+        # Called for every edge while the topology is built: find is inlined.
+        parent, members = self.parent, self.members
+        if source not in parent:
+            parent[source] = source
+            members[source] = [source]
+        if target not in parent:
+            parent[target] = target
+            members[target] = [target]
+        while parent[source] != source:
+            parent[source] = source = parent[parent[source]]
+        while parent[target] != target:
+            parent[target] = target = parent[parent[target]]
+        if source == target:
+            return
+        source_members, target_members = members[source], members[target]
+        if len(source_members) < len(target_members):
+            source, target = target, source
+            source_members, target_members = target_members, source_members
+        parent[target] = source
+        source_members.extend(target_members)
+        del members[target]
+
+    def remove_edge(self, source, target):
+        self.stale = True
+
+    def remove_node(self, node_id):
+        self.stale = True
+
+    # Queries
+
+    def find(self, node_id):
+        """
+        Return the root of the component of a node, halving its path on the way.
+        """
+        parent = self.parent
+        while parent[node_id] != node_id:
+            parent[node_id] = node_id = parent[parent[node_id]]
+        return node_id
+
+    def component_size(self, node_id):
+        """
+        Return the number of nodes of the component of a node.
+        """
+        return len(self.members[self.find(node_id)])
+
+    def number_of_components(self):
+        return len(self.members)
+
+    def components(self, min_size=1):
+        """
+        Iterate over the node id lists of the components of at least min_size nodes.
+        """
+        for members in self.members.values():
+            if len(members) >= min_size:
+                yield members
+
+    def nodes(self, min_size=1):
+        """
+        Return the ids of the nodes in components of at least min_size nodes.
+        """
+        return [node_id for members in self.components(min_size) for node_id in members]
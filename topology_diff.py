@@ -0,0 +1,165 @@
+import argparse
+import json
+from collections import Counter, namedtuple
+
+import networkx as nx
+
+from cache import DEFAULT_CACHE_DIR, LayoutCache, RecordCache
+from layout import LAYOUTS
+from snapshot import load_topology, render_graph
+from styles import diff_edge_attributes, diff_node_attributes
+
+NODE_FIELDS = ("resource_type", "name", "account", "region")
+EDGE_FIELDS = ("kind", "title")
+
+# Nodes ({id: NODE_FIELDS tuple}) and edges ({(id, id): EDGE_FIELDS tuple}) of a topology.
+TopologyRecords = namedtuple("TopologyRecords", ["nodes", "edges"])
+# Sorted node ids or edge keys of each kind of change.
+Changes = namedtuple("Changes", ["added", "removed", "modified"])
+TopologyDiff = namedtuple("TopologyDiff", ["old", "new", "nodes", "edges"])
+
+
+def topology_records(net):
+    """
+    Return the TopologyRecords of an AwsTopology. Edge keys are sorted (id, id) pairs.
+    """
+    if net.compact:
+        nodes = {node_id: tuple(attributes) for node_id, *attributes in net.network.node_records()}
+        edge_records = ((source, target, (kind, title)) for source, target, kind, title in net.network.edge_records())
+    else:
+        nodes = {node_id: tuple(data.get(field) for field in NODE_FIELDS) for node_id, data in net.network.nodes(data=True)}
+        edge_records = ((source, target, tuple(data.get(field) for field in EDGE_FIELDS)) for source, target, data in net.network.edges(data=True))
+    edges = {}
+    for source, target, attributes in edge_records:
+        edges[(source, target) if source <= target else (target, source)] = attributes
+    return TopologyRecords(nodes, edges)
+
+
+def _changes(old, new):
+    return Changes(
+        sorted(new.keys() - old.keys()),
+        sorted(old.keys() - new.keys()),
+        sorted(key for key in old.keys() & new.keys() if old[key] != new[key]),
+    )
+
+
+def diff_records(old, new):
+    """
+    Compare two TopologyRecords in linear time.
+    """
+    return TopologyDiff(old, new, _changes(old.nodes, new.nodes), _changes(old.edges, new.edges))
+
+
+def diff_report(diff):
+    """
+    Return the JSON-serializable report of a TopologyDiff: counts by change, by node
+    resource type and by edge kind, then the changed nodes and edges.
+    """
+    def node(node_id, attributes):
+        return {"id": node_id, **dict(zip(NODE_FIELDS, attributes))}
+
+    def edge(key, attributes):
+        return {"source": key[0], "target": key[1], **dict(zip(EDGE_FIELDS, attributes))}
+
+    report = {"summary": {}, "nodes": {}, "edges": {}}
+    for section, changes, records, group, item in (
+            ("nodes", diff.nodes, (diff.old.nodes, diff.new.nodes), "by_resource_type", node),
+            ("edges", diff.edges, (diff.old.edges, diff.new.edges), "by_kind", edge)):
+        old, new = records
+        groups = {}
+        for change, keys in changes._asdict().items():
+            for key in keys:
+                group_name = (new.get(key) or old.get(key))[0]
+                groups.setdefault(group_name or "unknown", Counter())[change] += 1
+        report["summary"][section] = {change: len(keys) for change, keys in changes._asdict().items()}
+        report["summary"][section][group] = {name: dict(counts) for name, counts in sorted(groups.items())}
+        report[section] = {
+            "added": [item(key, new[key]) for key in changes.added],
+            "removed": [item(key, old[key]) for key in changes.removed],
+            "modified": [{"before": item(key, old[key]), "after": item(key, new[key])} for key in changes.modified],
+        }
+    return report
+
+
+def diff_graph(diff):
+    """
+    Return a networkx.Graph of the changed nodes and edges, the endpoints of the
+    changed edges and the unchanged edges between them, highlighted by change.
+    """
+    graph = nx.Graph()
+    changes = {}
+    for change, keys in diff.nodes._asdict().items():
+        changes.update((key, change) for key in keys)
+    edge_changes = {}
+    for change, keys in diff.edges._asdict().items():
+        edge_changes.update((key, change) for key in keys)
+
+    shown = set(changes)
+    for source, target in edge_changes:
+        shown.update((source, target))
+    for node_id in shown:
+        attributes = diff.new.nodes.get(node_id) or diff.old.nodes[node_id]
+        if attributes[0] is None:
+            graph.add_node(node_id)
+        else:
+            graph.add_node(node_id, **diff_node_attributes(node_id, changes.get(node_id, "unchanged"), *attributes))
+    for key, change in edge_changes.items():
+        attributes = diff.new.edges.get(key) or diff.old.edges[key]
+        graph.add_edge(*key, **diff_edge_attributes(change, *attributes))
+    for key, attributes in diff.new.edges.items():
+        if key not in edge_changes and key[0] in shown and key[1] in shown:
+            graph.add_edge(*key, **diff_edge_attributes("unchanged", *attributes))
+    return graph
+
+
+def build_records(dir_path, workers=1, topology_only=True, cache=None):
+    """
+    Build the topology of a directory (with the compact backend), or open a saved
+    topology file, and return its TopologyRecords. Return None if dir_path is neither.
+    """
+    net = load_topology(dir_path, workers, topology_only, cache=cache, backend="compact")
+    return None if net is None else topology_records(net)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the topology of two snapshot directories.")
+    parser.add_argument("--old", dest="old_dir", type=str, required=True,
+                        help="Directory of the old .pb files, or a saved .topo topology file.")
+    parser.add_argument("--new", dest="new_dir", type=str, required=True,
+                        help="Directory of the new .pb files, or a saved .topo topology file.")
+    parser.add_argument("--json", dest="json_file", type=str, default=None,
+                        help="Path to the JSON report (printed to stdout if not set).")
+    parser.add_argument("--html", dest="html_file", type=str, default=None,
+                        help="Path to the HTML page of the changes.")
+    parser.add_argument("--layout", dest="layout", choices=LAYOUTS, default="physics",
+                        help="Node placement of the HTML page.")
+    parser.add_argument("--workers", dest="workers", type=int, default=1,
+                        help="Number of processes used to parse the .pb files (0 uses all CPU cores).")
+    parser.add_argument("--full-decode", dest="topology_only", action="store_false",
+                        help="Decode every snapshot field instead of only the topology ones.")
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, default=DEFAULT_CACHE_DIR,
+                        help="Directory of the per-file topology records cache.")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                        help="Do not read or write the records cache.")
+    args = parser.parse_args()
+    cache = RecordCache(args.cache_dir) if args.use_cache else None
+    old = build_records(args.old_dir, args.workers, args.topology_only, cache)
+    new = build_records(args.new_dir, args.workers, args.topology_only, cache)
+    if old is None or new is None:
+        return
+    diff = diff_records(old, new)
+    report = diff_report(diff)
+    if args.json_file is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.json_file, "w") as f:
+            json.dump(report, f, indent=2)
+        summary = report["summary"]
+        print(f"Nodes: {summary['nodes']['added']} added, {summary['nodes']['removed']} removed, {summary['nodes']['modified']} modified.")
+        print(f"Edges: {summary['edges']['added']} added, {summary['edges']['removed']} removed, {summary['edges']['modified']} modified.")
+    if args.html_file is not None:
+        layout_cache = LayoutCache(args.cache_dir, "diff_layout") if args.use_cache else None
+        render_graph(diff_graph(diff), args.html_file, layout=args.layout, layout_cache=layout_cache)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import bisect
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+from array import array
+from itertools import accumulate
+
+from compact_graph import NO_VALUE, CompactGraph, StringTable
+
+# Bump when the layout of the topology file changes.
+TOPOLOGY_FILE_VERSION = 1
+TOPOLOGY_FILE_EXTENSION = ".topo"
+TOPOLOGY_FILE_MAGIC = b"AWSTOPO\0"
+# Sections are aligned so that every column can be cast in place.
+SECTION_ALIGNMENT = 8
+
+NODE_COLUMNS = ("resource_types", "names", "accounts", "regions")
+EDGE_COLUMNS = ("edge_sources", "edge_targets", "edge_kinds", "edge_titles")
+
+
+class _MappedValues:
+    """
+    Read-only sequence of the strings of a mapped table, decoded on access.
+    """
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return str(self.blob[self.offsets[index]:self.offsets[index + 1]], "utf-8")
+
+    def __iter__(self):
+        blob = self.blob
+        start = 0
+        for end in self.offsets[1:]:
+            yield str(blob[start:end], "utf-8")
+            start = end
+
+
+class _MappedCodes:
+    """
+    Read-only mapping of the strings of a mapped table to their codes, by binary
+    search in the sorted order stored with the table.
+    """
+
+    def __init__(self, offsets, blob, order):
+        self.offsets = offsets
+        self.blob = blob
+        self.order = order
+
+    def _key(self, code):
+        return bytes(self.blob[self.offsets[code]:self.offsets[code + 1]])
+
+    def get(self, value, default=None):
+        key = value.encode()
+        position = bisect.bisect_left(self.order, key, key=self._key)
+        if position < len(self.order) and self._key(self.order[position]) == key:
+            return self.order[position]
+        return default
+
+    def __getitem__(self, value):
+        code = self.get(value)
+        if code is None:
+            raise KeyError(value)
+        return code
+
+    def __contains__(self, value):
+        return self.get(value) is not None
+
+    def __len__(self):
+        return len(self.order)
+
+
+class MappedStringTable:
+    """
+    Read-only StringTable stored in a topology file: values and codes are looked up
+    in the file without building the table in memory.
+    """
+
+    def __init__(self, offsets, blob, order):
+        self.values = _MappedValues(offsets, blob)
+        self.codes = _MappedCodes(offsets, blob, order)
+
+    def code(self, value):
+        """
+        Return the code of a value of the table. None is NO_VALUE.
+        """
+        if value is None:
+            return NO_VALUE
+        code = self.codes.get(value)
+        if code is None:
+            raise TypeError(f"{value} is not in the read-only string table")
+        return code
+
+    def value(self, code):
+        """
+        Return the string of a code, None for NO_VALUE.
+        """
+        return None if code == NO_VALUE else self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class MappedGraph(CompactGraph):
+    """
+    Read-only CompactGraph memory-mapped from a topology file (see write_topology_file).
+    Columns, the CSR adjacency and the string tables are used in place, so opening a
+    file only reads its header; node ids are found by binary search. Use to_compact
+    for a graph that can be changed.
+    """
+
+    def __init__(self, file_path):
+        with open(file_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._map)
+        magic_size = len(TOPOLOGY_FILE_MAGIC)
+        if bytes(buffer[:magic_size]) != TOPOLOGY_FILE_MAGIC:
+            raise ValueError(f"{file_path} is not a topology file")
+        header_size, = struct.unpack_from("<I", buffer, magic_size)
+        header = json.loads(bytes(buffer[magic_size + 4:magic_size + 4 + header_size]))
+        if header["version"] != TOPOLOGY_FILE_VERSION or header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{file_path} was written by another version or platform")
+        sections = {}
+        for name, (offset, size, typecode) in header["sections"].items():
+            sections[name] = buffer[offset:offset + size].cast(typecode)
+
+        self.node_ids = MappedStringTable(sections["node_id_offsets"], sections["node_id_blob"], sections["node_id_order"])
+        self.strings = MappedStringTable(sections["string_offsets"], sections["string_blob"], sections["string_order"])
+        for name in NODE_COLUMNS + EDGE_COLUMNS:
+            setattr(self, name, sections[name])
+        self._csr = (sections["adjacency_offsets"], sections["adjacency_neighbors"])
+        self._edge_index = None
+        self._routing = sections["routing"]
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("MappedGraph is read-only, see to_compact")
+
+    add_node = add_edge = set_node = remove_edges_from = remove_nodes_from = _read_only
+
+    def has_edge(self, source_id, target_id):
+        codes = self.node_ids.codes
+        source, target = codes.get(source_id), codes.get(target_id)
+        if source is None or target is None:
+            return False
+        offsets, neighbors = self._csr
+        return target in neighbors[offsets[source]:offsets[source + 1]]
+
+    def _scan_tables(self):
+        """
+        Full scans decode the node ids and strings once instead of on every access.
+        """
+        strings = list(self.strings.values)
+
+        def value(code):
+            return None if code == NO_VALUE else strings[code]
+
+        return list(self.node_ids.values), value
+
+    def routing(self):
+        """
+        Return the routing data written with the graph.
+        """
+        return pickle.loads(self._routing)
+
+    def to_compact(self):
+        """
+        Return a writable CompactGraph copy of the graph.
+        """
+        graph = self.subgraph_indices(range(len(self.node_ids)))
+        graph.strings = StringTable(self.strings.values)
+        return graph
+
+
+def _string_sections(prefix, values):
+    encoded = [value.encode() for value in values]
+    return {
+        f"{prefix}_offsets": array('q', accumulate((len(value) for value in encoded), initial=0)),
+        f"{prefix}_blob": b"".join(encoded),
+        f"{prefix}_order": array('i', sorted(range(len(encoded)), key=encoded.__getitem__)),
+    }
+
+
+def write_topology_file(file_path, graph, routing=None):
+    """
+    Write a CompactGraph to a topology file: a JSON header of section offsets, then
+    the node id and string tables (offsets, UTF-8 blob, sorted order), the node and
+    edge columns, the CSR adjacency and the pickled routing data, in native byte order.
+    """
+    sections = {}
+    sections.update(_string_sections("node_id", graph.node_ids.values))
+    sections.update(_string_sections("string", graph.strings.values))
+    for name in NODE_COLUMNS + EDGE_COLUMNS:
+        sections[name] = getattr(graph, name)
+    sections["adjacency_offsets"], sections["adjacency_neighbors"] = graph._adjacency()
+    sections["routing"] = pickle.dumps(routing or {}, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # The section offsets depend on the size of the header holding them: grow the
+    # padded header size until it fits.
+    header_size = 0
+    header_bytes = b"."
+    while len(header_bytes) > header_size:
+        header_size = len(header_bytes) + 64
+        header = {"version": TOPOLOGY_FILE_VERSION, "byteorder": sys.byteorder, "sections": {}}
+        offset = len(TOPOLOGY_FILE_MAGIC) + 4 + header_size
+        for name, section in sections.items():
+            offset += -offset % SECTION_ALIGNMENT
+            view = memoryview(section)
+            header["sections"][name] = (offset, view.nbytes, view.format)
+            offset += view.nbytes
+        header_bytes = json.dumps(header).encode()
+    header_bytes = header_bytes.ljust(header_size)
+
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(TOPOLOGY_FILE_MAGIC)
+        f.write(struct.pack("<I", header_size))
+        f.write(header_bytes)
+        for name, section in sections.items():
+            f.write(b"\0" * (header["sections"][name][0] - f.tell()))
+            f.write(section)
+    os.replace(temp_path, file_path)
+
+
+def is_topology_file(path):
+    """
+    Return True if path is an existing topology file (by its extension).
+    """
+    return path.endswith(TOPOLOGY_FILE_EXTENSION) and os.path.isfile(path)
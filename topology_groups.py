@@ -0,0 +1,174 @@
+from collections import Counter
+
+import networkx as nx
+
+from styles import grouped_edge_attributes, grouped_node_attributes, node_attributes
+
+# Node attributes the resources are grouped by, by grouping name.
+GROUPINGS = {
+    "account-region": ("account", "region"),
+    "account": ("account",),
+    "region": ("region",),
+}
+# Resource types merged into one node per group; other nodes are kept as they are.
+GROUPED_RESOURCE_TYPES = frozenset(("vpc",))
+
+
+class GroupedView:
+    """
+    Aggregated view of an AwsTopology where the VPCs of each account and region
+    (or account, or region, see GROUPINGS) are merged into one group node, and the
+    edges between the same nodes are merged with their multiplicity by kind.
+    It is maintained like TopologyIndex as nodes and edges are set and removed,
+    so only the groups and aggregated edges around a change are updated.
+    """
+
+    def __init__(self, grouping="account-region"):
+        self.grouping = grouping
+        self.fields = GROUPINGS[grouping]
+        # node id: (resource type, name, account, region)
+        self.nodes = {}
+        # node id: id of the node standing for it in the view (itself if not grouped)
+        self.group_of = {}
+        # group id: ids of its resources
+        self.members = {}
+        # node id: {neighbor id: edge kind}
+        self.adjacency = {}
+        # (node id, node id) sorted: Counter of the merged edge kinds
+        self.edges = {}
+
+    @classmethod
+    def from_records(cls, node_records, edge_records, grouping="account-region"):
+        """
+        Build the view of a graph from its node (id, resource type, name, account,
+        region) and edge (source, target, kind, title) records.
+        """
+        view = cls(grouping)
+        for node_id, resource_type, name, account, region in node_records:
+            view.set_node(node_id, resource_type, name, account, region)
+        for source, target, kind, _ in edge_records:
+            view.set_edge(source, target, kind)
+        return view
+
+    def _group_id(self, node_id, resource_type, account, region):
+        if resource_type not in GROUPED_RESOURCE_TYPES:
+            return node_id
+        values = {"account": account, "region": region}
+        if not all(values[field] for field in self.fields):
+            return node_id
+        return ":".join(values[field] for field in self.fields)
+
+    # Maintenance
+
+    def _count_edge(self, source, target, kind, delta):
+        key = (source, target) if source <= target else (target, source)
+        kinds = self.edges.get(key)
+        if kinds is None:
+            kinds = self.edges[key] = Counter()
+        kinds[kind] += delta
+        if kinds[kind] <= 0:
+            del kinds[kind]
+            if not kinds:
+                del self.edges[key]
+
+    def _count_edges(self, node_id, delta):
+        group_of = self.group_of
+        for other, kind in self.adjacency.get(node_id, {}).items():
+            self._count_edge(group_of[node_id], group_of[other], kind, delta)
+
+    def set_node(self, node_id, resource_type=None, name=None, account=None, region=None):
+        """
+        Add a node or replace all its attributes, moving it to its new group.
+        """
+        self.nodes[node_id] = (resource_type, name, account, region)
+        group_id = self._group_id(node_id, resource_type, account, region)
+        previous = self.group_of.get(node_id)
+        if previous == group_id:
+            return
+        self._count_edges(node_id, -1)
+        if previous is not None and previous != node_id:
+            self._discard_member(previous, node_id)
+        self.group_of[node_id] = group_id
+        if group_id != node_id:
+            self.members.setdefault(group_id, set()).add(node_id)
+        self._count_edges(node_id, 1)
+
+    def add_node(self, node_id, resource_type=None, name=None, account=None, region=None):
+        """
+        Add a node or update it like CompactGraph.add_node: account and region are
+        only updated when given.
+        """
+        if not (account and region):
+            _, _, account, region = self.nodes.get(node_id, (None, None, None, None))
+        self.set_node(node_id, resource_type, name, account, region)
+
+    def _discard_member(self, group_id, node_id):
+        members = self.members[group_id]
+        members.discard(node_id)
+        if not members:
+            del self.members[group_id]
+
+    def remove_node(self, node_id):
+        """
+        Drop a node and its edges from the view.
+        """
+        if node_id not in self.nodes:
+            return
+        for other in list(self.adjacency.get(node_id, ())):
+            self.remove_edge(node_id, other)
+        group_id = self.group_of.pop(node_id)
+        if group_id != node_id:
+            self._discard_member(group_id, node_id)
+        del self.nodes[node_id]
+
+    def _ensure_node(self, node_id):
+        if node_id not in self.nodes:
+            self.set_node(node_id)
+
+    def set_edge(self, source, target, kind, title=None):
+        """
+        Add an edge or replace its kind, adding its missing endpoints untyped.
+        """
+        self._ensure_node(source)
+        self._ensure_node(target)
+        self.remove_edge(source, target)
+        self.adjacency.setdefault(source, {})[target] = kind
+        self.adjacency.setdefault(target, {})[source] = kind
+        self._count_edge(self.group_of[source], self.group_of[target], kind, 1)
+
+    def remove_edge(self, source, target):
+        """
+        Drop an edge from the view, if it is in it.
+        """
+        neighbors = self.adjacency.get(source)
+        if neighbors is None or target not in neighbors:
+            return
+        kind = neighbors.pop(target)
+        self.adjacency[target].pop(source, None)
+        for node_id in (source, target):
+            if not self.adjacency.get(node_id, True):
+                del self.adjacency[node_id]
+        self._count_edge(self.group_of[source], self.group_of[target], kind, -1)
+
+    # Queries
+
+    def number_of_nodes(self):
+        return len(self.members) + sum(1 for node_id, group_id in self.group_of.items() if group_id == node_id)
+
+    def number_of_edges(self):
+        return len(self.edges)
+
+    def to_networkx(self):
+        """
+        Return the view as a networkx.Graph with the presentation attributes: group
+        nodes with their resource count and aggregated edges with their multiplicity.
+        """
+        graph = nx.Graph()
+        for group_id, members in self.members.items():
+            graph.add_node(group_id, **grouped_node_attributes(group_id, dict(zip(self.fields, group_id.split(":"))), len(members)))
+        for node_id, group_id in self.group_of.items():
+            if group_id == node_id:
+                graph.add_node(node_id, **node_attributes(node_id, *self.nodes[node_id]))
+        for (source, target), kinds in self.edges.items():
+            graph.add_edge(source, target, **grouped_edge_attributes(kinds))
+        return graph
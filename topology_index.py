@@ -0,0 +1,173 @@
+from utils.arn_utils import extract_resource_id, extract_resource_type
+
+# Node attributes with a secondary index.
+INDEX_FIELDS = ("resource_type", "account", "region")
+# Edges between a transit gateway and a resource (or a peer TGW) it is attached to.
+TGW_EDGE_KINDS = frozenset((
+    "tgw-vpc-attachment",
+    "tgw-vpn-attachment",
+    "tgw-dcg-attachment",
+    "tgw-attachment",
+    "tgw-peering",
+))
+
+_EMPTY = frozenset()
+
+
+class TopologyIndex:
+    """
+    Secondary indexes of an AwsTopology, maintained as nodes and edges are set and
+    removed: node ids by resource type, account and region, and the resources (and
+    peer TGWs) attached to each transit gateway with the edge kind and attachment id.
+    Untyped nodes (only added as edge endpoints) are indexed under None.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.groups = {field: {} for field in INDEX_FIELDS}
+        self.tgw_attachments = {}
+        self._attached_to = {}
+
+    @classmethod
+    def from_records(cls, node_records, edge_records):
+        """
+        Build the index of a graph from its node (id, resource type, name, account,
+        region) and edge (source, target, kind, title) records.
+        """
+        index = cls()
+        for node_id, resource_type, name, account, region in node_records:
+            index.set_node(node_id, resource_type, name, account, region)
+        for source, target, kind, title in edge_records:
+            index.set_edge(source, target, kind, title)
+        return index
+
+    # Maintenance
+
+    def _group(self, node_id, key, add):
+        for field, value in zip(INDEX_FIELDS, key):
+            members = self.groups[field].get(value)
+            if add:
+                if members is None:
+                    members = self.groups[field][value] = set()
+                members.add(node_id)
+            elif members is not None:
+                members.discard(node_id)
+                if not members:
+                    del self.groups[field][value]
+
+    def set_node(self, node_id, resource_type=None, name=None, account=None, region=None):
+        """
+        Index a node with all its attributes replaced. Names are not indexed.
+        """
+        key = (resource_type, account, region)
+        previous = self.nodes.get(node_id)
+        if previous == key:
+            return
+        if previous is not None:
+            self._group(node_id, previous, False)
+        self.nodes[node_id] = key
+        self._group(node_id, key, True)
+
+    def add_node(self, node_id, resource_type=None, name=None, account=None, region=None):
+        """
+        Index a node added or updated like CompactGraph.add_node: account and region
+        are only updated when given.
+        """
+        if not (account and region):
+            _, account, region = self.nodes.get(node_id, (None, None, None))
+        self.set_node(node_id, resource_type, name, account, region)
+
+    def remove_node(self, node_id):
+        """
+        Drop a node and its TGW attachments from the index.
+        """
+        key = self.nodes.pop(node_id, None)
+        if key is None:
+            return
+        self._group(node_id, key, False)
+        for other in list(self.tgw_attachments.get(node_id, ())) + list(self._attached_to.get(node_id, ())):
+            self.remove_edge(node_id, other)
+
+    def _ensure_node(self, node_id):
+        if node_id not in self.nodes:
+            self.set_node(node_id)
+
+    def set_edge(self, source, target, kind, title=None):
+        """
+        Index an edge added or updated, adding its missing endpoints untyped.
+        """
+        self._ensure_node(source)
+        self._ensure_node(target)
+        self.remove_edge(source, target)
+        if kind not in TGW_EDGE_KINDS:
+            return
+        for tgw_id, other in ((source, target), (target, source)):
+            if extract_resource_type(tgw_id) == "transit-gateway":
+                self.tgw_attachments.setdefault(tgw_id, {})[other] = (kind, title)
+                self._attached_to.setdefault(other, set()).add(tgw_id)
+
+    def remove_edge(self, source, target):
+        """
+        Drop an edge from the TGW attachments, if it is one.
+        """
+        for tgw_id, other in ((source, target), (target, source)):
+            attachments = self.tgw_attachments.get(tgw_id)
+            if attachments is None or attachments.pop(other, None) is None:
+                continue
+            if not attachments:
+                del self.tgw_attachments[tgw_id]
+            attached_to = self._attached_to[other]
+            attached_to.discard(tgw_id)
+            if not attached_to:
+                del self._attached_to[other]
+
+    # Queries
+
+    def ids(self, field, value):
+        """
+        Return the (read-only) set of node ids whose field has this value.
+        """
+        return self.groups[field].get(value, _EMPTY)
+
+    def count(self, field, value):
+        return len(self.ids(field, value))
+
+    def counts(self, field):
+        """
+        Return the number of nodes of each value of a field.
+        """
+        return {value: len(members) for value, members in self.groups[field].items()}
+
+    def tgw_id(self, tgw):
+        """
+        Return the indexed id of a transit gateway from its ARN or tgw-... id, or None.
+        """
+        if tgw in self.tgw_attachments or tgw in self.nodes:
+            return tgw
+        short_id = extract_resource_id(tgw)
+        for tgw_id in self.tgw_attachments:
+            if extract_resource_id(tgw_id) == short_id:
+                return tgw_id
+        return None
+
+    def attachments(self, tgw):
+        """
+        Return {resource id: (edge kind, attachment id)} of the resources and peer
+        TGWs attached to a transit gateway.
+        """
+        return self.tgw_attachments.get(self.tgw_id(tgw), {})
+
+    def query(self, resource_type=None, account=None, region=None, tgw=None):
+        """
+        Return the sorted ids of the nodes matching every given criterion: resource
+        type, account, region and attached to a transit gateway. The smallest
+        candidate set is scanned, so the cost follows the result, not the graph.
+        """
+        candidates = [self.ids(field, value) for field, value in zip(INDEX_FIELDS, (resource_type, account, region)) if value is not None]
+        if tgw is not None:
+            candidates.append(self.attachments(tgw).keys())
+        if not candidates:
+            return sorted(self.nodes)
+        candidates.sort(key=len)
+        smallest, others = candidates[0], candidates[1:]
+        return sorted(node_id for node_id in smallest if all(node_id in other for other in others))
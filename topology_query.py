@@ -0,0 +1,71 @@
+import argparse
+import json
+import time
+
+from cache import DEFAULT_CACHE_DIR, RecordCache
+from snapshot import load_topology
+from topology_index import INDEX_FIELDS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the topology nodes by resource type, account, region and transit gateway.")
+    parser.add_argument("--input_dir", dest="dir_path", type=str, required=True,
+                        help="Path to the directory containing .pb files, or a saved .topo topology file.")
+    parser.add_argument("--type", dest="resource_type", type=str, default=None,
+                        help="Resource type of the nodes (vpc, tgw, vpn-gateway...).")
+    parser.add_argument("--account", dest="account", type=str, default=None,
+                        help="Account of the nodes.")
+    parser.add_argument("--region", dest="region", type=str, default=None,
+                        help="Region of the nodes.")
+    parser.add_argument("--tgw", dest="tgw", type=str, default=None,
+                        help="Only the nodes attached to this transit gateway (ARN or tgw-... id), listed with their attachment.")
+    parser.add_argument("--count", dest="count", action="store_true",
+                        help="Only print the number of matching nodes.")
+    parser.add_argument("--group-by", dest="group_by", choices=INDEX_FIELDS, default=None,
+                        help="Print the number of nodes of each value of a field instead.")
+    parser.add_argument("--json", dest="as_json", action="store_true",
+                        help="Print the result as JSON.")
+    parser.add_argument("--workers", dest="workers", type=int, default=1,
+                        help="Number of processes used to parse the .pb files (0 uses all CPU cores).")
+    parser.add_argument("--full-decode", dest="topology_only", action="store_false",
+                        help="Decode every snapshot field instead of only the topology ones.")
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, default=DEFAULT_CACHE_DIR,
+                        help="Directory of the per-file topology records cache.")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                        help="Do not read or write the records cache.")
+    args = parser.parse_args()
+    cache = RecordCache(args.cache_dir) if args.use_cache else None
+    net = load_topology(args.dir_path, args.workers, args.topology_only, cache=cache, backend="compact")
+    if net is None:
+        return
+
+    start = time.perf_counter()
+    if args.group_by is not None:
+        counts = net.count(args.group_by)
+        result = {str(value): count for value, count in sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))}
+    else:
+        node_ids = net.query(args.resource_type, args.account, args.region, args.tgw)
+        if args.count:
+            result = len(node_ids)
+        elif args.tgw is not None:
+            attachments = net.index.attachments(args.tgw)
+            result = [{"id": node_id, "kind": attachments[node_id][0], "attachment": attachments[node_id][1]} for node_id in node_ids]
+        else:
+            result = node_ids
+    elapsed = time.perf_counter() - start
+
+    if args.as_json:
+        print(json.dumps(result, indent=2))
+        return
+    if isinstance(result, dict):
+        for value, count in result.items():
+            print(f"{count}\t{value}")
+    elif isinstance(result, list):
+        for item in result:
+            print(f"{item['id']}\t{item['kind']}\t{item['attachment']}" if isinstance(item, dict) else item)
+        print(f"{len(result)} nodes in {elapsed * 1000:.1f}ms.")
+    else:
+        print(result)
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,60 @@
+import sys
+from collections import namedtuple
+from functools import lru_cache
+
+# Number of distinct raw ARNs whose parsed form is memoized by parse_arn.
+ARN_CACHE_SIZE = 1 << 18
+
+ParsedArn = namedtuple("ParsedArn", ["id", "service", "region", "account", "resource_type"])
+
+
+@lru_cache(maxsize=ARN_CACHE_SIZE)
+def parse_arn(arn):
+    """
+    Normalize an ARN (garn: prefix, lower case) and split it in one pass.
+    Results are memoized and their strings interned, so an ARN seen in many files
+    is stored once. Identifiers that are not ARNs (e.g. dxgw-...) only get normalized.
+    """
+    arn_id = sys.intern(arn.replace("garn:", "arn:").lower())
+    parts = arn_id.split(':', 5)
+    if len(parts) <= 4:
+        return ParsedArn(arn_id, None, None, None, None)
+    service = sys.intern(parts[2])
+    region_id = sys.intern(parts[3])
+    account_id = sys.intern(parts[4])
+    resource_type = None
+    if len(parts) > 5:
+        resource_type = sys.intern(parts[5].split('/')[0].split(':')[0])
+    return ParsedArn(arn_id, service, region_id, account_id, resource_type)
+
+def normalize_arn(arn):
+    """
+    Return the canonical ID of an ARN.
+    """
+    return parse_arn(arn).id
 
 def extract_resource_type(resource_arn):
     """
     Extract the resource type from the ARN.
     """
-    parts = resource_arn.split(':')
-    if len(parts) > 5:
-        return parts[5].split('/')[0]
-    return None
+    return parse_arn(resource_arn).resource_type
+
+def extract_resource_id(arn):
+    """
+    Extract the resource ID (vpc-..., tgw-...) from the ARN. Identifiers that are not ARNs are returned normalized.
+    """
+    parsed = parse_arn(arn)
+    return parsed.id.rsplit('/', 1)[-1] if parsed.service else parsed.id
 
 def extract_account_region_from_arn(arn):
     """
     Extract the account ID and region from the ARN.
     """
-    parts = arn.split(':')
-    if len(parts) > 4:
-        account_id = parts[4]
-        region_id = parts[3]
-        return account_id, region_id
-    return None, None
+    parsed = parse_arn(arn)
+    return parsed.account, parsed.region
 
 def reconstruct_arn(service, account_id, region_id, resource_type, resource_id):
     """
     Reconstruct the ARN from the service, account ID, region ID, resource type, and resource ID.
     """
     return f"arn:aws:{service}:{region_id}:{account_id}:{resource_type}/{resource_id}"
-    
@@ -0,0 +1,24 @@
+def normalize_azure_id(resource_id):
+    """
+    Normalize an Azure resource ID, Azure IDs are case-insensitive.
+    """
+    return resource_id.rstrip('/').lower()
+
+def extract_subscription_from_id(resource_id):
+    """
+    Extract the subscription ID from the Azure resource ID.
+    """
+    parts = resource_id.split('/')
+    if len(parts) > 2 and parts[1].lower() == 'subscriptions':
+        return parts[2].lower()
+    return None
+
+def parent_resource_id(resource_id, child_type):
+    """
+    Return the ID of the parent resource of a child resource ID, e.g. the virtual network
+    of ".../virtualNetworks/vnet1/subnets/subnet1" for child type "subnets".
+    """
+    index = resource_id.lower().find(f"/{child_type.lower()}/")
+    if index > 0:
+        return resource_id[:index]
+    return None
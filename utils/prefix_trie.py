@@ -0,0 +1,166 @@
+import ipaddress
+
+_MISSING = object()
+_BITS = {4: 32, 6: 128}
+
+
+def parse_prefix(prefix):
+    """
+    Return the (version, network int, length) of a CIDR block or address, host bits
+    cleared. Already parsed tuples are returned as is. Raise ValueError if invalid.
+    """
+    if isinstance(prefix, tuple):
+        return prefix
+    if ":" not in prefix:
+        address, _, length = prefix.partition("/")
+        octets = address.split(".")
+        length = int(length) if length else 32
+        if len(octets) != 4 or not 0 <= length <= 32:
+            raise ValueError(f"Invalid IPv4 prefix: {prefix}")
+        key = 0
+        for octet in octets:
+            octet = int(octet)
+            if not 0 <= octet <= 255:
+                raise ValueError(f"Invalid IPv4 prefix: {prefix}")
+            key = key << 8 | octet
+        return 4, key >> (32 - length) << (32 - length), length
+    network = ipaddress.ip_network(prefix, strict=False)
+    return network.version, int(network.network_address), network.prefixlen
+
+
+def format_prefix(prefix):
+    """
+    Return the CIDR notation of a parsed (version, network int, length) prefix.
+    """
+    version, key, length = prefix
+    if version == 4:
+        return f"{key >> 24}.{key >> 16 & 255}.{key >> 8 & 255}.{key & 255}/{length}"
+    return str(ipaddress.IPv6Network((key, length)))
+
+
+class _Node:
+    __slots__ = ("key", "length", "value", "children")
+
+    def __init__(self, key, length, value=_MISSING):
+        self.key = key
+        self.length = length
+        self.value = value
+        self.children = [None, None]
+
+
+class PrefixTrie:
+    """
+    Path-compressed binary (Patricia) trie of IPv4 and IPv6 prefixes.
+    Inner nodes only exist where two prefixes branch, so a lookup visits at most
+    one node per stored prefix on its path. Prefixes are CIDR strings, addresses or
+    parse_prefix tuples; results carry prefixes in CIDR notation.
+    """
+
+    def __init__(self):
+        self._roots = {4: _Node(0, 0), 6: _Node(0, 0)}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, prefix, value):
+        """
+        Store value at a prefix, replacing the previous value.
+        """
+        version, key, length = parse_prefix(prefix)
+        bits = _BITS[version]
+        node = self._roots[version]
+        while True:
+            if node.length == length:
+                if node.value is _MISSING:
+                    self._size += 1
+                node.value = value
+                return
+            bit = (key >> (bits - node.length - 1)) & 1
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _Node(key, length, value)
+                self._size += 1
+                return
+            difference = key ^ child.key
+            common = min(length, child.length)
+            if difference:
+                common = min(common, bits - difference.bit_length())
+            if common == child.length:
+                node = child
+                continue
+            if common == length:
+                leaf = _Node(key, length, value)
+                leaf.children[(child.key >> (bits - length - 1)) & 1] = child
+                node.children[bit] = leaf
+            else:
+                branch = _Node(key >> (bits - common) << (bits - common), common)
+                branch.children[(key >> (bits - common - 1)) & 1] = _Node(key, length, value)
+                branch.children[(child.key >> (bits - common - 1)) & 1] = child
+                node.children[bit] = branch
+            self._size += 1
+            return
+
+    def _path(self, version, key, length):
+        """
+        Yield the nodes whose prefix contains the prefix, shortest first.
+        """
+        bits = _BITS[version]
+        node = self._roots[version]
+        while node is not None and node.length <= length:
+            if (key ^ node.key) >> (bits - node.length):
+                return
+            yield node
+            if node.length == length:
+                return
+            node = node.children[(key >> (bits - node.length - 1)) & 1]
+
+    def get(self, prefix, default=None):
+        """
+        Return the value stored at exactly this prefix.
+        """
+        version, key, length = parse_prefix(prefix)
+        for node in self._path(version, key, length):
+            if node.length == length and node.value is not _MISSING:
+                return node.value
+        return default
+
+    def longest_match(self, prefix):
+        """
+        Return the (prefix, value) of the longest stored prefix containing prefix
+        (an address or a CIDR block), or None.
+        """
+        version, key, length = parse_prefix(prefix)
+        best = None
+        for node in self._path(version, key, length):
+            if node.value is not _MISSING:
+                best = node
+        return None if best is None else (format_prefix((version, best.key, best.length)), best.value)
+
+    def covered(self, prefix):
+        """
+        Yield the (prefix, value) of the stored prefixes inside prefix, itself
+        included, in address order.
+        """
+        version, key, length = parse_prefix(prefix)
+        bits = _BITS[version]
+        node = self._roots[version]
+        while node is not None and node.length < length:
+            if (key ^ node.key) >> (bits - node.length):
+                return
+            node = node.children[(key >> (bits - node.length - 1)) & 1]
+        if node is None or (key ^ node.key) >> (bits - length):
+            return
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.value is not _MISSING:
+                yield format_prefix((version, node.key, node.length)), node.value
+            stack.extend(child for child in reversed(node.children) if child is not None)
+
+    def items(self):
+        """
+        Yield the (prefix, value) of every stored prefix, IPv4 first, in address order.
+        """
+        yield from self.covered((4, 0, 0))
+        yield from self.covered((6, 0, 0))